@@ -5,6 +5,9 @@ class ArangoObjectsViewApp(AppConfig):
     label = 'dogesec_arango_objects_views'
 
     def ready(self) -> None:
-        from .db_view_creator import startup_func
-        startup_func()
+        from . import canonical_latest, derived_fields
+        from .bootstrap import check_bootstrap
+        derived_fields.register_upload_hooks()
+        canonical_latest.register_upload_hooks()
+        check_bootstrap()
         return super().ready()
\ No newline at end of file
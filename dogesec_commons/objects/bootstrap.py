@@ -0,0 +1,218 @@
+"""
+One-shot database setup (database, analyzers, view and links).
+
+`bootstrap()` records a fingerprint of what it set up, including the
+collections it linked, in a system collection, so a process that finds the
+recorded fingerprint current has nothing to do, and concurrent bootstraps
+(several workers starting at once) are serialised by a lock document in the
+same collection. It runs on demand, from `manage.py bootstrap_arangodb`; app
+startup only checks the fingerprint unless `ARANGODB_BOOTSTRAP_ON_READY` is set.
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+
+import arango.exceptions
+from arango.collection import StandardCollection
+from arango.database import StandardDatabase
+
+from . import conf, db_pool, db_view_creator
+
+ERROR_UNIQUE_CONSTRAINT_VIOLATED = 1210
+
+META_COLLECTION = "_dogesec_commons"
+BOOTSTRAP_KEY = "bootstrap"
+LOCK_KEY = "bootstrap_lock"
+# set once data written before `_is_canonical_latest` existed has been marked
+CANONICAL_LATEST_BACKFILL_KEY = "canonical_latest_backfill"
+# set once data written before the derived fields existed has been stamped
+DERIVED_FIELDS_BACKFILL_KEY = "derived_fields_backfill"
+BACKFILL_KEYS = [CANONICAL_LATEST_BACKFILL_KEY, DERIVED_FIELDS_BACKFILL_KEY]
+
+
+class LockNotAcquired(Exception):
+    pass
+
+
+def get_collection_names(db: StandardDatabase):
+    """Collections `setup_database()` links to the view"""
+    return sorted(c["name"] for c in db.collections() if not c["system"])
+
+
+def get_bootstrap_version(db: StandardDatabase):
+    data = json.dumps(
+        [
+            # a collection created since the last bootstrap is not linked yet
+            get_collection_names(db),
+            db_view_creator.fingerprint_view(
+                db_view_creator.make_view_spec(),
+                db_view_creator.IMMUTABLE_VIEW_PROPERTIES
+                + db_view_creator.MUTABLE_VIEW_PROPERTIES,
+            ),
+            db_view_creator.make_link(),
+            db_view_creator.ANALYZERS,
+            conf.VIEW_BACKEND,
+            db_view_creator.make_inverted_index(),
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_meta_collection(db: StandardDatabase) -> StandardCollection:
+    if not db.has_collection(META_COLLECTION):
+        try:
+            db.create_collection(META_COLLECTION, system=True)
+        except arango.exceptions.CollectionCreateError as e:
+            # another process created it first
+            logging.info(e)
+    return db.collection(META_COLLECTION)
+
+
+def get_recorded_version(db: StandardDatabase):
+    try:
+        if not db.has_collection(META_COLLECTION):
+            return None
+        doc = db.collection(META_COLLECTION).get(BOOTSTRAP_KEY) or {}
+    except arango.exceptions.ArangoServerError:
+        # e.g. the database does not exist yet
+        return None
+    return doc.get("version")
+
+
+def is_bootstrapped(db: StandardDatabase, version):
+    """True when `version` is recorded and every backfill has run"""
+    if get_recorded_version(db) != version:
+        return False
+    # the fingerprint of a database bootstrapped before a backfill existed is current
+    meta = db.collection(META_COLLECTION)
+    return all(meta.get(key) for key in BACKFILL_KEYS)
+
+
+@contextlib.contextmanager
+def document_lock(collection: StandardCollection, key, ttl, wait=True, timeout=None):
+    """
+    Hold the document `key` in `collection` for the duration of the block.
+
+    A lock left by a process that died is taken over once it is `ttl` seconds
+    old. Raises `LockNotAcquired` when `wait` is false or `timeout` runs out.
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4()}"
+    deadline = timeout and time.time() + timeout
+    while True:
+        try:
+            collection.insert(dict(_key=key, owner=owner, expires_at=time.time() + ttl))
+            break
+        except arango.exceptions.DocumentInsertError as e:
+            if e.error_code != ERROR_UNIQUE_CONSTRAINT_VIOLATED:
+                raise
+            current = collection.get(key)
+            if current and current["expires_at"] < time.time():
+                logging.warning(
+                    "taking over stale lock %s of %s", key, current["owner"]
+                )
+                with contextlib.suppress(arango.exceptions.ArangoServerError):
+                    collection.delete(current, check_rev=True)
+                continue
+            if not wait or (deadline and time.time() > deadline):
+                raise LockNotAcquired(
+                    f"{key} is held by {current and current['owner']}"
+                )
+            time.sleep(1)
+    try:
+        yield owner
+    finally:
+        current = collection.get(key)
+        if current and current["owner"] == owner:
+            with contextlib.suppress(arango.exceptions.ArangoServerError):
+                collection.delete(current, check_rev=True)
+
+
+def backfill_canonical_latest(db: StandardDatabase, meta: StandardCollection):
+    """Mark the objects uploaded before `_is_canonical_latest`, once per database"""
+    # canonical_latest reaches this module through helpers and result_cache
+    from . import canonical_latest
+
+    if meta.get(CANONICAL_LATEST_BACKFILL_KEY):
+        return
+    updated = canonical_latest.backfill(db)
+    logging.info("marked canonical latest versions: %s", updated)
+    meta.insert(
+        dict(_key=CANONICAL_LATEST_BACKFILL_KEY, completed_at=time.time()),
+        overwrite=True,
+    )
+
+
+def backfill_derived_fields(db: StandardDatabase, meta: StandardCollection):
+    """Stamp the derived fields on the objects uploaded before them, once per database"""
+    # derived_fields reaches this module through helpers and result_cache
+    from . import derived_fields
+
+    if meta.get(DERIVED_FIELDS_BACKFILL_KEY):
+        return
+    updated = derived_fields.backfill(db)
+    logging.info("stamped derived fields: %s", updated)
+    meta.insert(
+        dict(_key=DERIVED_FIELDS_BACKFILL_KEY, completed_at=time.time()),
+        overwrite=True,
+    )
+
+
+def bootstrap(force=False, wait=True, timeout=None):
+    """
+    Set up the database, analyzers, view and links if they are not current, and
+    the first time mark the canonical latest versions of existing objects and
+    stamp their derived fields.
+
+    Returns True when this call did the work.
+    """
+    client = db_pool.get_client()
+    sys_db = db_pool.get_database("_system")
+    db = db_view_creator.create_database(client, sys_db, conf.DB_NAME)
+    version = get_bootstrap_version(db)
+    if not force and is_bootstrapped(db, version):
+        return False
+
+    meta = get_meta_collection(db)
+    with document_lock(
+        meta, LOCK_KEY, conf.BOOTSTRAP_LOCK_TTL, wait=wait, timeout=timeout
+    ):
+        if not force and is_bootstrapped(db, version):
+            # done by whoever held the lock before us
+            return False
+        db_view_creator.setup_database(db)
+        backfill_canonical_latest(db, meta)
+        backfill_derived_fields(db, meta)
+        meta.insert(
+            dict(_key=BOOTSTRAP_KEY, version=version, completed_at=time.time()),
+            overwrite=True,
+        )
+    return True
+
+
+def check_bootstrap():
+    """
+    Cheap check run when the app loads. Warns when the setup is outdated, or with
+    `BOOTSTRAP_ON_READY` bootstraps if nothing else is doing it.
+    """
+    try:
+        db = db_pool.get_database()
+        if get_recorded_version(db) and is_bootstrapped(db, get_bootstrap_version(db)):
+            return
+        if not conf.BOOTSTRAP_ON_READY:
+            logging.warning(
+                "database %s is not bootstrapped, has collections not linked to the view or objects without derived fields, run `manage.py bootstrap_arangodb`",
+                conf.DB_NAME,
+            )
+            return
+        bootstrap(wait=False)
+    except LockNotAcquired as e:
+        logging.info("bootstrap running in another process: %s", e)
+    except Exception as e:
+        logging.exception(e)
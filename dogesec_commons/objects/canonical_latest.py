@@ -0,0 +1,132 @@
+"""
+`_is_canonical_latest` marks the one document per STIX id the list endpoints return.
+
+stix2arango keeps `_is_latest` per collection, so an object uploaded to several
+collections has a latest version in each of them, and the list queries used to
+collapse them with `COLLECT id = doc.id INTO docs`, holding every version in
+memory. The marker is recomputed for the ids that were written after each
+stix2arango upload (a post-upload hook), knowledge base sync and report object
+deletion, reading the versions from the primary index of every stix2arango
+collection so that collections not linked to the view yet are covered too.
+Existing data is marked by `bootstrap()` the first time it runs, or by the
+`backfill_canonical_latest` management command.
+"""
+
+import itertools
+from collections import defaultdict
+
+from arango.database import StandardDatabase
+from stix2arango.stix2arango import Stix2Arango
+
+from . import conf, helpers
+
+CANONICAL_LATEST_FIELD = "_is_canonical_latest"
+
+# versions of `stix_id` in one collection, by `_key` range like helpers.get_objects_by_key()
+VERSIONS_SUBQUERY = """(
+                FOR doc IN @@collection_{i}
+                    FILTER doc._key >= CONCAT(stix_id, @key_start) AND doc._key < CONCAT(stix_id, @key_end)
+                    FILTER doc._is_latest == TRUE OR doc._is_canonical_latest == TRUE
+                    RETURN KEEP(doc, "_id", "_is_latest", "_is_canonical_latest", "modified", "created", "_record_modified")
+            )"""
+
+# the newest `_is_latest` version wins, the `_id` only breaks ties
+CANONICAL_CHANGES_QUERY = """
+    FOR stix_id IN @ids
+        LET docs = FLATTEN([#versions])
+        LET canonical = FIRST(
+            FOR d IN docs
+                FILTER d._is_latest == TRUE
+                SORT d.modified OR d.created DESC, d._record_modified DESC, d._id DESC
+                RETURN d._id
+        )
+        FOR d IN docs
+            FILTER (d._id == canonical) != (d._is_canonical_latest == TRUE)
+            RETURN [d._id, d._id == canonical]
+"""
+
+
+def get_canonical_changes(db: StandardDatabase, stix_ids, collection_names):
+    """`[_id, is_canonical]` of every document of `stix_ids` whose marker is wrong"""
+    if not collection_names:
+        return []
+    bind_vars = {
+        "ids": list(stix_ids),
+        "key_start": helpers.KEY_SEPARATOR,
+        "key_end": helpers.KEY_SEPARATOR_END,
+    }
+    versions = []
+    for i, collection_name in enumerate(collection_names):
+        bind_vars[f"@collection_{i}"] = collection_name
+        versions.append(VERSIONS_SUBQUERY.format(i=i))
+    query = CANONICAL_CHANGES_QUERY.replace("#versions", ", ".join(versions))
+    return list(db.aql.execute(query, bind_vars=bind_vars))
+
+
+def update_canonical_latest(
+    db: StandardDatabase, stix_ids, collection_names=None, batch_size=1000
+):
+    """
+    Recompute the marker of `stix_ids` across `collection_names`, every
+    stix2arango collection of `db` by default
+    """
+    if collection_names is None:
+        # listed again, a collection created since the cached list may hold a version
+        collection_names = helpers.get_stix_collections(db, refresh=True)
+    updated = 0
+    stix_ids = iter(set(stix_ids))
+    while batch := list(itertools.islice(stix_ids, batch_size)):
+        changes = defaultdict(list)
+        for doc_id, is_canonical in get_canonical_changes(db, batch, collection_names):
+            collection_name, _, key = doc_id.partition("/")
+            changes[collection_name].append(
+                {"_key": key, CANONICAL_LATEST_FIELD: is_canonical}
+            )
+        for collection_name, docs in changes.items():
+            db.collection(collection_name).update_many(docs, merge=False, silent=True)
+            updated += len(docs)
+    return updated
+
+
+def post_upload_hook(instance: Stix2Arango, collection_name, objects, **kwargs):
+    db = instance.arango.db
+    if db.name != conf.DB_NAME:
+        # the list endpoints only read this app's database
+        return
+    update_canonical_latest(db, [obj["id"] for obj in objects])
+
+
+def register_upload_hooks():
+    """Recompute the marker after everything uploaded through stix2arango in this process"""
+    hooks = [hook for hook, _ in Stix2Arango._post_upload_hooks]
+    if post_upload_hook not in hooks:
+        Stix2Arango.register_post_upload_hook(post_upload_hook)
+
+
+def backfill_collection(
+    db: StandardDatabase, collection_name, collection_names=None, batch_size=1000
+):
+    """Recompute the marker of every STIX id in `collection_name`"""
+    if collection_names is None:
+        collection_names = helpers.get_stix_collections(db, refresh=True)
+    cursor = db.aql.execute(
+        "FOR doc IN @@collection FILTER doc._is_latest == TRUE OR doc._is_canonical_latest == TRUE RETURN doc.id",
+        bind_vars={"@collection": collection_name},
+        stream=True,
+        batch_size=batch_size,
+    )
+    updated = 0
+    while batch := list(itertools.islice(cursor, batch_size)):
+        updated += update_canonical_latest(db, batch, collection_names, batch_size)
+    return updated
+
+
+def backfill(db: StandardDatabase, collection_names=None, batch_size=1000):
+    """Recompute the marker of every STIX id in `collection_names` (default: every stix2arango collection)"""
+    all_collections = helpers.get_stix_collections(db, refresh=True)
+    updated = {}
+    for collection_name in collection_names or all_collections:
+        updated[collection_name] = backfill_collection(
+            db, collection_name, all_collections, batch_size
+        )
+    return updated
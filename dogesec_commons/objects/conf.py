@@ -5,4 +5,128 @@ DEFAULT_PAGE_SIZE = getattr(settings, 'DEFAULT_PAGE_SIZE', 50)
 
 DB = settings.ARANGODB_DATABASE
 DB_NAME = f"{DB}_database"
-ARANGODB_DATABASE_VIEW = getattr(settings, "ARANGODB_DATABASE_VIEW", f"{DB}_view")
\ No newline at end of file
+ARANGODB_DATABASE_VIEW = getattr(settings, "ARANGODB_DATABASE_VIEW", f"{DB}_view")
+
+# how `total_results_count` is computed for paginated queries: exact | estimate | none
+COUNT_MODES = ["exact", "estimate", "none"]
+DEFAULT_COUNT_MODE = getattr(settings, "DEFAULT_COUNT_MODE", "exact")
+COUNT_ESTIMATE_TTL = getattr(settings, "COUNT_ESTIMATE_TTL", 300)
+COUNT_ESTIMATE_CACHE = getattr(settings, "COUNT_ESTIMATE_CACHE", "default")
+
+# guards passed to every AQL query, override them for a single endpoint (`scos`,
+# `smos`, `sdos`, `sros`, `object`, `retrieve`, `bundle`, `resolve`, `export`) with
+# ARANGODB_QUERY_LIMITS, e.g. {"bundle": {"memory_limit": 2**30}}
+DEFAULT_QUERY_LIMITS = dict(
+    max_runtime=getattr(settings, "ARANGODB_QUERY_MAX_RUNTIME", 30),
+    memory_limit=getattr(settings, "ARANGODB_QUERY_MEMORY_LIMIT", 0),
+    fail_on_warning=getattr(settings, "ARANGODB_QUERY_FAIL_ON_WARNING", False),
+)
+
+# per endpoint defaults, never above ARANGODB_QUERY_MAX_RUNTIME (0, no limit, stays 0)
+_MAX_RUNTIME = DEFAULT_QUERY_LIMITS["max_runtime"]
+ENDPOINT_QUERY_LIMITS = {
+    # answered from the primary index or a handful of term lookups
+    "object": dict(max_runtime=min(_MAX_RUNTIME, 5)),
+    "retrieve": dict(max_runtime=min(_MAX_RUNTIME, 10)),
+    "resolve": dict(max_runtime=min(_MAX_RUNTIME, 10)),
+    # paginated SEARCH over the view
+    "smos": dict(max_runtime=min(_MAX_RUNTIME, 10)),
+    "sdos": dict(max_runtime=min(_MAX_RUNTIME, 20)),
+    "sros": dict(max_runtime=min(_MAX_RUNTIME, 20)),
+    # value searches may run LIKE over many documents, traversals may fan out
+    "scos": dict(max_runtime=min(_MAX_RUNTIME, 30)),
+    "bundle": dict(max_runtime=min(_MAX_RUNTIME, 30)),
+    # exports stay open for as long as the client keeps reading, `ttl` bounds them
+    "export": dict(max_runtime=0),
+}
+QUERY_LIMITS = {
+    name: {**ENDPOINT_QUERY_LIMITS.get(name, {}), **limits}
+    for name, limits in {
+        **ENDPOINT_QUERY_LIMITS,
+        **getattr(settings, "ARANGODB_QUERY_LIMITS", {}),
+    }.items()
+}
+
+# streaming exports (`/export/` on the objects list endpoints)
+EXPORT_FORMATS = ["ndjson", "bundle"]
+EXPORT_BATCH_SIZE = getattr(settings, "EXPORT_BATCH_SIZE", 1000)
+EXPORT_CURSOR_TTL = getattr(settings, "EXPORT_CURSOR_TTL", 300)
+EXPORT_MAXIMUM_OBJECTS = getattr(settings, "EXPORT_MAXIMUM_OBJECTS", 10_000_000)
+
+# shared ArangoDB connections (see db_pool.py)
+ARANGODB_REQUEST_TIMEOUT = getattr(settings, "ARANGODB_REQUEST_TIMEOUT", 60)
+ARANGODB_POOL_CONNECTIONS = getattr(settings, "ARANGODB_POOL_CONNECTIONS", 10)
+ARANGODB_POOL_MAXSIZE = getattr(settings, "ARANGODB_POOL_MAXSIZE", 20)
+ARANGODB_POOL_TIMEOUT = getattr(settings, "ARANGODB_POOL_TIMEOUT", None)
+ARANGODB_KEEP_ALIVE = getattr(settings, "ARANGODB_KEEP_ALIVE", True)
+
+# AQL execution statistics (see query_stats.py)
+QUERY_STATS_ENABLED = getattr(settings, "QUERY_STATS_ENABLED", True)
+QUERY_STATS_SERVER_TIMING = getattr(settings, "QUERY_STATS_SERVER_TIMING", False)
+SLOW_QUERY_THRESHOLD = getattr(settings, "SLOW_QUERY_THRESHOLD", 1.0)  # seconds
+# serve the statistics to staff users (and QUERY_METRICS_TOKEN holders) at
+# `metrics/aql/`. Counters are per process, each worker reports its own
+QUERY_METRICS_ENDPOINT = getattr(settings, "QUERY_METRICS_ENDPOINT", False)
+# lets scrapers without a session in with `Authorization: Bearer <token>`
+QUERY_METRICS_TOKEN = getattr(settings, "QUERY_METRICS_TOKEN", None)
+
+# most external IDs accepted by one `/objects/sdos/resolve/` request
+MAXIMUM_RESOLVE_IDS = getattr(settings, "MAXIMUM_RESOLVE_IDS", 1000)
+# most STIX IDs accepted by one `/objects/retrieve/` request
+MAXIMUM_RETRIEVE_IDS = getattr(settings, "MAXIMUM_RETRIEVE_IDS", 5000)
+
+# read single objects by `_key` prefix from the stix2arango collections before
+# searching the view, and how long the list of those collections is reused for
+OBJECT_KEY_LOOKUP = getattr(settings, "OBJECT_KEY_LOOKUP", True)
+STIX_COLLECTIONS_CACHE_TTL = getattr(settings, "STIX_COLLECTIONS_CACHE_TTL", 300)
+
+# cache of list and by-id query results (see result_cache.py): "lru", "django",
+# the dotted path of a backend class, or None to disable. Writers invalidate it
+# by bumping the data generation, which readers re-read every GENERATION_TTL seconds
+RESULT_CACHE_BACKEND = getattr(settings, "RESULT_CACHE_BACKEND", None)
+# keyword arguments of the backend, `max_entries` for lru, `alias` for django
+RESULT_CACHE_OPTIONS = getattr(settings, "RESULT_CACHE_OPTIONS", {})
+RESULT_CACHE_TTL = getattr(settings, "RESULT_CACHE_TTL", 300)
+RESULT_CACHE_GENERATION_TTL = getattr(settings, "RESULT_CACHE_GENERATION_TTL", 1)
+# `query_name`s whose results are cached, see QUERY_LIMITS
+RESULT_CACHE_QUERIES = getattr(
+    settings,
+    "RESULT_CACHE_QUERIES",
+    ["scos", "smos", "sdos", "sros", "object", "retrieve", "bundle", "resolve"],
+)
+
+# deepest `depth` accepted by the object bundle endpoint
+BUNDLE_MAXIMUM_DEPTH = getattr(settings, "BUNDLE_MAXIMUM_DEPTH", 3)
+
+# check n-gram postings before running LIKE for SCO `value` searches
+SCO_SEARCH_NGRAM_PREFILTER = getattr(settings, "SCO_SEARCH_NGRAM_PREFILTER", True)
+
+# database setup, see bootstrap.py and `manage.py bootstrap_arangodb`. App startup
+# only warns when the setup is outdated, unless BOOTSTRAP_ON_READY
+BOOTSTRAP_ON_READY = getattr(settings, "ARANGODB_BOOTSTRAP_ON_READY", False)
+BOOTSTRAP_LOCK_TTL = getattr(settings, "ARANGODB_BOOTSTRAP_LOCK_TTL", 600)
+
+# seconds a collection seen linked to the view is trusted to still be linked, 0 disables
+VIEW_LINK_CACHE_TTL = getattr(settings, "ARANGODB_VIEW_LINK_CACHE_TTL", 300)
+
+# the list sort the view keeps its documents in (a `sort` value of the list endpoints),
+# only this sort is streamed from the view, changing it recreates the view. Unset by
+# default: set it to the sort of the listing requested most, e.g. "name_ascending"
+# when clients mostly page through /objects/sdos/ with its default sort. Every write
+# pays for keeping the order, which no other sort benefits from
+VIEW_PRIMARY_SORT = getattr(settings, "ARANGODB_VIEW_PRIMARY_SORT", None)
+
+# ArangoSearch view tunables, None keeps ArangoDB's default. primarySortCompression
+# and writebufferSizeMax can only be set on creation, changing them recreates the view
+VIEW_COMMIT_INTERVAL_MSEC = getattr(settings, "ARANGODB_VIEW_COMMIT_INTERVAL_MSEC", None)
+VIEW_CONSOLIDATION_INTERVAL_MSEC = getattr(settings, "ARANGODB_VIEW_CONSOLIDATION_INTERVAL_MSEC", None)
+VIEW_CLEANUP_INTERVAL_STEP = getattr(settings, "ARANGODB_VIEW_CLEANUP_INTERVAL_STEP", None)
+VIEW_CONSOLIDATION_POLICY = getattr(settings, "ARANGODB_VIEW_CONSOLIDATION_POLICY", None)
+VIEW_PRIMARY_SORT_COMPRESSION = getattr(settings, "ARANGODB_VIEW_PRIMARY_SORT_COMPRESSION", None)
+VIEW_WRITEBUFFER_SIZE_MAX = getattr(settings, "ARANGODB_VIEW_WRITEBUFFER_SIZE_MAX", None)
+# build new links without blocking writes to the collection
+VIEW_LINK_IN_BACKGROUND = getattr(settings, "ARANGODB_VIEW_LINK_IN_BACKGROUND", False)
+
+# "arangosearch": one view linking every collection with all of its attributes indexed
+# "search-alias": a view over per-collection inverted indexes of only the searched fields
+VIEW_BACKEND = getattr(settings, "ARANGODB_VIEW_BACKEND", "arangosearch")
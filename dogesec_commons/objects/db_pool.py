@@ -0,0 +1,96 @@
+"""
+Process-wide registry of ArangoDB clients and database handles.
+
+Building an `ArangoClient` opens its HTTP sessions and `client.db()` builds a
+new connection object on every call, so both are created once per process,
+keyed by host and by (host, database, username), and shared by every thread.
+A forked child starts with an empty registry and a fresh lock (see
+`os.register_at_fork`), so pre-fork servers (gunicorn, uvicorn workers) never
+share sockets with their parent.
+"""
+
+import os
+import threading
+
+from arango import ArangoClient
+from arango.database import StandardDatabase
+from arango.http import DefaultHTTPClient
+from django.conf import settings
+
+from . import conf
+
+_lock = threading.Lock()
+_clients: dict[str, ArangoClient] = {}
+_databases: dict[tuple[str, str, str], StandardDatabase] = {}
+
+
+class PooledHTTPClient(DefaultHTTPClient):
+    def __init__(self, keep_alive=True, **kwargs):
+        super().__init__(**kwargs)
+        self.keep_alive = keep_alive
+
+    def create_session(self, host):
+        session = super().create_session(host)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+
+def make_http_client():
+    return PooledHTTPClient(
+        keep_alive=conf.ARANGODB_KEEP_ALIVE,
+        request_timeout=conf.ARANGODB_REQUEST_TIMEOUT,
+        pool_connections=conf.ARANGODB_POOL_CONNECTIONS,
+        pool_maxsize=conf.ARANGODB_POOL_MAXSIZE,
+        pool_timeout=conf.ARANGODB_POOL_TIMEOUT,
+    )
+
+
+def _reset_after_fork():
+    global _lock
+    # handles inherited from the parent share its sockets, and the lock may have
+    # been held by a parent thread that does not exist in the child
+    _lock = threading.Lock()
+    _clients.clear()
+    _databases.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(host=None) -> ArangoClient:
+    host = host or settings.ARANGODB_HOST_URL
+    with _lock:
+        if host not in _clients:
+            _clients[host] = ArangoClient(
+                hosts=host,
+                http_client=make_http_client(),
+                request_timeout=conf.ARANGODB_REQUEST_TIMEOUT,
+            )
+        return _clients[host]
+
+
+def get_database(
+    db_name=None, username=None, password=None, host=None
+) -> StandardDatabase:
+    host = host or settings.ARANGODB_HOST_URL
+    db_name = db_name or conf.DB_NAME
+    if username is None:
+        username, password = settings.ARANGODB_USERNAME, settings.ARANGODB_PASSWORD
+    key = (host, db_name, username)
+    client = get_client(host)
+    with _lock:
+        if key not in _databases:
+            # no request is sent here, the handle is only built
+            _databases[key] = client.db(db_name, username=username, password=password)
+        return _databases[key]
+
+
+def reset():
+    """Close and forget every pooled handle, e.g. after credentials change."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _databases.clear()
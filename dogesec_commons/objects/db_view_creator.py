@@ -1,11 +1,15 @@
+import hashlib
+import json
 import logging
+import threading
+import time
 
 import arango
 import arango.exceptions
 from arango.database import StandardDatabase
 from arango import ArangoClient
 
-from dogesec_commons.objects import conf
+from dogesec_commons.objects import conf, db_pool
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,6 +18,7 @@ logging.basicConfig(
 )
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 
 SORT_FIELDS = [
@@ -44,46 +49,226 @@ FILTER_FIELDS_EDGE = [
     "target_ref",
     "relationship_type",
 ]
+# stamped on upload by derived_fields.py
+FILTER_DERIVED_FIELDS = ["_ttp_source", "_attack_form", "_external_id", "_visibility"]
+# stamped by stixifier and obstracts on the objects of a report / post
+FILTER_SCOPE_FIELDS = ["_stixify_report_id", "_obstracts_post_id"]
 FILTER_SCO_FIELDS = ['value', 'path', 'subject', 'number', 'pid', 'string', 'key', 'iban_number', 'payload_bin', 'hash', 'display_name', 'protocols', 'name', 'body']
 FILTER_FIELDS = list(set(FILTER_FIELDS_EDGE + FILTER_FIELDS_VERTEX))
 
+# fields searched by the SCO `value` filter
+SCO_SEARCH_FIELDS = [
+    "value",  # ipv4-addr, ipv6-addr, mutex, url, domain-name, etc
+    "name",  # file, software
+    "number",  # autonomous-system
+    "path",  # directory
+    "body",  # email-message
+    "subject",  # x509-certificate
+    "key",  # windows-registry-key
+    "display_name",  # user-account
+    "string",  # user-agent
+    "payload_bin",  # artifact
+    "protocols",  # network-traffic
+    "command_line",  # process
+    "cpe",  # software
+    "iban",  # bank-account
+    "account_number",  # bank-account
+    "bic",  # bank-account
+]
+
+# attributes the helpers use in SEARCH expressions, the only ones indexed by the
+# search-alias backend (the arangosearch view indexes every attribute)
+SEARCH_ALIAS_FIELDS = [
+    "id",
+    "type",
+    # ranged by list cursors
+    "created",
+    "modified",
+    "_is_latest",
+    "_is_canonical_latest",
+    "_is_ref",
+    "_from",
+    "_to",
+    "labels",
+    "source_ref",
+    "target_ref",
+    "relationship_type",
+    "_source_type",
+    "_target_type",
+    "_stix2arango_note",
+    *FILTER_DERIVED_FIELDS,
+    *FILTER_SCOPE_FIELDS,
+]
+
+# `ARANGODB_VIEW_BACKEND` values
+ARANGOSEARCH = "arangosearch"
+SEARCH_ALIAS = "search-alias"
+INVERTED_INDEX_PREFIX = "dogesec_search_"
+
+# case-folded copy of a field, for case insensitive `==` and LIKE in SEARCH
+NORM_ANALYZER = "dogesec_norm"
+# trigrams of the case-folded field, for NGRAM_MATCH
+NGRAM_ANALYZER = "dogesec_ngram"
+NORM_PROPERTIES = {"locale": "en", "case": "lower", "accent": True}
+ANALYZERS = [
+    dict(
+        name=NORM_ANALYZER,
+        analyzer_type="norm",
+        properties=NORM_PROPERTIES,
+        features=[],
+    ),
+    dict(
+        name=NGRAM_ANALYZER,
+        analyzer_type="pipeline",
+        properties={
+            "pipeline": [
+                {"type": "norm", "properties": NORM_PROPERTIES},
+                {
+                    "type": "ngram",
+                    "properties": {
+                        "min": 3,
+                        "max": 3,
+                        "preserveOriginal": False,
+                        "streamType": "utf8",
+                    },
+                },
+            ]
+        },
+        features=["frequency", "norm", "position"],
+    ),
+]
+
 
 def create_database(client: ArangoClient, sys_db: StandardDatabase, db_name):
-    logging.info(f"creating database {db_name}")
-    try:
-        sys_db.create_database(db_name)
-    except arango.exceptions.DatabaseCreateError as e:
-        logging.error(e)
+    if not sys_db.has_database(db_name):
+        logging.info(f"creating database {db_name}")
+        try:
+            sys_db.create_database(db_name)
+        except arango.exceptions.DatabaseCreateError as e:
+            logging.error(e)
     return client.db(
         name=db_name, username=settings.ARANGODB_USERNAME, password=settings.ARANGODB_PASSWORD, verify=True
     )
 
 
-def create_view(db: StandardDatabase, view_name, sort_fields=SORT_FIELDS, filter_fields=[SORT_FIELDS, FILTER_FIELDS_VERTEX, FILTER_FIELDS_EDGE, FILTER_HIDDEN_FIELDS, FILTER_SCO_FIELDS]):
-    logging.info(f"creating view {view_name} in {db.name}")
-    primary_sort = []
-    for field in sort_fields:
-        primary_sort.append(dict(field=field, direction="asc"))
-        primary_sort.append(dict(field=field, direction="desc"))
+def get_primary_sort(sort_option=None):
+    """
+    primarySort in the order `ArangoDBHelper.get_seek_sort_stmt()` sorts by for
+    `sort_option` (e.g. `modified_descending`: modified, then id), so list
+    queries using that sort read the view in order and stop at their LIMIT.
+    A view has a single primary sort, any other sort is done in memory.
+    Empty when no sort is configured.
+    """
+    sort_option = sort_option or conf.VIEW_PRIMARY_SORT
+    if not sort_option:
+        return []
+    field, _, direction = sort_option.rpartition("_")
+    direction = {"ascending": "asc", "descending": "desc"}.get(direction)
+    if not field or not direction:
+        raise ImproperlyConfigured(f"invalid view primary sort: {sort_option}")
+    key_fields = ["id"] if field == "id" else [field, "id"]
+    return [dict(field=f, direction=direction) for f in key_fields]
+
 
+def make_view_spec(sort_fields=SORT_FIELDS, filter_fields=[SORT_FIELDS, FILTER_FIELDS_VERTEX, FILTER_FIELDS_EDGE, FILTER_HIDDEN_FIELDS, FILTER_SCO_FIELDS, FILTER_DERIVED_FIELDS], primary_sort=None):
     all_fields = [*filter_fields, sort_fields]
+    return {
+        "primarySort": get_primary_sort(primary_sort),
+        "storedValues": [{"fields": fields} for fields in all_fields],
+        **get_view_properties(),
+    }
 
-    try:
+
+def get_view_properties():
+    """ArangoSearch tunables set in settings, the ones left unset keep ArangoDB's defaults"""
+    properties = {
+        "commitIntervalMsec": conf.VIEW_COMMIT_INTERVAL_MSEC,
+        "consolidationIntervalMsec": conf.VIEW_CONSOLIDATION_INTERVAL_MSEC,
+        "cleanupIntervalStep": conf.VIEW_CLEANUP_INTERVAL_STEP,
+        "consolidationPolicy": conf.VIEW_CONSOLIDATION_POLICY,
+        "primarySortCompression": conf.VIEW_PRIMARY_SORT_COMPRESSION,
+        "writebufferSizeMax": conf.VIEW_WRITEBUFFER_SIZE_MAX,
+    }
+    return {k: v for k, v in properties.items() if v is not None}
+
+
+def create_view(db: StandardDatabase, view_name, sort_fields=SORT_FIELDS, filter_fields=[SORT_FIELDS, FILTER_FIELDS_VERTEX, FILTER_FIELDS_EDGE, FILTER_HIDDEN_FIELDS, FILTER_SCO_FIELDS, FILTER_DERIVED_FIELDS]):
+    if conf.VIEW_BACKEND == SEARCH_ALIAS:
+        return create_search_alias_view(db, view_name)
+    logging.info(f"creating view {view_name} in {db.name}")
+    spec = make_view_spec(sort_fields, filter_fields)
+
+    if db.has_view(view_name):
         logging.info("try updating view (%s) if exists", view_name)
-        return update_view(db, all_fields, view_name)
-    except BaseException as e:
-        logging.info(f"view update not possible: {e}")
+        view = update_view(db, spec, view_name)
+        if view:
+            return view
 
     try:
         logging.info("create new view: %s", view_name)
-        return db.create_arangosearch_view(
-            view_name, {"primarySort": primary_sort, "storedValues": all_fields}
-        )
+        return db.create_arangosearch_view(view_name, spec)
     except arango.exceptions.ViewCreateError as e:
         logging.error(e)
     return db.view(view_name)
 
 
+def is_subset(spec, current):
+    if isinstance(spec, dict):
+        return isinstance(current, dict) and all(
+            is_subset(v, current.get(k)) for k, v in spec.items()
+        )
+    if isinstance(spec, list):
+        return (
+            isinstance(current, list)
+            and len(spec) == len(current)
+            and all(is_subset(a, b) for a, b in zip(spec, current))
+        )
+    return spec == current
+
+
+def analyzer_matches(current: dict, analyzer: dict):
+    # ArangoDB fills in defaults, so only the properties we set are compared
+    return (
+        current.get("type") == analyzer["analyzer_type"]
+        and sorted(current.get("features") or []) == sorted(analyzer["features"])
+        and is_subset(analyzer["properties"], current.get("properties") or {})
+    )
+
+
+def create_analyzers(db: StandardDatabase):
+    existing = {strip_analyzer_prefix(a["name"]): a for a in db.analyzers()}
+    for analyzer in ANALYZERS:
+        current = existing.get(analyzer["name"])
+        if current and analyzer_matches(current, analyzer):
+            continue
+        if current:
+            # analyzers cannot be changed while views use them
+            logging.error(
+                "analyzer %s exists with a different definition, give the new definition a new name",
+                analyzer["name"],
+            )
+            continue
+        try:
+            db.create_analyzer(**analyzer)
+        except arango.exceptions.AnalyzerCreateError as e:
+            logging.error(e)
+
+
+def make_link():
+    link = dict(
+        includeAllFields=True,
+        storeValues="id",
+        fields={
+            field: dict(analyzers=["identity", NORM_ANALYZER, NGRAM_ANALYZER])
+            for field in SCO_SEARCH_FIELDS
+        },
+    )
+    if conf.VIEW_LINK_IN_BACKGROUND:
+        # index existing documents without locking the collection for writes
+        link["inBackground"] = True
+    return link
+
+
 def get_link_properties(collection_name: str):
     if collection_name.endswith("_vertex_collection"):
         return {
@@ -97,68 +282,347 @@ def get_link_properties(collection_name: str):
         return None
 
 
+# (database, view, collection) -> time the link stops being trusted
+_linked_collections: dict[tuple[str, str, str], float] = {}
+_linked_collections_lock = threading.Lock()
+
+
+def is_link_cached(db: StandardDatabase, view_name, collection_name):
+    with _linked_collections_lock:
+        expires_at = _linked_collections.get((db.name, view_name, collection_name))
+    return expires_at is not None and expires_at > time.monotonic()
+
+
+def cache_links(db: StandardDatabase, view_name, collection_names):
+    if conf.VIEW_LINK_CACHE_TTL <= 0:
+        return
+    expires_at = time.monotonic() + conf.VIEW_LINK_CACHE_TTL
+    with _linked_collections_lock:
+        for collection_name in collection_names:
+            _linked_collections[(db.name, view_name, collection_name)] = expires_at
+
+
+def forget_links(view_name=None):
+    with _linked_collections_lock:
+        for key in list(_linked_collections):
+            if view_name is None or key[1] == view_name:
+                del _linked_collections[key]
+
+
 def link_one_collection(db: StandardDatabase, view_name, collection_name):
-    logging.info(f"linking collection {collection_name} to {view_name}")
+    """
+    Link `collection_name` to the view unless it already is.
+
+    Collections seen linked are remembered for `VIEW_LINK_CACHE_TTL` seconds, so
+    repeated uploads to the same collection do not fetch the view every time.
+    """
+    if is_link_cached(db, view_name, collection_name):
+        return
+    if conf.VIEW_BACKEND == SEARCH_ALIAS:
+        link_search_alias_view(db, view_name, [collection_name])
+        return
     view = db.view(view_name)
-    link = dict(includeAllFields=True, storeValues='id')
-    if link and collection_name:
-        view["links"][collection_name] = link
-    v = db.update_arangosearch_view(view_name, view)
-    logging.info(f"linked collection {collection_name} to {view_name}")
+    link = make_link()
+    if normalize_link(view["links"].get(collection_name, {})) != normalize_link(link):
+        logging.info(f"linking collection {collection_name} to {view_name}")
+        db.update_arangosearch_view(view_name, {"links": {collection_name: link}})
+        logging.info(f"linked collection {collection_name} to {view_name}")
+    cache_links(db, view_name, [collection_name])
 
 
-def update_view(db: StandardDatabase, filter_fields, view_name) -> bool:
-    view = db.view(view_name)
-    view_fields = [sv['fields'] for sv in view['stored_values']]
-    def hash_fields(fields: list[list[str]]) -> set[str]:
-        hashes = set()
-        for ff in fields:
-            hash_val = 0
-            for f in set(ff):
-                hash_val += hash(f)
-            hashes.add(hash_val)
-        return hashes
-    view_hash = hash_fields(view_fields)
-    fields_hash = hash_fields(filter_fields)
-    
-    if view_hash == fields_hash:
-        return view
-    
-    logging.info("old hash does not match new hash, updating...")
+# view properties ArangoDB only accepts when the view is created
+IMMUTABLE_VIEW_PROPERTIES = [
+    "primarySort",
+    "storedValues",
+    "primarySortCompression",
+    "writebufferSizeMax",
+]
+# view properties that can be changed on an existing view, links aside
+MUTABLE_VIEW_PROPERTIES = [
+    "commitIntervalMsec",
+    "consolidationIntervalMsec",
+    "cleanupIntervalStep",
+    "consolidationPolicy",
+]
+# ArangoDB's value for the immutable properties a spec may leave out
+IMMUTABLE_VIEW_DEFAULTS = {
+    "primarySortCompression": "lz4",
+    "writebufferSizeMax": 33554432,
+}
+# python-arango's key for each view property, see arango.formatter.format_view
+FORMATTED_VIEW_KEYS = {
+    "primary_sort": "primarySort",
+    "stored_values": "storedValues",
+    "primary_sort_compression": "primarySortCompression",
+    "writebuffer_max_size": "writebufferSizeMax",
+    "commit_interval_msec": "commitIntervalMsec",
+    "consolidation_interval_msec": "consolidationIntervalMsec",
+    "cleanup_interval_step": "cleanupIntervalStep",
+    "consolidation_policy": "consolidationPolicy",
+    "links": "links",
+}
+
+
+def camel_case(name: str):
+    first, *rest = name.split("_")
+    return first + "".join(part.title() for part in rest)
 
-    view['storedValues'] = [{"fields": v} for v in filter_fields]
-    view["stored_values"] = filter_fields
 
-    new_view = db.update_arangosearch_view(view_name, view)
+def strip_analyzer_prefix(name: str):
+    return name.rpartition("::")[2]
+
+
+def normalize_link(link: dict):
+    return {
+        "includeAllFields": link.get("includeAllFields", False),
+        "storeValues": link.get("storeValues", "none"),
+        "trackListPositions": link.get("trackListPositions", False),
+        "analyzers": sorted(
+            map(strip_analyzer_prefix, link.get("analyzers") or ["identity"])
+        ),
+        "fields": {
+            field: normalize_link(field_link)
+            for field, field_link in (link.get("fields") or {}).items()
+        },
+    }
+
+
+def normalize_view_spec(view: dict):
+    """
+    Bring a view definition into one comparable shape, whether it is a spec
+    sent to ArangoDB or a view returned by python-arango.
+    """
+    view = {FORMATTED_VIEW_KEYS.get(k, k): v for k, v in view.items()}
+    primary_sort = []
+    for sort in view.get("primarySort") or []:
+        asc = sort.get("asc", sort.get("direction", "asc") == "asc")
+        primary_sort.append([sort["field"], asc])
+    stored_values = {
+        tuple(sorted(set(sv["fields"]))) for sv in view.get("storedValues") or []
+    }
+    normalized = {
+        "primarySort": primary_sort,
+        "storedValues": sorted(stored_values),
+        "links": {
+            collection: normalize_link(link)
+            for collection, link in (view.get("links") or {}).items()
+        },
+    }
+    for prop, default in IMMUTABLE_VIEW_DEFAULTS.items():
+        normalized[prop] = view.get(prop, default)
+    for prop in MUTABLE_VIEW_PROPERTIES:
+        if prop in view:
+            normalized[prop] = view[prop]
+    if policy := normalized.get("consolidationPolicy"):
+        normalized["consolidationPolicy"] = {
+            camel_case(k): v for k, v in policy.items()
+        }
+    return normalized
+
 
-    # should update but for some reason update not working, so recreate instead
-    new_view_hash = hash_fields([sv['fields'] for sv in new_view['stored_values']])
-    if new_view_hash != fields_hash:
+def fingerprint_view(view: dict, properties=IMMUTABLE_VIEW_PROPERTIES):
+    """Stable across processes and restarts, unlike the builtin `hash()`"""
+    normalized = normalize_view_spec(view)
+    data = json.dumps({k: normalized.get(k) for k in properties}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_mutable_changes(view: dict, spec: dict):
+    """Properties set in `spec` that differ on `view`, unset ones are left as they are"""
+    current = normalize_view_spec(view)
+    return {
+        prop: spec[prop]
+        for prop in MUTABLE_VIEW_PROPERTIES
+        if prop in spec and not is_subset(spec[prop], current.get(prop))
+    }
+
+
+def update_view(db: StandardDatabase, spec: dict, view_name):
+    """
+    Apply `spec` to an existing view in place. Returns None when a property
+    that can only be set on creation changed, after deleting the view so it
+    can be created again.
+    """
+    view = db.view(view_name)
+    if view.get("type", ARANGOSEARCH) != ARANGOSEARCH:
+        logging.warning("view %s is a %s view, recreating it", view_name, view["type"])
         db.delete_view(view_name, ignore_missing=True)
-        raise Exception("recreate because update is impossible")
-    return new_view
+        forget_links(view_name)
+        drop_inverted_indexes(db)
+        return None
+    if fingerprint_view(view) == fingerprint_view(spec):
+        if changes := get_mutable_changes(view, spec):
+            logging.info("updating %s of view %s", ", ".join(changes), view_name)
+            db.update_arangosearch_view(view_name, changes)
+        else:
+            logging.info("view %s is up to date", view_name)
+        return view
+
+    changed = [
+        prop
+        for prop in IMMUTABLE_VIEW_PROPERTIES
+        if fingerprint_view(view, [prop]) != fingerprint_view(spec, [prop])
+    ]
+    logging.warning(
+        "%s of view %s changed, recreating it, search results are incomplete until it is reindexed",
+        ", ".join(changed),
+        view_name,
+    )
+    db.delete_view(view_name, ignore_missing=True)
+    forget_links(view_name)
+    return None
+
 
 def link_all_collections(db: StandardDatabase, view: dict):
-    links = view.get("links", {})
     view_name = view["name"]
+    if view.get("type") == SEARCH_ALIAS:
+        collection_names = [c["name"] for c in db.collections() if not c["system"]]
+        link_search_alias_view(db, view_name, collection_names)
+        return
+    current_links = view.get("links", {})
+    links = {}
+    linked = []
+    link = make_link()
     for collection in db.collections():
         collection_name = collection["name"]
         if collection["system"]:
             continue
-        links[collection_name] = dict(includeAllFields=True, storeValues='id')
-        if not links[collection_name]:
-            del links[collection]
+        linked.append(collection_name)
+        if normalize_link(current_links.get(collection_name, {})) == normalize_link(link):
             continue
+        links[collection_name] = link
         logging.info(f"linking collection {collection_name} to {view_name}")
-    db.update_arangosearch_view(view_name, view)
+    if links:
+        # only the links that changed are sent, the others are left untouched
+        db.update_arangosearch_view(view_name, {"links": links})
+    cache_links(db, view_name, linked)
     logging.info(f"linked {len(links)} collections to view")
 
 
+def make_inverted_index():
+    """
+    Inverted index backing the search-alias view, with the same primary sort,
+    stored values and tunables as the arangosearch view but only the fields
+    the helpers search on.
+    """
+    spec = make_view_spec()
+    properties = {
+        k: v for k, v in get_view_properties().items() if k != "primarySortCompression"
+    }
+    fields = [
+        dict(name=field, analyzer=NORM_ANALYZER) for field in SCO_SEARCH_FIELDS
+    ] + [
+        dict(name=field)
+        for field in SEARCH_ALIAS_FIELDS
+        if field not in SCO_SEARCH_FIELDS
+    ]
+    index = dict(
+        type="inverted",
+        fields=fields,
+        # index array elements individually, as arangosearch views do, so the
+        # same SEARCH expressions work on both backends
+        searchField=True,
+        storedValues=spec["storedValues"],
+        **properties,
+    )
+    if spec["primarySort"]:
+        index["primarySort"] = dict(
+            fields=spec["primarySort"],
+            compression=spec.get("primarySortCompression", "lz4"),
+        )
+    return index
+
+
+def get_inverted_index_name(index: dict):
+    # indexes cannot be changed, a new definition gets a new name
+    data = json.dumps(index, sort_keys=True)
+    return INVERTED_INDEX_PREFIX + hashlib.sha256(data.encode()).hexdigest()[:12]
+
+
+def is_search_alias_index(index: dict):
+    return index["type"] == "inverted" and index["name"].startswith(
+        INVERTED_INDEX_PREFIX
+    )
+
+
+def create_search_alias_view(db: StandardDatabase, view_name):
+    if db.has_view(view_name):
+        view = db.view(view_name)
+        if view["type"] == SEARCH_ALIAS:
+            return view
+        logging.warning("view %s is a %s view, recreating it", view_name, view["type"])
+        db.delete_view(view_name, ignore_missing=True)
+        forget_links(view_name)
+    try:
+        logging.info("create new view: %s", view_name)
+        return db.create_view(view_name, SEARCH_ALIAS, {"indexes": []})
+    except arango.exceptions.ViewCreateError as e:
+        logging.error(e)
+    return db.view(view_name)
+
+
+def link_search_alias_view(db: StandardDatabase, view_name, collection_names):
+    """
+    Add the current inverted index of each collection to the search-alias
+    view, replacing (and dropping) indexes built from an older definition.
+    """
+    index = make_inverted_index()
+    index_name = get_inverted_index_name(index)
+    current = {
+        (i["collection"], i["index"]) for i in db.view(view_name).get("indexes", [])
+    }
+    changes = []
+    stale_indexes = []
+    for collection_name in collection_names:
+        collection = db.collection(collection_name)
+        existing = {
+            i["name"]: i["id"] for i in collection.indexes() if is_search_alias_index(i)
+        }
+        if index_name not in existing:
+            logging.info(f"creating inverted index {index_name} on {collection_name}")
+            collection.add_index(
+                dict(index, name=index_name, inBackground=conf.VIEW_LINK_IN_BACKGROUND)
+            )
+        if (collection_name, index_name) not in current:
+            changes.append(dict(collection=collection_name, index=index_name))
+        for name, index_id in existing.items():
+            if name == index_name:
+                continue
+            if (collection_name, name) in current:
+                changes.append(
+                    dict(collection=collection_name, index=name, operation="del")
+                )
+            stale_indexes.append((collection, index_id))
+    if changes:
+        db.update_view(view_name, {"indexes": changes})
+    for collection, index_id in stale_indexes:
+        collection.delete_index(index_id, ignore_missing=True)
+    cache_links(db, view_name, collection_names)
+    logging.info(f"added {len(changes)} inverted indexes to view {view_name}")
+
+
+def drop_inverted_indexes(db: StandardDatabase):
+    """Remove the search-alias backend's indexes, they cost writes once nothing reads them"""
+    for c in db.collections():
+        if c["system"]:
+            continue
+        collection = db.collection(c["name"])
+        for index in collection.indexes():
+            if is_search_alias_index(index):
+                logging.info(f"dropping inverted index {index['name']} on {c['name']}")
+                collection.delete_index(index["id"], ignore_missing=True)
+
+
+def setup_database(db: StandardDatabase):
+    create_analyzers(db)
+    view = create_view(db, conf.ARANGODB_DATABASE_VIEW)
+    link_all_collections(db, view)
+
+
 def startup_func():
     logging.info("setting up database")
-    client = ArangoClient(settings.ARANGODB_HOST_URL)
-    sys_db = client.db(username=settings.ARANGODB_USERNAME, password=settings.ARANGODB_PASSWORD)
+    client = db_pool.get_client()
+    sys_db = db_pool.get_database("_system")
     db = create_database(client, sys_db, conf.DB_NAME)
-    view = create_view(db, conf.ARANGODB_DATABASE_VIEW)
-    link_all_collections(db, view)
+    setup_database(db)
     logging.info("app ready")
\ No newline at end of file
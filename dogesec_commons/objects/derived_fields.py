@@ -0,0 +1,152 @@
+"""
+Normalized fields stamped on objects when they are written to ArangoDB.
+
+The SDO filters (`ttp_type`, `ttp_object_type`, `ttp_id`) and `visible_to` used
+to be evaluated as per-document FILTERs or OR-ed array checks over nested
+attributes; keeping their answer in flat `_`-prefixed attributes lets the
+view's index answer them with term lookups inside SEARCH.
+Objects uploaded before these fields existed are stamped once by `bootstrap()`,
+or again at any time by the `backfill_derived_fields` management command.
+"""
+
+import itertools
+
+from arango.database import StandardDatabase
+from stix2arango.stix2arango import Stix2Arango
+
+from .helpers import (
+    ATTACK_FORMS,
+    MITRE_ATTACK_DOMAINS,
+    TLP_VISIBLE_TO_ALL,
+    VISIBILITY_PUBLIC,
+    get_stix_collections,
+)
+
+# `ttp_type` value -> how an object is recognised as coming from it
+TTP_TYPE_STIX_TYPES = {
+    "vulnerability": "cve",
+    "weakness": "cwe",
+    "location": "location",
+}
+TTP_TYPE_SOURCE_NAMES = {
+    "capec": "capec",
+    "mitre-atlas": "atlas",
+    "DISARM": "disarm",
+    "sector2stix": "sector",
+}
+
+DERIVED_FIELDS = ["_ttp_source", "_attack_form", "_external_id", "_visibility"]
+# attributes the derived fields are computed from
+SOURCE_FIELDS = [
+    "type",
+    "external_references",
+    "x_mitre_domains",
+    "x_mitre_is_subtechnique",
+    "created_by_ref",
+    "object_marking_refs",
+]
+
+
+def get_ttp_sources(obj: dict) -> list[str]:
+    sources = []
+    if ttp_type := TTP_TYPE_STIX_TYPES.get(obj.get("type")):
+        sources.append(ttp_type)
+    for domain in obj.get("x_mitre_domains") or []:
+        if isinstance(domain, str) and domain.endswith("-attack"):
+            sources.append(domain)
+    external_references = obj.get("external_references") or [{}]
+    source_name = external_references[0].get("source_name")
+    if ttp_type := TTP_TYPE_SOURCE_NAMES.get(source_name):
+        sources.append(ttp_type)
+    return sources
+
+
+def get_attack_form(obj: dict):
+    for form, matchers in ATTACK_FORMS.items():
+        for matcher in matchers:
+            if all(obj.get(k) == v for k, v in matcher.items()):
+                return form
+    return None
+
+
+def get_external_id(obj: dict):
+    external_references = obj.get("external_references") or [{}]
+    return external_references[0].get("external_id")
+
+
+def get_visibility(obj: dict):
+    """
+    `public` when every `visible_to` may see the object: it has no creator or
+    no markings, a TLP marking that is visible to all, or comes from ATT&CK.
+    Otherwise `owner:<created_by_ref>`, only visible to its creator.
+    """
+    created_by_ref = obj.get("created_by_ref")
+    marking_refs = obj.get("object_marking_refs")
+    if (
+        created_by_ref is None
+        or marking_refs is None
+        or set(marking_refs).intersection(TLP_VISIBLE_TO_ALL)
+        or set(obj.get("x_mitre_domains") or []).intersection(MITRE_ATTACK_DOMAINS)
+    ):
+        return VISIBILITY_PUBLIC
+    return f"owner:{created_by_ref}"
+
+
+def get_derived_fields(obj: dict) -> dict:
+    return {
+        "_ttp_source": get_ttp_sources(obj),
+        "_attack_form": get_attack_form(obj),
+        "_external_id": get_external_id(obj),
+        "_visibility": get_visibility(obj),
+    }
+
+
+def add_derived_fields(obj: dict):
+    """Stamp the derived fields on `obj` in place, usable as a stix2arango alter function"""
+    obj.update(get_derived_fields(obj))
+    return obj
+
+
+def pre_upload_hook(instance, collection_name, objects: list[dict]):
+    for obj in objects:
+        add_derived_fields(obj)
+
+
+def register_upload_hooks():
+    """Stamp derived fields on everything uploaded through stix2arango in this process"""
+    hooks = [hook for hook, _ in Stix2Arango._pre_upload_hooks]
+    if pre_upload_hook not in hooks:
+        Stix2Arango.register_pre_upload_hook(pre_upload_hook)
+
+
+def backfill_collection(db: StandardDatabase, collection_name, batch_size=1000):
+    """Stamp derived fields on every document of `collection_name` that is missing or has stale values"""
+    cursor = db.aql.execute(
+        "FOR doc IN @@collection RETURN KEEP(doc, @fields)",
+        bind_vars={
+            "@collection": collection_name,
+            "fields": ["_key", *SOURCE_FIELDS, *DERIVED_FIELDS],
+        },
+        stream=True,
+        batch_size=batch_size,
+    )
+    collection = db.collection(collection_name)
+    updated = 0
+    while batch := list(itertools.islice(cursor, batch_size)):
+        changes = []
+        for doc in batch:
+            fields = get_derived_fields(doc)
+            if any(k not in doc or doc[k] != v for k, v in fields.items()):
+                changes.append(dict(_key=doc["_key"], **fields))
+        if changes:
+            collection.update_many(changes, merge=False, silent=True)
+            updated += len(changes)
+    return updated
+
+
+def backfill(db: StandardDatabase, collection_names=None, batch_size=1000):
+    """Stamp derived fields in `collection_names` (default: every vertex and edge collection)"""
+    updated = {}
+    for collection_name in collection_names or get_stix_collections(db, refresh=True):
+        updated[collection_name] = backfill_collection(db, collection_name, batch_size)
+    return updated
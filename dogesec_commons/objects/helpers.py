@@ -1,14 +1,32 @@
+import base64
 import contextlib
+import hashlib
+import json
 import logging
 import re
-from arango import ArangoClient
+import threading
+import time
+import uuid
 from django.conf import settings
+from django.core.cache import caches
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from rest_framework.response import Response
 from drf_spectacular.utils import OpenApiParameter
 from ..utils.pagination import Pagination
-from rest_framework.exceptions import ValidationError, NotFound
+from rest_framework.exceptions import APIException, ValidationError, NotFound
+from arango.exceptions import AQLQueryExecuteError
 from stix2arango.services import ArangoDBService
-from . import conf
+from . import canonical_latest, conf, db_pool, query_stats, result_cache
+from .query_stats import normalize_aql
+from .db_view_creator import (
+    SCO_SEARCH_FIELDS,
+    SEARCH_ALIAS_FIELDS,
+    NORM_ANALYZER,
+    NGRAM_ANALYZER,
+    SEARCH_ALIAS,
+)
 from ..utils.helpers import positive_int
 
 from dogesec_commons.utils.schemas import (
@@ -112,6 +130,36 @@ SCO_TYPES = set(
         "x509-certificate",
     ]
 )
+# fields the SCO `value` filter searches for each type, when `value_fields` is not passed
+SCO_VALUE_FIELDS = {
+    "artifact": ["payload_bin"],
+    "autonomous-system": ["number", "name"],
+    "bank-account": ["iban", "account_number", "bic"],
+    "payment-card": ["value"],
+    "cryptocurrency-transaction": ["value"],
+    "cryptocurrency-wallet": ["value"],
+    "directory": ["path"],
+    "domain-name": ["value"],
+    "email-addr": ["value", "display_name"],
+    "email-message": ["subject"],
+    "file": ["name"],
+    "data-source": ["name"],
+    "ipv4-addr": ["value"],
+    "ipv6-addr": ["value"],
+    "mac-addr": ["value"],
+    "mutex": ["name", "value"],
+    "network-traffic": ["protocols"],
+    "phone-number": ["number"],
+    "process": ["command_line"],
+    "software": ["name", "cpe"],
+    "url": ["value"],
+    "user-account": ["display_name"],
+    "user-agent": ["string"],
+    "windows-registry-key": ["key"],
+    "x509-certificate": ["subject"],
+}
+# can be megabytes per document, only searched when asked for
+SCO_BLOB_FIELDS = ["payload_bin", "body"]
 SDO_SORT_FIELDS = [
     "name_ascending",
     "name_descending",
@@ -139,6 +187,9 @@ BUNDLE_SORT_FIELDS = [
 
 SCO_SORT_FIELDS = ["type_ascending", "type_descending"]
 
+# sort keys whose cursor range is pushed into SEARCH, see get_seek_sort_stmt()
+SEEK_SEARCH_FIELDS = ["id", "type", "created", "modified"]
+
 
 SMO_SORT_FIELDS = [
     "created_ascending",
@@ -168,20 +219,33 @@ TLP_VISIBLE_TO_ALL = (
     "marking-definition--613f2e26-407d-48c7-9eca-b8e91df99dc9",
     "marking-definition--34098fce-860f-48ae-8e50-ebd3cc5e41da",
 )
-VISIBLE_TO_SEARCH_FILTER = (
-    "("
-    "(doc.created_by_ref == @visible_to OR NOT EXISTS(doc.created_by_ref) OR NOT EXISTS(doc.object_marking_refs))"  # Object created by the user or has no creator or marking refs
-    " OR (@marking_visible_to_all ANY IN doc.object_marking_refs)"  # Object has TLP marking visible to all
-    " OR ['enterprise-attack', 'mobile-attack', 'ics-attack'] ANY IN doc.x_mitre_domains"  # Object is from MITRE ATT&CK domains
-    ")"
-)
-VISIBLE_TO_REGULAR_FILTER = (
-    "("
-    "(doc.created_by_ref IN [@visible_to, NULL] OR doc.object_marking_refs == NULL)"  # Object created by the user or has no creator or no marking refs
-    " OR (@marking_visible_to_all ANY IN doc.object_marking_refs)"  # Object has TLP marking visible to all
-    " OR ['enterprise-attack', 'mobile-attack', 'ics-attack'] ANY IN doc.x_mitre_domains"  # Object is from MITRE ATT&CK domains
-    ")"
-)
+# top level attribute names accepted by `fields`
+ATTRIBUTE_NAME_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# newest version of each id, for queries that list versions `_is_canonical_latest` does not cover
+COLLAPSE_VERSIONS = """
+            COLLECT id = doc.id INTO docs
+            LET doc = FIRST(FOR d in docs[*].doc SORT d.modified OR d.created DESC, d._record_modified DESC RETURN d)
+"""
+
+# query param -> attribute the list endpoints are scoped by
+SCOPE_FIELDS = {
+    "report_id": "_stixify_report_id",
+    "post_id": "_obstracts_post_id",
+}
+
+MITRE_ATTACK_DOMAINS = ["enterprise-attack", "mobile-attack", "ics-attack"]
+
+# `_visibility` of objects every `visible_to` may see, see derived_fields.get_visibility().
+# bootstrap() stamps it on objects uploaded before it existed
+VISIBILITY_PUBLIC = "public"
+VISIBLE_TO_SEARCH_FILTER = "doc._visibility IN @visibility"
+
+
+def get_visibility_terms(visible_to):
+    """`@visibility` of the objects `visible_to` may see"""
+    return [VISIBILITY_PUBLIC, f"owner:{visible_to}"]
+
 
 TTP_STIX_TYPES = set(
     [
@@ -226,6 +290,56 @@ H400RESP_SCHEMA = make_response_schema_with_examples(
 )
 
 
+ERROR_RESOURCE_LIMIT = 32
+ERROR_QUERY_KILLED = 1500
+
+VERTEX_COLLECTION_SUFFIX = "_vertex_collection"
+EDGE_COLLECTION_SUFFIX = "_edge_collection"
+# stix2arango `_key`s are `<stix id>+<suffix>`, "," sorts right after "+"
+KEY_SEPARATOR = "+"
+KEY_SEPARATOR_END = ","
+
+_stix_collections: dict[str, tuple[float, list[str]]] = {}
+_stix_collections_lock = threading.Lock()
+
+
+def get_stix_collections(
+    db, suffixes=(VERTEX_COLLECTION_SUFFIX, EDGE_COLLECTION_SUFFIX), refresh=False
+):
+    """
+    Names of the stix2arango collections of `db`, listed at most once per
+    `STIX_COLLECTIONS_CACHE_TTL` unless `refresh`. A cached list may miss
+    collections created since, callers that cannot fall back pass `refresh`.
+    """
+    with _stix_collections_lock:
+        expires_at, names = _stix_collections.get(db.name, (0, None))
+    if refresh or names is None or expires_at <= time.time():
+        names = sorted(
+            collection["name"]
+            for collection in db.collections()
+            if not collection["system"]
+            and collection["name"].endswith(
+                (VERTEX_COLLECTION_SUFFIX, EDGE_COLLECTION_SUFFIX)
+            )
+        )
+        with _stix_collections_lock:
+            _stix_collections[db.name] = (
+                time.time() + conf.STIX_COLLECTIONS_CACHE_TTL,
+                names,
+            )
+    return [name for name in names if name.endswith(suffixes)]
+
+
+def forget_stix_collections():
+    with _stix_collections_lock:
+        _stix_collections.clear()
+
+
+class QueryTimeout(APIException):
+    status_code = 503
+    default_detail = "query took too long to complete, try narrowing down the filters"
+    default_code = "query_timeout"
+
 
 class ArangoDBHelper:
     max_page_size = conf.MAXIMUM_PAGE_SIZE
@@ -264,6 +378,113 @@ class ArangoDBHelper:
                 return f"SORT {cfield} {direction}"
             return f"SORT {doc_name}.{field} {direction}"
 
+    def get_sort_field(self, sort_options: list[str]):
+        sort_field = self.query.get("sort", sort_options[0])
+        if sort_field not in sort_options:
+            return sort_options[0]
+        return sort_field
+
+    @staticmethod
+    def is_seek_searchable(field):
+        # SEARCH ranges never match null or missing values and compare strings
+        # bytewise, unlike SORT, so only always-set fields with no case mix qualify
+        if field not in SEEK_SEARCH_FIELDS:
+            return False
+        if conf.VIEW_BACKEND == SEARCH_ALIAS:
+            return field in SEARCH_ALIAS_FIELDS
+        return True
+
+    def get_seek_sort_stmt(
+        self,
+        sort_options: list[str],
+        bind_vars: dict,
+        search_filters: list[str] = None,
+        doc_name="doc",
+    ):
+        """
+        Like `get_sort_stmt()` but always breaks ties on `id` so that the position
+        of the last row of a page can be handed out as a `cursor`.
+
+        When the request carries a `cursor`, the page starts right after that
+        position instead of skipping `(page - 1) * page_size` rows: for the
+        fields of SEEK_SEARCH_FIELDS the range condition on the sort key is
+        appended to `search_filters`, so the view only enumerates the rows that
+        follow it. Otherwise (e.g. `name`, or versions collapsed after SEARCH)
+        it is prepended as a FILTER.
+        """
+        finder = re.compile(r"(.+)_((a|de)sc)ending")
+        sort_field = self.get_sort_field(sort_options)
+        m = finder.match(sort_field)
+        field, direction = m.group(1), m.group(2).upper()
+
+        key_fields = [field, "id"]
+        self.seek_key = (sort_field, key_fields)
+        sort_stmt = "SORT " + ", ".join(
+            f"{doc_name}.{f} {direction}" for f in key_fields
+        )
+        cursor = self.query.get("cursor")
+        if not cursor:
+            return sort_stmt
+
+        value, last_id = self.decode_cursor(cursor, sort_field)
+        bind_vars["cursor_value"], bind_vars["cursor_id"] = value, last_id
+        operator = ">" if direction == "ASC" else "<"
+        if search_filters is not None and value is not None and self.is_seek_searchable(field):
+            condition = f"({doc_name}.{field} {operator} @cursor_value OR ({doc_name}.{field} == @cursor_value AND {doc_name}.id {operator} @cursor_id))"
+            search_filters.append(condition)
+            self.seek_condition = " AND " + condition
+            return sort_stmt
+        self.seek_condition = f"FILTER [{doc_name}.{field}, {doc_name}.id] {operator} [@cursor_value, @cursor_id]\n"
+        return self.seek_condition + sort_stmt
+
+    @staticmethod
+    def encode_cursor(sort_field, position: list):
+        data = json.dumps([sort_field, position]).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @staticmethod
+    def decode_cursor(cursor: str, sort_field):
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            cursor_sort, position = json.loads(data)
+        except Exception:
+            raise ValidationError(dict(error=f"invalid cursor `{cursor}`"))
+        if (
+            cursor_sort != sort_field
+            or not isinstance(position, list)
+            or len(position) != 2
+        ):
+            raise ValidationError(
+                dict(error="cursor was not issued for the requested `sort`")
+            )
+        return position
+
+    def get_projection(self):
+        """
+        RETURN expression of the list queries. With `fields`, only those
+        attributes are returned, read as literal `doc.<field>` accesses so
+        ArangoDB can answer from the view's stored values without loading the
+        documents when they cover every attribute the query uses. The sort key
+        is always returned, `next_cursor` is made from it.
+        """
+        fields = self.query_as_array("fields")
+        if not fields:
+            return "KEEP(doc, KEYS(doc, true))"
+        if invalid := [f for f in fields if not ATTRIBUTE_NAME_RE.fullmatch(f)]:
+            raise ValidationError(dict(error=f"invalid fields: {', '.join(invalid)}"))
+        if self.seek_key:
+            fields = [*fields, *self.seek_key[1]]
+        # quoted, AQL keywords such as `filter` are valid attribute names
+        projection = [f'"{f}": doc.`{f}`' for f in dict.fromkeys(fields)]
+        return "{" + ", ".join(projection) + "}"
+
+    def get_next_cursor(self, data: list):
+        if not self.seek_key or len(data) < self.count:
+            return None
+        sort_field, key_fields = self.seek_key
+        last = data[-1]
+        return self.encode_cursor(sort_field, [last.get(f) for f in key_fields])
+
     def query_as_array(self, key):
         query = self.query.get(key)
         if not query:
@@ -288,7 +509,13 @@ class ArangoDBHelper:
 
     @classmethod
     def get_paginated_response(
-        cls, data, page_number, page_size=page_size, full_count=0, result_key="objects"
+        cls,
+        data,
+        page_number,
+        page_size=page_size,
+        full_count=0,
+        result_key="objects",
+        next_cursor=None,
     ):
         return Response(
             {
@@ -296,6 +523,7 @@ class ArangoDBHelper:
                 "page_number": page_number,
                 "page_results_count": len(data),
                 "total_results_count": full_count,
+                "next_cursor": next_cursor,
                 result_key: list(data),
             }
         )
@@ -322,8 +550,16 @@ class ArangoDBHelper:
                     },
                     "total_results_count": {
                         "type": "integer",
+                        "nullable": True,
+                        "description": "`null` when `count=none` and on pages fetched with a `cursor`, unless `count=estimate` has a count of the same filters. Can lag behind the real count when `count=estimate`.",
                         "example": cls.page_size * cls.max_page_size,
                     },
+                    "next_cursor": {
+                        "type": "string",
+                        "nullable": True,
+                        "description": "Pass as `cursor` to fetch the page that follows this one. Only set by endpoints that accept `cursor` and only when this page is full.",
+                        "example": None,
+                    },
                     result_key: {
                         "type": "array",
                         "items": schema or cls.STIX_OBJECT_SCHEMA,
@@ -346,45 +582,196 @@ class ArangoDBHelper:
                 type=int,
                 description=Pagination.page_size_query_description,
             ),
+            OpenApiParameter(
+                "count",
+                enum=conf.COUNT_MODES,
+                description=f"How `total_results_count` is computed. `exact` counts every match, `estimate` reuses a recently computed count for the same filters and `none` skips counting altogether, which is the fastest option when you only page forward. Defaults to `{conf.DEFAULT_COUNT_MODE}`.",
+            ),
         ]
         return parameters
 
-    client = ArangoClient(hosts=settings.ARANGODB_HOST_URL)
     DB_NAME = conf.DB_NAME
 
-    def __init__(self, collection, request, result_key="objects") -> None:
+    def __init__(self, collection, request, result_key="objects", export=False) -> None:
         self.collection = collection
-        self.db = self.client.db(
-            self.DB_NAME,
-            username=settings.ARANGODB_USERNAME,
-            password=settings.ARANGODB_PASSWORD,
-        )
+        self.db = db_pool.get_database(self.DB_NAME)
         self.result_key = result_key
         self.request = request
         self.query = request.query_params.dict() if request else dict()
         self.page, self.count = self.get_page_params(self.query)
+        self.seek_key = None
+        # what the cursor added to the query, see get_seek_sort_stmt()
+        self.seek_condition = None
+        self.export = export
 
-    def execute_query(self, query, bind_vars={}, paginate=True):
-        if paginate:
-            bind_vars["offset"], bind_vars["count"] = self.get_offset_and_count(
-                self.count, self.page
-            )
+    def get_count_mode(self):
+        count_mode = self.query.get("count", conf.DEFAULT_COUNT_MODE)
+        if count_mode not in conf.COUNT_MODES:
+            return conf.DEFAULT_COUNT_MODE
+        return count_mode
+
+    @staticmethod
+    def get_count_cache_key(query, bind_vars: dict, seek_condition=None):
+        """Same for every page of a filter set, including the pages fetched with a cursor"""
+        if seek_condition:
+            query = query.replace(seek_condition, "")
+        filters = {
+            k: v
+            for k, v in bind_vars.items()
+            if k not in ["offset", "count", "cursor_value", "cursor_id"]
+        }
+        data = json.dumps([normalize_aql(query), filters], sort_keys=True, default=str)
+        return "dogesec_commons:count:" + hashlib.sha256(data.encode()).hexdigest()
+
+    @staticmethod
+    def get_query_limits(query_name):
+        if not query_name:
+            # internal and write queries (kb_sync, deletes) are not guarded
+            return {}
+        return {**conf.DEFAULT_QUERY_LIMITS, **conf.QUERY_LIMITS.get(query_name, {})}
+
+    def run_query(self, query, bind_vars, query_name=None, **kwargs):
         try:
-            cursor = self.db.aql.execute(
-                query, bind_vars=bind_vars, count=True, full_count=True
+            return self.db.aql.execute(
+                query,
+                bind_vars=bind_vars,
+                **self.get_query_limits(query_name),
+                **kwargs,
             )
+        except AQLQueryExecuteError as e:
+            logging.exception(e)
+            if e.error_code == ERROR_QUERY_KILLED:
+                raise QueryTimeout()
+            if e.error_code == ERROR_RESOURCE_LIMIT:
+                raise ValidationError(
+                    dict(
+                        error="query used too much memory, try narrowing down the filters"
+                    )
+                )
+            raise ValidationError("aql: cannot process request")
         except Exception as e:
             logging.exception(e)
             raise ValidationError("aql: cannot process request")
+
+    def execute_query(self, query, bind_vars={}, paginate=True, query_name=None):
+        if paginate and self.export:
+            return self.get_export_response(query, bind_vars)
+        full_count = None
+        with_full_count = False
+        count_cache_key = None
         if paginate:
-            return self.get_paginated_response(
-                cursor,
-                self.page,
-                self.count,
-                cursor.statistics()["fullCount"],
-                result_key=self.result_key,
+            bind_vars["offset"], bind_vars["count"] = self.get_offset_and_count(
+                self.count, self.page
+            )
+            if self.seek_condition:
+                bind_vars["offset"] = 0
+            count_mode = self.get_count_mode()
+            if count_mode == "estimate":
+                count_cache_key = self.get_count_cache_key(
+                    query, bind_vars, self.seek_condition
+                )
+                full_count = caches[conf.COUNT_ESTIMATE_CACHE].get(count_cache_key)
+            # after a cursor fullCount would only count the rows that follow it
+            with_full_count = (
+                count_mode != "none" and full_count is None and not self.seek_condition
+            )
+        stats = None
+        result_cache_key = result_cache.get_cache_key(
+            self.db, query_name, query, bind_vars, with_full_count
+        )
+        if cached := result_cache.get_result(result_cache_key):
+            data, statistics = cached
+        else:
+            cursor = self.run_query(
+                query,
+                bind_vars,
+                query_name,
+                count=True,
+                full_count=with_full_count,
+            )
+            data = list(cursor)
+            statistics = cursor.statistics() or {}
+            if conf.QUERY_STATS_ENABLED:
+                stats = query_stats.record(query_name, query, bind_vars, statistics)
+            result_cache.set_result(result_cache_key, (data, statistics))
+        if not paginate:
+            return data
+
+        if with_full_count:
+            full_count = statistics["fullCount"]
+            if count_cache_key and not self.seek_condition:
+                caches[conf.COUNT_ESTIMATE_CACHE].set(
+                    count_cache_key, full_count, conf.COUNT_ESTIMATE_TTL
+                )
+        response = self.get_paginated_response(
+            data,
+            self.page,
+            self.count,
+            full_count,
+            result_key=self.result_key,
+            next_cursor=self.get_next_cursor(data),
+        )
+        if stats and conf.QUERY_STATS_SERVER_TIMING:
+            response["Server-Timing"] = query_stats.server_timing(query_name, stats)
+        return response
+
+    def get_export_response(self, query, bind_vars):
+        """
+        Stream every result of a listing query instead of a single page.
+
+        The query runs as a server-side streaming cursor so neither ArangoDB nor
+        this process holds the whole result set; documents are written out as
+        they arrive from the cursor, one batch at a time.
+        """
+        export_format = self.query.get("export_format", conf.EXPORT_FORMATS[0])
+        if export_format not in conf.EXPORT_FORMATS:
+            raise ValidationError(
+                dict(error=f"unsupported export_format `{export_format}`")
             )
-        return list(cursor)
+        bind_vars["offset"], bind_vars["count"] = 0, conf.EXPORT_MAXIMUM_OBJECTS
+        cursor = self.run_query(
+            query,
+            bind_vars,
+            "export",
+            stream=True,
+            batch_size=conf.EXPORT_BATCH_SIZE,
+            ttl=conf.EXPORT_CURSOR_TTL,
+        )
+
+        content = self.iter_export(cursor, export_format)
+        content_type = "application/x-ndjson"
+        if export_format == "bundle":
+            content_type = "application/json"
+        accepts_gzip = self.request and "gzip" in self.request.META.get(
+            "HTTP_ACCEPT_ENCODING", ""
+        )
+        if accepts_gzip:
+            content = compress_sequence(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        if accepts_gzip:
+            response["Content-Encoding"] = "gzip"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+    @staticmethod
+    def iter_export(cursor, export_format):
+        try:
+            if export_format == "bundle":
+                bundle_id = f"bundle--{uuid.uuid4()}"
+                yield f'{{"type": "bundle", "id": "{bundle_id}", "objects": ['.encode()
+                separator = ""
+                for obj in cursor:
+                    yield (separator + json.dumps(obj)).encode()
+                    separator = ", "
+                yield b"]}"
+            else:
+                for obj in cursor:
+                    yield (json.dumps(obj) + "\n").encode()
+        finally:
+            # also runs when the client goes away mid-download, closing a
+            # stream cursor aborts the query on the server
+            with contextlib.suppress(Exception):
+                cursor.close(ignore_missing=True)
 
     def get_offset_and_count(self, count, page) -> tuple[int, int]:
         page = page or 1
@@ -393,9 +780,80 @@ class ArangoDBHelper:
         offset = (page - 1) * count
         return offset, count
 
+    def get_value_search(
+        self, value: str, bind_vars: dict, exact=False, fields=SCO_SEARCH_FIELDS
+    ):
+        """
+        SEARCH expression matching `value` against `fields`, ignoring case.
+
+        The fields are linked with the norm and n-gram analyzers created in
+        `db_view_creator`, so both modes are answered from the view's index.
+        The search-alias backend indexes them with the norm analyzer only, and
+        takes the analyzer from its inverted indexes.
+        """
+        search_alias = conf.VIEW_BACKEND == SEARCH_ALIAS
+        bind_vars["search_value"] = value.lower()
+        if exact:
+            clauses = [f"doc.{field} == @search_value" for field in fields]
+        else:
+            bind_vars["search_like"] = "%" + self.get_like_literal(value.lower()) + "%"
+            clauses = [f"doc.{field} LIKE @search_like" for field in fields]
+        if search_alias:
+            search = " OR ".join(clauses)
+        else:
+            search = f'ANALYZER({" OR ".join(clauses)}, "{NORM_ANALYZER}")'
+
+        if (
+            not exact
+            and not search_alias
+            and conf.SCO_SEARCH_NGRAM_PREFILTER
+            and len(value) >= 3
+        ):
+            # every trigram of the value must be in the field, cheap to
+            # intersect and it narrows down what LIKE has to check
+            ngram_clauses = [
+                f'NGRAM_MATCH(doc.{field}, @search_value, 1, "{NGRAM_ANALYZER}")'
+                for field in fields
+            ]
+            search = f'({" OR ".join(ngram_clauses)}) AND {search}'
+
+        if value.isdigit() and "number" in fields:
+            # numbers are not run through analyzers, e.g. autonomous-system.number,
+            # so they only match whole, in both modes
+            bind_vars["search_number"] = int(value)
+            search = f"{search} OR doc.number == @search_number"
+        return f"({search})"
+
+    def get_sco_value_fields(self, types=None):
+        if value_fields := self.query_as_array("value_fields"):
+            if unknown := set(value_fields).difference(SCO_SEARCH_FIELDS):
+                raise ValidationError(
+                    dict(error=f"unsupported value_fields: {', '.join(sorted(unknown))}")
+                )
+            return [field for field in SCO_SEARCH_FIELDS if field in value_fields]
+
+        fields = set()
+        for type in types or []:
+            fields.update(SCO_VALUE_FIELDS.get(type, []))
+        if not fields:
+            fields = set(SCO_SEARCH_FIELDS).difference(SCO_BLOB_FIELDS)
+        return [field for field in SCO_SEARCH_FIELDS if field in fields]
+
+    def get_scope_filters(self, bind_vars, matcher={}):
+        """SEARCH predicates limiting a list to the objects of `report_id` / `post_id` (and `matcher`)"""
+        fields = {
+            field: value
+            for param, field in SCOPE_FIELDS.items()
+            if (value := self.query.get(param))
+        }
+        filters = []
+        for i, (field, value) in enumerate({**fields, **matcher}.items()):
+            bind_vars[f"scope_{i}"] = value
+            filters.append(f"doc.`{field}` == @scope_{i}")
+        return filters
+
     def get_scos(self, matcher={}):
         types = SCO_TYPES
-        other_filters = []
 
         if new_types := self.query_as_array("types"):
             types = types.intersection(new_types)
@@ -403,61 +861,29 @@ class ArangoDBHelper:
             "@collection": self.collection,
             "types": list(types),
         }
-        search_exact = self.query_as_bool("value_exact", False)
+        search_filters = ["doc.type IN @types", "doc._is_canonical_latest == TRUE"]
         if value := self.query.get("value"):
-            bind_vars["search_value"] = value.lower()
-
-        if bind_vars.get("search_value"):
-            search_value_filters = []
-            for key in [
-                    "value",           # ipv4-addr, ipv6-addr, mutex, url, domain-name, etc
-                    "name",            # file, software
-                    "number",          # autonomous-system
-                    "path",            # directory
-                    "body",            # email-message
-                    "subject",         # x509-certificate
-                    "key",             # windows-registry-key
-                    "display_name",    # user-account
-                    "string",          # user-agent
-                    "payload_bin",     # artifact
-                    "protocols",       # network-traffic
-                    "command_line",    # process
-                    "cpe",             # software
-                    "iban",            # bank-account
-                    "account_number",  # bank-account
-                    "bic"              # bank-account
-            ]:
-                if search_exact:
-                    search_value_filters.append(f"LOWER(doc.{key}) == @search_value")
-                else:
-                    search_value_filters.append(f"CONTAINS(LOWER(doc.{key}), @search_value)")
-            other_filters.append(
-                f"""
-                (
-                    {" OR ".join(search_value_filters)}
+            search_filters.append(
+                self.get_value_search(
+                    value,
+                    bind_vars,
+                    exact=self.query_as_bool("value_exact", False),
+                    fields=self.get_sco_value_fields(types if new_types else None),
                 )
-                """.strip()
             )
 
-        if matcher:
-            bind_vars["matcher"] = matcher
-            other_filters.insert(0, "MATCHES(doc, @matcher)")
-
-        if other_filters:
-            other_filters = "FILTER " + " AND ".join(other_filters)
+        search_filters.extend(self.get_scope_filters(bind_vars, matcher))
+        sort_stmt = self.get_seek_sort_stmt(SCO_SORT_FIELDS, bind_vars, search_filters)
 
         query = f"""
-            FOR doc in @@collection SEARCH doc.type IN @types AND doc._is_latest == TRUE
-            {other_filters or ""}
+            FOR doc in @@collection SEARCH {" AND ".join(search_filters)}
 
-            COLLECT id = doc.id INTO docs
-            LET doc = FIRST(FOR d in docs[*].doc SORT d.modified OR d.created DESC, d._record_modified DESC RETURN d)
-            {self.get_sort_stmt(SCO_SORT_FIELDS)}
+            {sort_stmt}
             
             LIMIT @offset, @count
-            RETURN KEEP(doc, KEYS(doc, true))
+            RETURN {self.get_projection()}
         """
-        return self.execute_query(query, bind_vars=bind_vars)
+        return self.execute_query(query, bind_vars=bind_vars, query_name="scos")
 
     def get_smos(self):
         types = SMO_TYPES
@@ -468,20 +894,19 @@ class ArangoDBHelper:
             "types": list(types),
         }
         other_filters = {}
+        search_filters = ["doc.type IN @types", "doc._is_canonical_latest == TRUE"]
+        sort_stmt = self.get_seek_sort_stmt(SMO_SORT_FIELDS, bind_vars, search_filters)
         query = f"""
             FOR doc in @@collection
-            SEARCH doc.type IN @types AND doc._is_latest == TRUE
+            SEARCH {" AND ".join(search_filters)}
             {other_filters or ""}
 
-
-            COLLECT id = doc.id INTO docs
-            LET doc = FIRST(FOR d in docs[*].doc SORT d.modified OR d.created DESC, d._record_modified DESC RETURN d)
-            {self.get_sort_stmt(SMO_SORT_FIELDS)}
+            {sort_stmt}
 
             LIMIT @offset, @count
-            RETURN  KEEP(doc, KEYS(doc, true))
+            RETURN {self.get_projection()}
         """
-        return self.execute_query(query, bind_vars=bind_vars)
+        return self.execute_query(query, bind_vars=bind_vars, query_name="smos")
 
     def get_sdos(self, ttps=None):
         types = SDO_TYPES
@@ -496,7 +921,7 @@ class ArangoDBHelper:
             "types": list(types),
         }
         other_filters = []
-        search_filters = ["doc._is_latest == TRUE"]
+        search_filters = ["doc._is_canonical_latest == TRUE"]
         if term := self.query.get("labels"):
             bind_vars["labels"] = term.lower()
             other_filters.append(
@@ -507,54 +932,25 @@ class ArangoDBHelper:
             bind_vars["name"] = "%" + self.get_like_literal(term).lower() + "%"
             other_filters.append("LOWER(doc.name) LIKE @name")
 
-        ttp_filters = set()
-        for ttp_type in self.query_as_array("ttp_type"):
-            if ttp_type in ["cve", "location", "cwe"]:
-                ttp_types_mapping = dict(
-                    cve="vulnerability", cwe="weakness", location="location"
-                )
-                ttp_stix_types = bind_vars.setdefault("ttp_stix_types", [])
-                ttp_filters.add("doc.type IN @ttp_stix_types")
-                ttp_stix_types.append(ttp_types_mapping[ttp_type])
-            elif ttp_type.endswith("-attack"):
-                ttp_mitre_domains = bind_vars.setdefault("ttp_mitre_domains", [])
-                ttp_mitre_domains.append(ttp_type)
-                ttp_filters.add("doc.x_mitre_domains ANY IN @ttp_mitre_domains")
-            else:
-                ttp_source_name_mapping = dict(
-                    capec="capec",
-                    atlas="mitre-atlas",
-                    disarm="DISARM",
-                    sector="sector2stix",
-                )
-                ttp_source_names = bind_vars.setdefault("ttp_source_names", [])
-                ttp_source_names.append(ttp_source_name_mapping.get(ttp_type))
-                ttp_filters.add(
-                    "doc.external_references[0].source_name IN @ttp_source_names"
-                )
-        if ttp_filters:
-            other_filters.append("({})".format(" OR ".join(ttp_filters)))
+        if ttp_types := self.query_as_array("ttp_type"):
+            bind_vars["ttp_types"] = ttp_types
+            search_filters.append("doc._ttp_source IN @ttp_types")
 
         if ttp_object_type := self.query_as_array("ttp_object_type"):
-            form_list = []
-            for form in ttp_object_type:
-                form_list.extend(ATTACK_FORMS.get(form, []))
+            bind_vars["attack_forms"] = ttp_object_type
+            search_filters.append("doc._attack_form IN @attack_forms")
 
-            if form_list:
-                other_filters.append(
-                    "@attack_form_list[? ANY FILTER MATCHES(doc, CURRENT)]"
-                )
-                bind_vars["attack_form_list"] = form_list
-
-        if ttp_id := self.query.get("ttp_id"):
-            bind_vars["ttp_id"] = ttp_id
-            other_filters.append("doc.external_references[0].external_id == @ttp_id")
+        if ttp_ids := self.query_as_array("ttp_id"):
+            bind_vars["ttp_ids"] = ttp_ids
+            search_filters.append("doc._external_id IN @ttp_ids")
 
         if q := self.query.get("visible_to"):
-            bind_vars["visible_to"] = q
-            bind_vars["marking_visible_to_all"] = TLP_VISIBLE_TO_ALL
+            bind_vars["visibility"] = get_visibility_terms(q)
             search_filters.append(VISIBLE_TO_SEARCH_FILTER)
 
+        search_filters.extend(self.get_scope_filters(bind_vars))
+        sort_stmt = self.get_seek_sort_stmt(SDO_SORT_FIELDS, bind_vars, search_filters)
+
         if other_filters:
             other_filters = "FILTER " + " AND ".join(other_filters)
 
@@ -563,18 +959,86 @@ class ArangoDBHelper:
             SEARCH doc.type IN @types AND {' AND '.join(search_filters)}
             {other_filters or ""}
 
-            
-            COLLECT id = doc.id INTO docs
-            LET doc = FIRST(FOR d in docs[*].doc SORT d.modified OR d.created DESC, d._record_modified DESC RETURN d)
-            {self.get_sort_stmt(SDO_SORT_FIELDS)}
+            {sort_stmt}
 
             LIMIT @offset, @count
-            RETURN  KEEP(doc, KEYS(doc, true))
+            RETURN {self.get_projection()}
         """
         # return HttpResponse(f"{query}\n\n// {__import__('json').dumps(bind_vars)}")
-        return self.execute_query(query, bind_vars=bind_vars)
+        return self.execute_query(query, bind_vars=bind_vars, query_name="sdos")
+
+    def resolve_external_ids(self, external_ids: list[str]):
+        bind_vars = {
+            "@view": self.collection,
+            "external_ids": external_ids,
+            "types": list(SDO_TYPES),
+        }
+        visible_to_filter = ""
+        if visible_to := self.query.get("visible_to"):
+            visible_to_filter = "AND " + VISIBLE_TO_SEARCH_FILTER
+            bind_vars["visibility"] = get_visibility_terms(visible_to)
+
+        query = """
+            FOR doc IN @@view
+            SEARCH doc._external_id IN @external_ids AND doc.type IN @types AND doc._is_canonical_latest == TRUE
+            #visible_to_filter
+            // objects sharing an external id: the newest comes last and wins in dict()
+            SORT doc.modified OR doc.created ASC
+            RETURN [doc._external_id, KEEP(doc, KEYS(doc, true))]
+        """
+        query = query.replace("#visible_to_filter", visible_to_filter)
+        objects = dict(
+            self.execute_query(
+                query, bind_vars=bind_vars, paginate=False, query_name="resolve"
+            )
+        )
+        missing = [
+            external_id for external_id in external_ids if external_id not in objects
+        ]
+        return Response(dict(objects=objects, missing=missing))
+
+    def get_objects_by_key(self, id):
+        """
+        Canonical latest version of `id` read from the primary index of every
+        stix2arango collection (`_key` range `<id>+` to `<id>,`), without the
+        view's commit lag
+        """
+        collections = get_stix_collections(self.db)
+        if not collections:
+            return []
+        bind_vars = {
+            "key_start": id + KEY_SEPARATOR,
+            "key_end": id + KEY_SEPARATOR_END,
+        }
+        visible_to_filter = ""
+        if visible_to := self.query.get("visible_to"):
+            visible_to_filter = "AND " + VISIBLE_TO_SEARCH_FILTER
+            bind_vars["visibility"] = get_visibility_terms(visible_to)
+
+        lookups = []
+        for i, collection_name in enumerate(collections):
+            bind_vars[f"@collection_{i}"] = collection_name
+            lookups.append(
+                f"""(
+                FOR doc IN @@collection_{i}
+                FILTER doc._key >= @key_start AND doc._key < @key_end
+                FILTER doc._is_canonical_latest == TRUE {visible_to_filter}
+                RETURN doc
+            )"""
+            )
+        query = f"""
+            FOR doc IN FLATTEN([{", ".join(lookups)}])
+            LIMIT 1
+            RETURN KEEP(doc, KEYS(doc, true))
+        """
+        return self.execute_query(
+            query, bind_vars=bind_vars, paginate=False, query_name="object"
+        )
 
     def get_objects_by_id(self, id):
+        if conf.OBJECT_KEY_LOOKUP and (objs := self.get_objects_by_key(id)):
+            return Response(objs[0])
+
         bind_vars = {
             "@view": self.collection,
             "id": id,
@@ -582,88 +1046,167 @@ class ArangoDBHelper:
         visible_to_filter = ""
         if visible_to := self.query.get("visible_to"):
             visible_to_filter = "AND " + VISIBLE_TO_SEARCH_FILTER
-            bind_vars.update(
-                visible_to=visible_to, marking_visible_to_all=TLP_VISIBLE_TO_ALL
-            )
+            bind_vars["visibility"] = get_visibility_terms(visible_to)
 
         query = """
             FOR doc in @@view
-            SEARCH doc.id == @id AND doc._is_latest == TRUE
+            SEARCH doc.id == @id AND doc._is_canonical_latest == TRUE
             #visible_to_filter
             LIMIT 1
             RETURN KEEP(doc, KEYS(doc, true))
         """
         query = query.replace("#visible_to_filter", visible_to_filter)
-        objs = self.execute_query(query, bind_vars=bind_vars, paginate=False)
+        objs = self.execute_query(
+            query, bind_vars=bind_vars, paginate=False, query_name="object"
+        )
         if not objs:
             raise NotFound(dict(error=f"No object with id `{id}`"))
         return Response(objs[0])
 
+    def get_objects_by_ids(self, ids: list[str]):
+        bind_vars = {
+            "@view": self.collection,
+            "ids": ids,
+        }
+        visible_to_filter = ""
+        if visible_to := self.query.get("visible_to"):
+            visible_to_filter = "AND " + VISIBLE_TO_SEARCH_FILTER
+            bind_vars["visibility"] = get_visibility_terms(visible_to)
+
+        query = """
+            FOR doc IN @@view
+            SEARCH doc.id IN @ids AND doc._is_canonical_latest == TRUE
+            #visible_to_filter
+            RETURN [doc.id, KEEP(doc, KEYS(doc, true))]
+        """
+        query = query.replace("#visible_to_filter", visible_to_filter)
+        objects = dict(
+            self.execute_query(
+                query, bind_vars=bind_vars, paginate=False, query_name="retrieve"
+            )
+        )
+        missing = [stix_id for stix_id in ids if stix_id not in objects]
+        return Response(dict(objects=objects, missing=missing))
+
     def get_object_bundle(self, stix_id):
+        """
+        The object and everything up to `depth` relationships away from it.
+
+        Walked as a graph traversal over the edge collections that expands every
+        object at most once; objects excluded by `types`, `created_by_refs` or
+        `visible_to` are returned by the step reaching them but not walked through.
+        """
+        depth = positive_int(
+            self.query.get("depth"), cutoff=conf.BUNDLE_MAXIMUM_DEPTH, default=1
+        )
         bind_vars = {
             "@view": self.collection,
             "id": stix_id,
+            "expand_depth": depth - 1,
         }
-        rel_search_filters = []
+        # applied to every relationship walked, pushed down into the traversal
+        path_filters = ["p.edges[*]._is_latest ALL == TRUE"]
+        # applied to the relationships of the expanded objects
+        edge_filters = ["e._is_latest == TRUE"]
+        # objects whose relationships are not walked
+        prune_conditions = []
         late_filters = []
         if not self.query_as_bool("include_embedded_refs", True):
-            rel_search_filters.append("doc._is_ref != TRUE")
+            path_filters.append("p.edges[*]._is_ref ALL != TRUE")
+            edge_filters.append("e._is_ref != TRUE")
 
         if types := self.query_as_array("types"):
-            rel_search_filters.append(
-                "(doc._target_type IN @types OR doc._source_type IN @types)"
+            edge_filters.append(
+                "(e._target_type IN @types OR e._source_type IN @types)"
             )
+            prune_conditions.append("v.type NOT IN @types")
             late_filters.append("FILTER doc.type IN @types")
             bind_vars["types"] = types
 
         if not self.query_as_bool("include_embedded_sros", False):
             late_filters.append("FILTER doc._is_ref != TRUE")
 
-        visible_to_filter = ""
-
         if created_by_refs := self.query_as_array("created_by_refs"):
+            prune_conditions.append("v.created_by_ref NOT IN @created_by_refs")
             late_filters.append(
                 "FILTER doc.created_by_ref IN @created_by_refs OR doc.id == @id"
             )
             bind_vars["created_by_refs"] = created_by_refs
 
         if q := self.query.get("visible_to"):
-            bind_vars["visible_to"] = q
-            bind_vars["marking_visible_to_all"] = TLP_VISIBLE_TO_ALL
-            visible_to_filter = "FILTER " + VISIBLE_TO_REGULAR_FILTER
+            bind_vars["visibility"] = get_visibility_terms(q)
+            prune_conditions.append("v._visibility NOT IN @visibility")
+            late_filters.append("FILTER " + VISIBLE_TO_SEARCH_FILTER)
+
+        edge_collections = get_stix_collections(self.db, EDGE_COLLECTION_SUFFIX)
+        for i, collection_name in enumerate(edge_collections):
+            bind_vars[f"@edge_collection_{i}"] = collection_name
+        edges = ", ".join(
+            f"@@edge_collection_{i}" for i in range(len(edge_collections))
+        )
+        # clusters only let traversals and DOCUMENT() read collections declared upfront
+        vertex_collections = get_stix_collections(self.db, VERTEX_COLLECTION_SUFFIX)
+        for i, collection_name in enumerate(vertex_collections):
+            bind_vars[f"@vertex_collection_{i}"] = collection_name
+        with_stmt = ""
+        if vertex_collections:
+            with_stmt = "WITH " + ", ".join(
+                f"@@vertex_collection_{i}" for i in range(len(vertex_collections))
+            )
 
-        query = """
-            LET bundle_ids = FLATTEN(FOR doc in @@view SEARCH (doc.source_ref == @id or doc.target_ref == @id) AND doc._is_latest == TRUE /* rel_search_extras */ RETURN [doc._id, doc._from, doc._to])
-            FOR doc IN @@view
-            SEARCH (doc._id IN bundle_ids OR (doc.id == @id AND doc._is_latest == TRUE))
+        prune_stmt = ""
+        if prune_conditions:
+            # the object itself is always expanded
+            prune = f"LENGTH(p.edges) > 0 AND ({' OR '.join(prune_conditions)})"
+            prune_stmt = f"PRUNE {prune}"
+            path_filters.append(f"NOT ({prune})")
+
+        traversal = ""
+        if edge_collections:
+            traversal = f"""
+            LET expanded_ids = UNIQUE(
+                FOR start IN starts
+                    FOR v, e, p IN 0..@expand_depth ANY start._id {edges}
+                        {prune_stmt}
+                        OPTIONS {{order: "bfs", uniqueVertices: "global"}}
+                        FILTER {' AND '.join(path_filters)}
+                        RETURN v._id
+            )
+            LET bundle_ids = FLATTEN(
+                FOR vertex_id IN expanded_ids
+                    FOR v, e IN 1..1 ANY vertex_id {edges}
+                        FILTER {' AND '.join(edge_filters)}
+                        RETURN [e._id, v._id]
+            )"""
+
+        query = f"""
+            {with_stmt}
+            LET starts = (FOR doc IN @@view SEARCH doc.id == @id RETURN KEEP(doc, "_id", "_is_latest"))
+            LET start_ids = starts[* FILTER CURRENT._is_latest == TRUE]._id
+            {traversal or "LET bundle_ids = []"}
+            FOR doc_id IN UNIQUE(APPEND(start_ids, bundle_ids))
+            LET doc = DOCUMENT(doc_id)
             // extra_search
-            // visible_to_filter
             LET sort_doc = KEEP(doc, 'modified', 'created')
             // sort_stmt
             LIMIT @offset, @count
             RETURN KEEP(doc, KEYS(doc, TRUE))
         """
-        if rel_search_filters:
-            query = query.replace(
-                "/* rel_search_extras */", " AND " + " AND ".join(rel_search_filters)
-            )
         if late_filters:
             query = query.replace("// extra_search", "\n".join(late_filters))
 
-        if visible_to_filter:
-            query = query.replace("// visible_to_filter", visible_to_filter)
-
         query = query.replace(
             "// sort_stmt", self.get_sort_stmt(BUNDLE_SORT_FIELDS, doc_name="sort_doc")
         )
-        return self.execute_query(query, bind_vars=bind_vars)
+        return self.execute_query(query, bind_vars=bind_vars, query_name="bundle")
 
     def get_sros(self):
         bind_vars = {
             "@collection": self.collection,
         }
 
-        search_filters = ["doc._is_latest == TRUE"]
+        search_filters = ["doc._is_canonical_latest == TRUE"]
+        collapse_versions = ""
 
         if terms := self.query_as_array("source_ref_type"):
             bind_vars["source_ref_type"] = terms
@@ -673,48 +1216,65 @@ class ArangoDBHelper:
             bind_vars["target_ref_type"] = terms
             search_filters.append("doc._target_type IN @target_ref_type")
 
-        if term := self.query.get("relationship_type"):
-            bind_vars["relationship_type"] = (
-                "%" + self.get_like_literal(term).lower() + "%"
-            )
-            search_filters.append("doc.relationship_type LIKE @relationship_type")
+        if terms := self.query_as_array("relationship_type"):
+            if self.query_as_bool("relationship_type_exact", False):
+                bind_vars["relationship_type"] = terms
+                search_filters.append("doc.relationship_type IN @relationship_type")
+            else:
+                like_filters = []
+                for i, term in enumerate(terms):
+                    bind_vars[f"relationship_type_{i}"] = (
+                        "%" + self.get_like_literal(term).lower() + "%"
+                    )
+                    like_filters.append(
+                        f"doc.relationship_type LIKE @relationship_type_{i}"
+                    )
+                search_filters.append(f"({' OR '.join(like_filters)})")
 
         if not self.query_as_bool("include_embedded_refs", True):
             search_filters.append("doc._is_ref != TRUE")
 
-        if term := self.query.get("target_ref"):
-            bind_vars["target_ref"] = term
-            search_filters.append("doc.target_ref == @target_ref")
+        if terms := self.query_as_array("target_ref"):
+            bind_vars["target_ref"] = terms
+            search_filters.append("doc.target_ref IN @target_ref")
 
-        if term := self.query.get("source_ref"):
-            bind_vars["source_ref"] = term
-            search_filters.append("doc.source_ref == @source_ref")
+        if terms := self.query_as_array("source_ref"):
+            bind_vars["source_ref"] = terms
+            search_filters.append("doc.source_ref IN @source_ref")
 
         if not self.SRO_OBJECTS_ONLY_LATEST:
             search_filters[0] = (
                 "(doc._is_latest == TRUE OR doc._target_type IN @sco_types OR doc._source_type IN @sco_types)"
             )
             bind_vars["sco_types"] = list(SCO_TYPES)
+            # older versions are listed too, only the newest of each id is kept
+            collapse_versions = COLLAPSE_VERSIONS
 
         if q := self.query.get("visible_to"):
-            bind_vars["visible_to"] = q
-            bind_vars["marking_visible_to_all"] = TLP_VISIBLE_TO_ALL
+            bind_vars["visibility"] = get_visibility_terms(q)
             search_filters.append(VISIBLE_TO_SEARCH_FILTER)
 
+        search_filters.extend(self.get_scope_filters(bind_vars))
+        # a cursor searched before the versions are collapsed could bring back an id
+        # whose newest version was already listed
+        sort_stmt = self.get_seek_sort_stmt(
+            SRO_SORT_FIELDS,
+            bind_vars,
+            None if collapse_versions else search_filters,
+        )
+
         query = f"""
             FOR doc in @@collection
             SEARCH doc.type == 'relationship' AND { ' AND '.join(search_filters) }
-
-            COLLECT id = doc.id INTO docs
-            LET doc = FIRST(FOR d in docs[*].doc SORT d.modified OR d.created DESC, d._record_modified DESC RETURN d)
-            {self.get_sort_stmt(SRO_SORT_FIELDS)}
+            {collapse_versions}
+            {sort_stmt}
 
             LIMIT @offset, @count
-            RETURN KEEP(doc, KEYS(doc, true))
+            RETURN {self.get_projection()}
 
         """
         # return HttpResponse(content=f"{query}\n\n// {__import__('json').dumps(bind_vars)}")
-        return self.execute_query(query, bind_vars=bind_vars)
+        return self.execute_query(query, bind_vars=bind_vars, query_name="sros")
 
     def delete_report_objects(self, report_id, object_ids):
         db_service = ArangoDBService(
@@ -781,4 +1341,6 @@ class ArangoDBHelper:
                 paginate=False,
             )
             db_service.update_is_latest_several(report_ref_ids, collection_name)
+            canonical_latest.update_canonical_latest(self.db, report_ref_ids)
+            result_cache.bump_generation(self.db)
         return Response(dict(removed_objects=report_ref_ids))
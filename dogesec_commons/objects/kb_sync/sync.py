@@ -2,6 +2,9 @@ import itertools
 import time
 from urllib.parse import urljoin
 
+from dogesec_commons.objects import result_cache
+from dogesec_commons.objects.canonical_latest import update_canonical_latest
+from dogesec_commons.objects.derived_fields import add_derived_fields
 from dogesec_commons.objects.helpers import ArangoDBHelper
 from dogesec_commons.objects.kb_sync.mappings import KNOWLEDGEBASE_TYPE_MAPPING
 from dogesec_commons.objects.kb_sync.retriever import STIXObjectRetriever
@@ -82,6 +85,7 @@ def get_updates_for_ids(
             config.get("result_key", "objects"),
         ):
             obj["_kb_update_time"] = update_time
+            add_derived_fields(obj)
             updates[obj["id"]] = obj
 
     return updates
@@ -120,6 +124,9 @@ RETURN updated_count
         bind_vars=bind_vars,
         paginate=False,
     )
+    # `modified` may have changed, so may the version the list endpoints return
+    update_canonical_latest(helper.db, updates)
+    result_cache.bump_generation(helper.db)
 
     return result[0] if result else 0
 
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from dogesec_commons.objects import canonical_latest, db_pool
+
+
+class Command(BaseCommand):
+    help = "Mark the version of each STIX id the list endpoints return on objects uploaded before `_is_canonical_latest` was introduced"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collection",
+            action="append",
+            dest="collections",
+            help="collection to backfill, can be repeated (default: every vertex and edge collection)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, collections=None, batch_size=1000, **options):
+        db = db_pool.get_database()
+        updated = canonical_latest.backfill(db, collections, batch_size=batch_size)
+        for collection_name, count in updated.items():
+            self.stdout.write(f"{collection_name}: updated {count} objects")
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dogesec_commons.objects import bootstrap
+
+
+class Command(BaseCommand):
+    help = "Create the ArangoDB database, analyzers and view, and link every collection to the view"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="run even if the recorded setup is current",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=None,
+            help="seconds to wait for a bootstrap running elsewhere (default: no limit)",
+        )
+
+    def handle(self, *args, force=False, timeout=None, **options):
+        try:
+            done = bootstrap.bootstrap(force=force, timeout=timeout)
+        except bootstrap.LockNotAcquired as e:
+            raise CommandError(f"could not acquire the bootstrap lock: {e}")
+        if done:
+            self.stdout.write("database bootstrapped")
+        else:
+            self.stdout.write("database already up to date")
@@ -0,0 +1,106 @@
+"""
+Execution statistics of the AQL queries run by `ArangoDBHelper`.
+
+Every query is recorded against the endpoint that ran it and a fingerprint of
+its normalized template, so the same filter combination always lands in the
+same series whatever the bind vars are. Totals are kept in the memory of each
+process, not shared between workers, and are rendered in the Prometheus text
+format by `render_prometheus()`.
+"""
+
+import hashlib
+import logging
+import threading
+
+from . import conf
+
+slow_query_logger = logging.getLogger("dogesec_commons.objects.slow_queries")
+
+# cursor.statistics() key -> metric name, help text
+STAT_METRICS = {
+    "execution_time": ("execution_seconds_total", "Time spent executing queries"),
+    "scanned_index": ("scanned_index_total", "Documents read from indexes"),
+    "scanned_full": ("scanned_full_total", "Documents read by full collection scans"),
+    "filtered": ("filtered_total", "Documents removed by FILTER conditions"),
+    "peak_memory_usage": ("peak_memory_bytes_total", "Sum of peak memory per query"),
+}
+METRIC_PREFIX = "dogesec_commons_aql_"
+
+_lock = threading.Lock()
+_totals: dict[tuple[str, str], dict] = {}
+
+
+def normalize_aql(query: str):
+    return " ".join(query.split())
+
+
+def fingerprint(query: str):
+    return hashlib.sha256(normalize_aql(query).encode()).hexdigest()[:16]
+
+
+def bind_var_shapes(bind_vars: dict):
+    """Describe bind vars without their values, e.g. `{"types": "list[3]"}`"""
+    shapes = {}
+    for key, value in bind_vars.items():
+        if key.startswith("@"):
+            shapes[key] = value
+        elif isinstance(value, (list, tuple, set, dict)):
+            shapes[key] = f"{type(value).__name__}[{len(value)}]"
+        else:
+            shapes[key] = type(value).__name__
+    return shapes
+
+
+def record(endpoint, query, bind_vars, statistics: dict):
+    endpoint = endpoint or "internal"
+    stats = {key: statistics.get(key) or 0 for key in STAT_METRICS}
+    query_fingerprint = fingerprint(query)
+    with _lock:
+        totals = _totals.setdefault(
+            (endpoint, query_fingerprint), dict.fromkeys(STAT_METRICS, 0) | {"count": 0}
+        )
+        totals["count"] += 1
+        for key, value in stats.items():
+            totals[key] += value
+
+    if stats["execution_time"] >= conf.SLOW_QUERY_THRESHOLD:
+        slow_query_logger.warning(
+            "slow query on %s (%s) took %.3fs: %s",
+            endpoint,
+            query_fingerprint,
+            stats["execution_time"],
+            dict(
+                stats,
+                bind_vars=bind_var_shapes(bind_vars),
+                query=normalize_aql(query),
+            ),
+        )
+    return stats
+
+
+def server_timing(endpoint, stats: dict):
+    return f'aql;dur={stats["execution_time"] * 1000:.1f};desc="{endpoint}"'
+
+
+def render_prometheus():
+    with _lock:
+        totals = {key: dict(value) for key, value in _totals.items()}
+    lines = [
+        f"# HELP {METRIC_PREFIX}queries_total Number of queries executed",
+        f"# TYPE {METRIC_PREFIX}queries_total counter",
+    ]
+    for (endpoint, query_fingerprint), values in sorted(totals.items()):
+        labels = f'endpoint="{endpoint}",fingerprint="{query_fingerprint}"'
+        lines.append(f"{METRIC_PREFIX}queries_total{{{labels}}} {values['count']}")
+    for key, (name, help_text) in STAT_METRICS.items():
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        for (endpoint, query_fingerprint), values in sorted(totals.items()):
+            labels = f'endpoint="{endpoint}",fingerprint="{query_fingerprint}"'
+            lines.append(f"{METRIC_PREFIX}{name}{{{labels}}} {values[key]}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _totals.clear()
@@ -0,0 +1,192 @@
+"""
+Cache of the results of the list and by-id queries run by `ArangoDBHelper`.
+
+Entries are keyed on the normalized query, its bind vars and the data
+generation: a counter kept in the `_dogesec_commons` collection that every
+writer (stixifier uploads, knowledge base sync, report object deletion) bumps
+with `bump_generation()`. A write makes all the entries cached before it
+unreachable instead of deleting them; they age out of the backend on their own.
+
+The backend is chosen with `RESULT_CACHE_BACKEND`: `lru` (per process),
+`django` (a Django cache, shared between processes when that cache is) or the
+dotted path of a class with the same `get()` / `set()` methods.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from arango.database import StandardDatabase
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from . import conf
+from .bootstrap import META_COLLECTION, get_meta_collection
+from .query_stats import normalize_aql
+
+GENERATION_KEY = "data_generation"
+CACHE_KEY_PREFIX = "dogesec_commons:results:"
+
+BUMP_GENERATION_QUERY = """
+    UPSERT {_key: @key}
+    INSERT {_key: @key, generation: 1}
+    UPDATE {generation: OLD.generation + 1}
+    IN @@collection
+    RETURN NEW.generation
+"""
+
+
+class LRUBackend:
+    """Per process cache of the `max_entries` most recently used results"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            expires_at, value = self._entries.get(key, (0, None))
+            if expires_at <= time.time():
+                self._entries.pop(key, None)
+                return None
+            self._entries.move_to_end(key)
+        # callers may change what they are given
+        return copy.deepcopy(value)
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.time() + timeout, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, value, timeout):
+        caches[self.alias].set(key, value, timeout)
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+BACKENDS = {
+    "lru": LRUBackend,
+    "django": DjangoCacheBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+# database name -> (time it is read again, generation)
+_generations: dict[str, tuple[float, int]] = {}
+_generations_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if not conf.RESULT_CACHE_BACKEND:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            backend_class = BACKENDS.get(conf.RESULT_CACHE_BACKEND)
+            if backend_class is None:
+                backend_class = import_string(conf.RESULT_CACHE_BACKEND)
+            _backend = backend_class(**conf.RESULT_CACHE_OPTIONS)
+        return _backend
+
+
+def remember_generation(db: StandardDatabase, generation):
+    with _generations_lock:
+        _generations[db.name] = (
+            time.time() + conf.RESULT_CACHE_GENERATION_TTL,
+            generation,
+        )
+
+
+def get_generation(db: StandardDatabase):
+    """Current data generation of `db`, re-read at most once per `RESULT_CACHE_GENERATION_TTL`"""
+    with _generations_lock:
+        expires_at, generation = _generations.get(db.name, (0, None))
+    if generation is not None and expires_at > time.time():
+        return generation
+    generation = 0
+    if db.has_collection(META_COLLECTION):
+        doc = db.collection(META_COLLECTION).get(GENERATION_KEY) or {}
+        generation = doc.get("generation", 0)
+    remember_generation(db, generation)
+    return generation
+
+
+def bump_generation(db: StandardDatabase):
+    """Make every result cached so far stale, run after writing to `db`"""
+    try:
+        get_meta_collection(db)
+        cursor = db.aql.execute(
+            BUMP_GENERATION_QUERY,
+            bind_vars={"key": GENERATION_KEY, "@collection": META_COLLECTION},
+        )
+        generation = next(cursor, None)
+    except Exception as e:
+        # cached results still expire after RESULT_CACHE_TTL
+        logging.exception(e)
+        return None
+    remember_generation(db, generation)
+    return generation
+
+
+def get_cache_key(db: StandardDatabase, query_name, query, bind_vars: dict, *args):
+    """None when results of `query_name` are not cached"""
+    if not get_backend() or query_name not in conf.RESULT_CACHE_QUERIES:
+        return None
+    try:
+        generation = get_generation(db)
+    except Exception as e:
+        logging.exception(e)
+        return None
+    data = json.dumps(
+        [db.name, generation, normalize_aql(query), bind_vars, *args],
+        sort_keys=True,
+        default=str,
+    )
+    return CACHE_KEY_PREFIX + hashlib.sha256(data.encode()).hexdigest()
+
+
+def get_result(key):
+    if not key:
+        return None
+    try:
+        return get_backend().get(key)
+    except Exception as e:
+        logging.exception(e)
+        return None
+
+
+def set_result(key, value):
+    if not key:
+        return
+    try:
+        get_backend().set(key, value, conf.RESULT_CACHE_TTL)
+    except Exception as e:
+        logging.exception(e)
+
+
+def reset():
+    global _backend
+    with _backend_lock:
+        _backend = None
+    with _generations_lock:
+        _generations.clear()
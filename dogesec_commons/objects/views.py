@@ -1,7 +1,9 @@
 import contextlib
-from dogesec_commons.objects import conf
+import hmac
+from dogesec_commons.objects import conf, query_stats
 from dogesec_commons.utils.schemas import DEFAULT_400_RESPONSE, DEFAULT_404_RESPONSE
 from dogesec_commons.utils.serializers import CommonErrorSerializer
+from .db_view_creator import SCO_SEARCH_FIELDS
 from .helpers import (
     BUNDLE_SORT_FIELDS,
     OBJECT_TYPES,
@@ -28,6 +30,8 @@ from rest_framework import viewsets, exceptions, decorators
 from rest_framework.response import Response
 
 from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
 
 import textwrap
 
@@ -38,6 +42,26 @@ OBJECT_ID_PATTERN = (
 
 
 class QueryParams:
+    cursor = OpenApiParameter(
+        "cursor",
+        description=textwrap.dedent(
+            """
+            Opaque position returned in `next_cursor` by the previous page. When passed, `page` is ignored and results start right after that position, so deep pages are served as fast as the first one.
+            A cursor is only valid with the `sort` it was issued for. Pages fetched with a cursor are not counted, `total_results_count` is `null` unless `count=estimate` has a count of the same filters.
+            """
+        ),
+    )
+    fields = OpenApiParameter(
+        "fields",
+        many=True,
+        explode=False,
+        description=textwrap.dedent(
+            """
+            Only return these top level properties of each object, e.g. `id,type,name,modified`. Properties an object does not have are returned as `null`, and the properties of the `sort` are always included.
+            `id`, `type`, `name`, `created` and `modified` are read from the search index without loading the objects, so lists of only these properties are the fastest to fetch.
+            """
+        ),
+    )
     value = OpenApiParameter(
         "value",
         description=textwrap.dedent(
@@ -45,6 +69,7 @@ class QueryParams:
             Search by the `value` field field of the SCO. This is the IoC. So if you're looking to retrieve a IP address by address you would enter the IP address here. Similarly, if you're looking for a credit card you would enter the card number here.
             Search is wildcard. For example, `1.1` will return SCOs with `value` fields; `1.1.1.1`, `2.1.1.2`, etc.
             If `value` field is named differently for the Object (e.g. `hash`) it will still be searched because these have been aliased to the `value` in the database search).
+            `autonomous-system.number` is the exception: it is a number, so it only matches a `value` of the whole number (e.g. `15169`, not `151`), wildcard or not.
             """
         ),
     )
@@ -67,12 +92,35 @@ class QueryParams:
             """
         ),
     )
+    report_id = OpenApiParameter(
+        "report_id",
+        description=textwrap.dedent(
+            """
+            Filter the results to only contain objects present in the specified Report ID, e.g. `report--6ae57ee1-39c9-4c6b-88a9-1d73d9efff7f`.
+            """
+        ),
+    )
+    value_fields = OpenApiParameter(
+        "value_fields",
+        many=True,
+        explode=False,
+        description=textwrap.dedent(
+            """
+            Properties the `value` filter searches. By default only the identifying properties of the SCO types in `types` are searched (all of them if `types` is not passed), and the large `artifact.payload_bin` and `email-message.body` properties are skipped unless `types` is limited to artifacts. Pass e.g. `body,subject` to search exactly these properties.
+            """
+        ),
+        enum=SCO_SEARCH_FIELDS,
+    )
     SCO_PARAMS = [
         value,
+        value_fields,
         sco_types,
         post_id,
+        report_id,
         OpenApiParameter("sort", enum=SCO_SORT_FIELDS),
         OpenApiParameter("value_exact", type=OpenApiTypes.BOOL, description="Set to `true` to only return exact matches on the `value` field. Default behaviour is wildcard search."),
+        cursor,
+        fields,
     ]
 
     ttp_type = OpenApiParameter(
@@ -101,7 +149,7 @@ class QueryParams:
         "ttp_id",
         description=textwrap.dedent(
             """
-            Filter results by external ID of TTP object. i.e T1047, CVE-2023-12345
+            Filter results by external ID of TTP object. i.e T1047, CVE-2023-12345. Pass in the format `T1047,T1059` to match any of several IDs.
             """
         ),
     )
@@ -150,7 +198,11 @@ class QueryParams:
         name,
         labels,
         sdo_types,
+        post_id,
+        report_id,
         OpenApiParameter("sort", enum=SDO_SORT_FIELDS),
+        cursor,
+        fields,
     ]
     TTP_PARAMS = [
         name,
@@ -160,13 +212,18 @@ class QueryParams:
         ttp_id,
         ttp_object_type,
         OpenApiParameter("sort", enum=SDO_SORT_FIELDS),
+        cursor,
+        fields,
     ]
 
     source_ref = OpenApiParameter(
         "source_ref",
+        many=True,
+        explode=False,
         description=textwrap.dedent(
             """
             Filter the results on the `source_ref` fields. The value entered should be a full ID of a STIX SDO or SCO which can be obtained from the respective Get Object endpoints. This endpoint allows for graph traversal use-cases as it returns STIX `relationship` objects that will tell you what objects are related to the one entered (in the `target_ref` property).
+            Pass several comma-separated IDs to get the relationships of all of them in one request.
             """
         ),
     )
@@ -182,9 +239,12 @@ class QueryParams:
     )
     target_ref = OpenApiParameter(
         "target_ref",
+        many=True,
+        explode=False,
         description=textwrap.dedent(
             """
             Filter the results on the `target_ref` fields. The value entered should be a full ID of a STIX SDO or SCO which can be obtained from the respective Get Object endpoints. This endpoint allows for graph traversal use-cases as it returns STIX `relationship` objects that will tell you what objects are related to the one entered (in the `source_ref` property).
+            Pass several comma-separated IDs to get the relationships of all of them in one request.
             """
         ),
     )
@@ -200,12 +260,20 @@ class QueryParams:
     )
     relationship_type = OpenApiParameter(
         "relationship_type",
+        many=True,
+        explode=False,
         description=textwrap.dedent(
             """
             Filter the results on the `relationship_type` field. Search is wildcard. For example, `in` will return `relationship` objects with ``relationship_type`s; `found-in`, `located-in`, etc.
+            Pass several comma-separated values to match any of them.
             """
         ),
     )
+    relationship_type_exact = OpenApiParameter(
+        "relationship_type_exact",
+        type=OpenApiTypes.BOOL,
+        description="Set to `true` to only return relationships whose `relationship_type` is exactly one of the values of `relationship_type`. This is much faster than the default wildcard search.",
+    )
     include_embedded_refs = OpenApiParameter(
         "include_embedded_refs",
         description=textwrap.dedent(
@@ -228,8 +296,13 @@ class QueryParams:
         target_ref,
         target_ref_type,
         relationship_type,
+        relationship_type_exact,
         include_embedded_refs,
+        post_id,
+        report_id,
         OpenApiParameter("sort", enum=SRO_SORT_FIELDS),
+        cursor,
+        fields,
     ]
 
     all_types = OpenApiParameter(
@@ -261,8 +334,21 @@ class QueryParams:
     SMO_PARAMS = [
         smo_types,
         OpenApiParameter("sort", enum=SMO_SORT_FIELDS),
+        cursor,
+        fields,
     ]
 
+    export_format = OpenApiParameter(
+        "export_format",
+        enum=conf.EXPORT_FORMATS,
+        description=textwrap.dedent(
+            """
+            `ndjson` (default) writes one STIX object per line. `bundle` wraps all objects in a single STIX bundle.
+            The download is gzip compressed when the request sends `Accept-Encoding: gzip`.
+            """
+        ),
+    )
+
     object_id_param = OpenApiParameter(
         "object_id",
         description="Filter by the STIX object ID. e.g. `ipv4-addr--ba6b3f21-d818-4e7c-bfff-765805177512`, `indicator--7bff059e-6963-4b50-b901-4aba20ce1c01`",
@@ -276,6 +362,15 @@ class QueryParams:
         description="Only show objects that are visible to the Identity `id` passed. e.g. passing `identity--b1ae1a15-6f4b-431e-b990-1b9678f35e15` would only show reports created by that identity (with any TLP level) or objects created by another identity ID but only if they are marked with `TLP:WHITE` (v1), `TLP:CLEAR` (v2) or `TLP:GREEN` (v2). Logically visible to will return an object if 1) `created_by_ref equals visible_to (any TLP marking definitions not considered)` OR 2) `object_marking_ref contains a TLP:WHITE, TLP:CLEAR, or TLP:GREEN marking definition reference (any created_by_ref identity)` OR 3) `created_by_ref IS NULL` (this condition ensures SCOs with no created_by_ref always show)",
         type=OpenApiTypes.STR,
     )
+    bundle_depth = OpenApiParameter(
+        "depth",
+        type=OpenApiTypes.INT,
+        description=textwrap.dedent(
+            f"""
+            How many relationships away from the object to walk. `1` (default) returns the objects directly related to it, `2` also returns the objects related to those, and so on, up to {conf.BUNDLE_MAXIMUM_DEPTH}. Objects excluded by `types`, `created_by_refs` or `visible_to` are not walked through.
+            """
+        ),
+    )
     created_by_refs = OpenApiParameter(
         "created_by_refs",
         many=True,
@@ -288,6 +383,31 @@ class QueryParams:
     )
 
 
+EXPORT_RESPONSES = {
+    (200, "application/x-ndjson"): OpenApiResponse(
+        OpenApiTypes.STR, "One STIX object per line, used for `export_format=ndjson`"
+    ),
+    (200, "application/json"): OpenApiResponse(
+        {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "example": "bundle"},
+                "id": {
+                    "type": "string",
+                    "example": "bundle--c7e3c0b6-0b6d-4b2e-9b0e-4c2c6a7b5a6f",
+                },
+                "objects": {
+                    "type": "array",
+                    "items": ArangoDBHelper.STIX_OBJECT_SCHEMA,
+                },
+            },
+        },
+        "STIX bundle, used for `export_format=bundle`",
+    ),
+    400: DEFAULT_400_RESPONSE,
+}
+
+
 OBJ404_RESP_SCHEMA = OpenApiResponse(
                 CommonErrorSerializer,
                 "No such object",
@@ -305,6 +425,28 @@ OBJ404_RESP_SCHEMA = OpenApiResponse(
                 ],
             )
 
+
+OBJECT_ID_ARRAY = {
+    "type": "array",
+    "items": {
+        "type": "string",
+        "pattern": "^[a-z\\-]+--[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$",
+        "example": "ipv4-addr--ba6b3f21-d818-4e7c-bfff-765805177512",
+    },
+}
+RETRIEVE_RESPONSE = {
+    "type": "object",
+    "properties": {
+        "objects": {
+            "type": "object",
+            "additionalProperties": ArangoDBHelper.STIX_OBJECT_SCHEMA,
+        },
+        "missing": OBJECT_ID_ARRAY,
+    },
+    "required": ["objects", "missing"],
+}
+
+
 @extend_schema_view(
     retrieve=extend_schema(
         summary="Get a STIX Object",
@@ -320,6 +462,19 @@ OBJ404_RESP_SCHEMA = OpenApiResponse(
         },
         parameters=[QueryParams.object_id_param, QueryParams.visible_to],
     ),
+    retrieve_multi=extend_schema(
+        request={"application/json": {**OBJECT_ID_ARRAY, "maxItems": conf.MAXIMUM_RETRIEVE_IDS}},
+        responses={200: RETRIEVE_RESPONSE, 400: DEFAULT_400_RESPONSE},
+        parameters=[QueryParams.visible_to],
+        summary="Get multiple STIX Objects",
+        description=textwrap.dedent(
+            f"""
+            Get the latest version of each of up to {conf.MAXIMUM_RETRIEVE_IDS} STIX Objects by their IDs in a single request, e.g. all the `object_refs` of a report.
+
+            The response maps every ID found to its object, and lists the ones that were not found (or are not visible to `visible_to`) in `missing`.
+            """
+        ),
+    ),
     bundle=extend_schema(
         summary="Get STIX Object's Bundle",
         description=textwrap.dedent(
@@ -336,6 +491,7 @@ OBJ404_RESP_SCHEMA = OpenApiResponse(
             QueryParams.include_embedded_sros,
             QueryParams.visible_to,
             QueryParams.created_by_refs,
+            QueryParams.bundle_depth,
             OpenApiParameter("sort", enum=BUNDLE_SORT_FIELDS)
         ],
     ),
@@ -350,6 +506,24 @@ class SingleObjectView(viewsets.ViewSet):
             kwargs.get(self.lookup_url_kwarg)
         )
 
+    @decorators.action(detail=False, methods=["POST"], url_path="retrieve")
+    def retrieve_multi(self, request, *args, **kwargs):
+        data = request.data
+        if not isinstance(data, list) or not all(isinstance(d, str) for d in data):
+            raise exceptions.ValidationError(
+                dict(error="request body must be an array of STIX object IDs")
+            )
+        if len(data) > conf.MAXIMUM_RETRIEVE_IDS:
+            raise exceptions.ValidationError(
+                dict(
+                    error=f"cannot retrieve more than {conf.MAXIMUM_RETRIEVE_IDS} objects at once"
+                )
+            )
+        stix_ids = list(dict.fromkeys(data))
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request
+        ).get_objects_by_ids(stix_ids)
+
     @decorators.action(detail=True, methods=["GET"])
     def bundle(self, request, *args, **kwargs):
         return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_object_bundle(
@@ -357,14 +531,6 @@ class SingleObjectView(viewsets.ViewSet):
         )
 
 
-OBJECT_ID_ARRAY = {
-    "type": "array",
-    "items": {
-        "type": "string",
-        "pattern": "^[a-z\\-]+--[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$",
-        "example": "ipv4-addr--ba6b3f21-d818-4e7c-bfff-765805177512",
-    },
-}
 DELETE_OBJECTS_RESPONSE = {
     "type": "object",
     "properties": {"removed_objects": OBJECT_ID_ARRAY},
@@ -372,6 +538,23 @@ DELETE_OBJECTS_RESPONSE = {
     "additionalProperties": False,
 }
 
+EXTERNAL_ID_ARRAY = {
+    "type": "array",
+    "items": {"type": "string", "example": "T1047"},
+    "maxItems": conf.MAXIMUM_RESOLVE_IDS,
+}
+RESOLVE_RESPONSE = {
+    "type": "object",
+    "properties": {
+        "objects": {
+            "type": "object",
+            "additionalProperties": ArangoDBHelper.STIX_OBJECT_SCHEMA,
+        },
+        "missing": EXTERNAL_ID_ARRAY,
+    },
+    "required": ["objects", "missing"],
+}
+
 
 @extend_schema_view(
     destroy_in_report=extend_schema(
@@ -459,6 +642,30 @@ class ObjectsWithReportsView(SingleObjectView):
             """
         ),
     ),
+    resolve=extend_schema(
+        request={"application/json": EXTERNAL_ID_ARRAY},
+        responses={200: RESOLVE_RESPONSE, 400: DEFAULT_400_RESPONSE},
+        parameters=[QueryParams.visible_to],
+        summary="Resolve external IDs to STIX Domain Objects",
+        description=textwrap.dedent(
+            f"""
+            Look up the latest domain object for each of up to {conf.MAXIMUM_RESOLVE_IDS} external IDs (e.g. `T1047`, `CVE-2023-12345`) in a single request.
+
+            The response maps every external ID found to its object, and lists the ones that were not found in `missing`.
+            """
+        ),
+    ),
+    export=extend_schema(
+        responses=EXPORT_RESPONSES,
+        parameters=QueryParams.SDO_PARAMS
+        + [QueryParams.visible_to, QueryParams.export_format],
+        summary="Export STIX Domain Objects",
+        description=textwrap.dedent(
+            """
+            Download every domain object matching the filters in a single streamed response. Accepts the same filters as the Search and filter STIX Domain Objects endpoint.
+            """
+        ),
+    ),
 )
 class SDOView(viewsets.ViewSet):
     skip_list_view = True
@@ -467,10 +674,34 @@ class SDOView(viewsets.ViewSet):
     def list(self, request, *args, **kwargs):
         return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_sdos()
 
+    @decorators.action(methods=["GET"], detail=False)
+    def export(self, request, *args, **kwargs):
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request, export=True
+        ).get_sdos()
+
     @decorators.action(methods=["GET"], detail=False)
     def knowledgebases(self, request, *args, **kwargs):
         return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_sdos(ttps=True)
 
+    @decorators.action(methods=["POST"], detail=False)
+    def resolve(self, request, *args, **kwargs):
+        data = request.data
+        if not isinstance(data, list) or not all(isinstance(d, str) for d in data):
+            raise exceptions.ValidationError(
+                dict(error="request body must be an array of external IDs")
+            )
+        if len(data) > conf.MAXIMUM_RESOLVE_IDS:
+            raise exceptions.ValidationError(
+                dict(
+                    error=f"cannot resolve more than {conf.MAXIMUM_RESOLVE_IDS} external IDs at once"
+                )
+            )
+        external_ids = list(dict.fromkeys(data))
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request
+        ).resolve_external_ids(external_ids)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -484,8 +715,8 @@ class SDOView(viewsets.ViewSet):
 
             Note the `value` filter searches the following object properties;
 
-            * `artifact.payload_bin`
-            * `autonomous-system.number`
+            * `artifact.payload_bin` (only when `types=artifact` or `value_fields=payload_bin`)
+            * `autonomous-system.number` (whole number only, `151` does not match `15169`)
             * `bank-account.iban`
             * `payment-card.value`
             * `cryptocurrency-transaction.value`
@@ -493,7 +724,8 @@ class SDOView(viewsets.ViewSet):
             * `directory.path`
             * `domain-name.value`
             * `email-addr.value`
-            * `email-message.body`
+            * `email-message.subject`
+            * `email-message.body` (only with `value_fields=body`)
             * `file.name`
             * `ipv4-addr.value`
             * `ipv6-addr.value`
@@ -501,7 +733,7 @@ class SDOView(viewsets.ViewSet):
             * `mutex.value`
             * `network-traffic.protocols`
             * `phone-number.value`
-            * `process.pid`
+            * `process.command_line`
             * `software.name`
             * `url.value`
             * `user-account.display_name`
@@ -511,18 +743,29 @@ class SDOView(viewsets.ViewSet):
             """
         ),
     ),
+    export=extend_schema(
+        responses=EXPORT_RESPONSES,
+        parameters=QueryParams.SCO_PARAMS + [QueryParams.export_format],
+        summary="Export STIX Cyber Observable Objects",
+        description=textwrap.dedent(
+            """
+            Download every cyber observable object matching the filters in a single streamed response. Accepts the same filters as the Search and filter STIX Cyber Observable Objects endpoint.
+            """
+        ),
+    ),
 )
 class SCOView(viewsets.ViewSet):
     skip_list_view = True
     openapi_tags = ["Objects"]
 
     def list(self, request, *args, **kwargs):
-        matcher = {}
-        if post_id := request.query_params.dict().get("post_id"):
-            matcher["_obstracts_post_id"] = post_id
-        return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_scos(
-            matcher=matcher
-        )
+        return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_scos()
+
+    @decorators.action(methods=["GET"], detail=False)
+    def export(self, request, *args, **kwargs):
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request, export=True
+        ).get_scos()
 
 
 @extend_schema_view(
@@ -536,7 +779,17 @@ class SCOView(viewsets.ViewSet):
             Search for meta objects. If you have the object ID already, you can use the base GET Objects endpoint.
             """
         ),
-    )
+    ),
+    export=extend_schema(
+        responses=EXPORT_RESPONSES,
+        parameters=QueryParams.SMO_PARAMS + [QueryParams.export_format],
+        summary="Export STIX Meta Objects",
+        description=textwrap.dedent(
+            """
+            Download every meta object matching the filters in a single streamed response. Accepts the same filters as the Search and filter STIX Meta Objects endpoint.
+            """
+        ),
+    ),
 )
 class SMOView(viewsets.ViewSet):
     skip_list_view = True
@@ -545,6 +798,12 @@ class SMOView(viewsets.ViewSet):
     def list(self, request, *args, **kwargs):
         return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_smos()
 
+    @decorators.action(methods=["GET"], detail=False)
+    def export(self, request, *args, **kwargs):
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request, export=True
+        ).get_smos()
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -559,6 +818,17 @@ class SMOView(viewsets.ViewSet):
             """
         ),
     ),
+    export=extend_schema(
+        responses=EXPORT_RESPONSES,
+        parameters=QueryParams.SRO_PARAMS
+        + [QueryParams.visible_to, QueryParams.export_format],
+        summary="Export STIX Relationship Objects",
+        description=textwrap.dedent(
+            """
+            Download every relationship object matching the filters in a single streamed response. Accepts the same filters as the Search and filter STIX Relationship Objects endpoint.
+            """
+        ),
+    ),
 )
 class SROView(viewsets.ViewSet):
     skip_list_view = True
@@ -566,3 +836,38 @@ class SROView(viewsets.ViewSet):
 
     def list(self, request, *args, **kwargs):
         return ArangoDBHelper(conf.ARANGODB_DATABASE_VIEW, request).get_sros()
+
+    @decorators.action(methods=["GET"], detail=False)
+    def export(self, request, *args, **kwargs):
+        return ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request, export=True
+        ).get_sros()
+
+
+def has_metrics_token(request):
+    if not conf.QUERY_METRICS_TOKEN:
+        return False
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        token.encode(), conf.QUERY_METRICS_TOKEN.encode()
+    )
+
+
+def query_metrics(request):
+    """
+    AQL execution statistics in the Prometheus text format, only when
+    `QUERY_METRICS_ENDPOINT` is enabled. Served to staff users and to scrapers
+    sending `QUERY_METRICS_TOKEN` as a bearer token.
+
+    The counters live in the memory of the process that answers the request, so
+    with several workers each scrape reads one worker's totals.
+    """
+    if not conf.QUERY_METRICS_ENDPOINT:
+        raise Http404()
+    user = getattr(request, "user", None)
+    if not has_metrics_token(request) and not (user and user.is_staff):
+        raise PermissionDenied()
+    return HttpResponse(
+        query_stats.render_prometheus(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -7,7 +7,7 @@ import shutil
 import uuid
 from attr import dataclass
 
-from ..objects import db_view_creator
+from ..objects import db_view_creator, result_cache
 from . import models
 import tempfile
 from file2txt.converter import get_parser_class
@@ -200,6 +200,7 @@ class StixifyProcessor:
             f"{self.collection_name}_vertex_collection",
         )
         s2a.run()
+        result_cache.bump_generation(s2a.arango.db)
 
     def __del__(self):
         shutil.rmtree(self.tmpdir)
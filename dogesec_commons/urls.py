@@ -42,6 +42,7 @@ urlpatterns = [
     path("api/", include(router.urls)),
     path("", include(regex_router.urls)),
     path("admin/", admin.site.urls),
+    path("metrics/aql/", arango_views.query_metrics, name="aql-metrics"),
     # YOUR PATTERNS
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     # Optional UI:
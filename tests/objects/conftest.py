@@ -1,11 +1,5 @@
-from django.conf import settings
-from arango.client import ArangoClient
+from dogesec_commons.objects.bootstrap import bootstrap
 
 
 def pytest_sessionstart(session):
-    client = ArangoClient(hosts=settings.ARANGODB_HOST_URL)
-    sys_db = client.db(
-        "_system",
-        username=settings.ARANGODB_USERNAME,
-        password=settings.ARANGODB_PASSWORD,
-    )
\ No newline at end of file
+    bootstrap(force=True)
@@ -0,0 +1,189 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import arango.exceptions
+import pytest
+
+from dogesec_commons.objects import bootstrap
+
+
+class FakeCollection:
+    """just enough of a StandardCollection for document_lock"""
+
+    def __init__(self):
+        self.docs = {}
+
+    def insert(self, doc, overwrite=False):
+        if doc["_key"] in self.docs and not overwrite:
+            raise arango.exceptions.DocumentInsertError(
+                MagicMock(error_code=bootstrap.ERROR_UNIQUE_CONSTRAINT_VIOLATED),
+                MagicMock(),
+            )
+        self.docs[doc["_key"]] = dict(doc, _rev=str(time.time()))
+
+    def get(self, key):
+        return self.docs.get(key)
+
+    def delete(self, doc, check_rev=True):
+        current = self.docs.get(doc["_key"])
+        if current and current["_rev"] == doc["_rev"]:
+            del self.docs[doc["_key"]]
+
+
+def test_document_lock():
+    collection = FakeCollection()
+    with bootstrap.document_lock(collection, "lock", ttl=60) as owner:
+        assert collection.get("lock")["owner"] == owner
+        with pytest.raises(bootstrap.LockNotAcquired):
+            with bootstrap.document_lock(collection, "lock", ttl=60, wait=False):
+                pass
+    assert collection.get("lock") is None
+
+
+def test_document_lock_timeout():
+    collection = FakeCollection()
+    collection.insert(dict(_key="lock", owner="other", expires_at=time.time() + 60))
+    with (
+        patch.object(bootstrap.time, "sleep"),
+        pytest.raises(bootstrap.LockNotAcquired),
+    ):
+        with bootstrap.document_lock(collection, "lock", ttl=60, timeout=-1):
+            pass
+    assert collection.get("lock")["owner"] == "other"
+
+
+def test_document_lock_takes_over_stale_lock():
+    collection = FakeCollection()
+    collection.insert(dict(_key="lock", owner="dead", expires_at=time.time() - 1))
+    with bootstrap.document_lock(collection, "lock", ttl=60, wait=False) as owner:
+        assert collection.get("lock")["owner"] == owner
+    assert collection.get("lock") is None
+
+
+def make_collections_db(*names):
+    db = MagicMock()
+    db.collections.return_value = [
+        dict(name=name, system=name.startswith("_")) for name in names
+    ]
+    return db
+
+
+def test_get_bootstrap_version_is_stable():
+    db = make_collections_db("a_vertex_collection", "_system_collection")
+    assert bootstrap.get_bootstrap_version(db) == bootstrap.get_bootstrap_version(db)
+
+
+def test_get_bootstrap_version_changes_with_collections():
+    # a new collection has to be linked by the next bootstrap
+    version = bootstrap.get_bootstrap_version(make_collections_db("a_vertex_collection"))
+    assert version == bootstrap.get_bootstrap_version(
+        make_collections_db("a_vertex_collection", "_dogesec_commons")
+    )
+    assert version != bootstrap.get_bootstrap_version(
+        make_collections_db("a_vertex_collection", "a_edge_collection")
+    )
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    meta = FakeCollection()
+    db.collection.return_value = meta
+    db.has_collection.return_value = True
+    with (
+        patch.object(bootstrap.db_view_creator, "create_database", return_value=db),
+        patch.object(bootstrap.db_view_creator, "setup_database") as setup_database,
+        patch.object(bootstrap.db_pool, "get_database", return_value=db),
+    ):
+        yield db, meta, setup_database
+
+
+@pytest.mark.parametrize(
+    "recorded_version,backfilled,force,expected",
+    [
+        (None, False, False, True),
+        ("outdated", True, False, True),
+        ("current", True, False, False),
+        ("current", True, True, True),
+        # bootstrapped before the backfills existed
+        ("current", False, False, True),
+    ],
+)
+def test_bootstrap(mock_db, recorded_version, backfilled, force, expected):
+    db, meta, setup_database = mock_db
+    version = bootstrap.get_bootstrap_version(db)
+    if recorded_version:
+        meta.insert(
+            dict(
+                _key=bootstrap.BOOTSTRAP_KEY,
+                version=version if recorded_version == "current" else "outdated",
+            )
+        )
+    if backfilled:
+        for key in bootstrap.BACKFILL_KEYS:
+            meta.insert(dict(_key=key))
+    with (
+        patch.object(bootstrap, "backfill_canonical_latest") as backfill,
+        patch.object(bootstrap, "backfill_derived_fields") as backfill_derived,
+    ):
+        assert bootstrap.bootstrap(force=force) == expected
+    assert setup_database.called == expected
+    assert backfill.called == expected
+    assert backfill_derived.called == expected
+    assert meta.get(bootstrap.BOOTSTRAP_KEY)["version"] == version
+    assert meta.get(bootstrap.LOCK_KEY) is None
+
+
+@pytest.mark.parametrize("bootstrap_on_ready", [True, False])
+def test_check_bootstrap(mock_db, bootstrap_on_ready):
+    db, meta, setup_database = mock_db
+    with patch.object(bootstrap.conf, "BOOTSTRAP_ON_READY", bootstrap_on_ready):
+        bootstrap.check_bootstrap()
+        assert setup_database.called == bootstrap_on_ready
+        setup_database.reset_mock()
+        bootstrap.check_bootstrap()
+        setup_database.assert_not_called()
+
+
+def test_check_bootstrap_pending_backfill(mock_db):
+    db, meta, setup_database = mock_db
+    meta.insert(
+        dict(_key=bootstrap.BOOTSTRAP_KEY, version=bootstrap.get_bootstrap_version(db))
+    )
+    meta.insert(dict(_key=bootstrap.CANONICAL_LATEST_BACKFILL_KEY))
+    with (
+        patch.object(bootstrap.conf, "BOOTSTRAP_ON_READY", True),
+        patch("dogesec_commons.objects.derived_fields.backfill") as backfill,
+    ):
+        bootstrap.check_bootstrap()
+    backfill.assert_called_once_with(db)
+    assert meta.get(bootstrap.DERIVED_FIELDS_BACKFILL_KEY)
+
+
+def test_check_bootstrap_locked(mock_db):
+    db, meta, setup_database = mock_db
+    meta.insert(
+        dict(_key=bootstrap.LOCK_KEY, owner="other", expires_at=time.time() + 60)
+    )
+    bootstrap.check_bootstrap()
+    setup_database.assert_not_called()
+
+
+def test_backfill_canonical_latest_runs_once():
+    db = MagicMock()
+    meta = FakeCollection()
+    with patch("dogesec_commons.objects.canonical_latest.backfill") as backfill:
+        bootstrap.backfill_canonical_latest(db, meta)
+        bootstrap.backfill_canonical_latest(db, meta)
+    backfill.assert_called_once_with(db)
+    assert meta.get(bootstrap.CANONICAL_LATEST_BACKFILL_KEY)
+
+
+def test_backfill_derived_fields_runs_once():
+    db = MagicMock()
+    meta = FakeCollection()
+    with patch("dogesec_commons.objects.derived_fields.backfill") as backfill:
+        bootstrap.backfill_derived_fields(db, meta)
+        bootstrap.backfill_derived_fields(db, meta)
+    backfill.assert_called_once_with(db)
+    assert meta.get(bootstrap.DERIVED_FIELDS_BACKFILL_KEY)
@@ -0,0 +1,96 @@
+from unittest.mock import MagicMock, call, patch
+
+import pytest
+from stix2arango.stix2arango import Stix2Arango
+
+from dogesec_commons.objects import canonical_latest, conf
+
+
+def test_update_canonical_latest():
+    db = MagicMock()
+    db.aql.execute.return_value = [
+        ["a_vertex_collection/indicator--1+1", True],
+        ["b_vertex_collection/indicator--1+2", False],
+        ["a_vertex_collection/indicator--2+1", False],
+    ]
+    assert (
+        canonical_latest.update_canonical_latest(
+            db,
+            ["indicator--1", "indicator--2", "indicator--1"],
+            ["a_vertex_collection", "b_vertex_collection"],
+        )
+        == 3
+    )
+    query = db.aql.execute.call_args[0][0]
+    bind_vars = db.aql.execute.call_args[1]["bind_vars"]
+    # read from the collections, not from the view
+    assert "@@view" not in query and "SEARCH" not in query
+    assert "FOR doc IN @@collection_1" in query
+    assert bind_vars["@collection_0"] == "a_vertex_collection"
+    assert bind_vars["@collection_1"] == "b_vertex_collection"
+    assert bind_vars["key_start"] == "+" and bind_vars["key_end"] == ","
+    assert sorted(bind_vars["ids"]) == ["indicator--1", "indicator--2"]
+    assert db.collection.call_args_list == [
+        call("a_vertex_collection"),
+        call("b_vertex_collection"),
+    ]
+    assert db.collection.return_value.update_many.call_args_list[0] == call(
+        [
+            {"_key": "indicator--1+1", "_is_canonical_latest": True},
+            {"_key": "indicator--2+1", "_is_canonical_latest": False},
+        ],
+        merge=False,
+        silent=True,
+    )
+
+
+def test_update_canonical_latest_batches():
+    db = MagicMock()
+    db.name = "some_database"
+    db.collections.return_value = [
+        dict(name="a_vertex_collection", system=False),
+        dict(name="a_edge_collection", system=False),
+        dict(name="other", system=False),
+    ]
+    db.aql.execute.return_value = []
+    canonical_latest.update_canonical_latest(
+        db, [f"indicator--{i}" for i in range(5)], batch_size=2
+    )
+    assert db.aql.execute.call_count == 3
+    # every stix2arango collection, listed once
+    db.collections.assert_called_once()
+    bind_vars = db.aql.execute.call_args[1]["bind_vars"]
+    assert bind_vars["@collection_0"] == "a_edge_collection"
+    assert bind_vars["@collection_1"] == "a_vertex_collection"
+    assert "@collection_2" not in bind_vars
+    db.collection.assert_not_called()
+
+
+def test_update_canonical_latest_without_collections():
+    db = MagicMock()
+    assert canonical_latest.update_canonical_latest(db, ["indicator--1"], []) == 0
+    db.aql.execute.assert_not_called()
+
+
+@pytest.mark.parametrize("same_database", [True, False])
+def test_post_upload_hook(same_database):
+    instance = MagicMock()
+    instance.arango.db.name = conf.DB_NAME if same_database else "other_database"
+    with patch.object(canonical_latest, "update_canonical_latest") as update:
+        canonical_latest.post_upload_hook(
+            instance,
+            "some_vertex_collection",
+            [{"id": "indicator--1"}],
+            inserted_ids=[],
+        )
+    if same_database:
+        update.assert_called_once_with(instance.arango.db, ["indicator--1"])
+    else:
+        update.assert_not_called()
+
+
+def test_register_upload_hooks():
+    canonical_latest.register_upload_hooks()
+    canonical_latest.register_upload_hooks()
+    hooks = [hook for hook, _ in Stix2Arango._post_upload_hooks]
+    assert hooks.count(canonical_latest.post_upload_hook) == 1
@@ -0,0 +1,74 @@
+import os
+import threading
+
+import pytest
+
+from dogesec_commons.objects import db_pool
+
+
+@pytest.fixture(autouse=True)
+def clean_pool():
+    db_pool.reset()
+    yield
+    db_pool.reset()
+
+
+def test_get_database_is_shared():
+    db = db_pool.get_database("some_database", "user", "pass")
+    assert db_pool.get_database("some_database", "user", "pass") is db
+    assert db.name == "some_database"
+    assert db_pool.get_database("other_database", "user", "pass") is not db
+    assert db_pool.get_database("some_database", "user2", "pass") is not db
+
+
+def test_get_database_shares_client():
+    db_pool.get_database("some_database", "user", "pass")
+    db_pool.get_database("other_database", "user", "pass")
+    assert len(db_pool._clients) == 1
+
+
+def test_get_database_is_thread_safe():
+    handles = []
+
+    def worker():
+        handles.append(db_pool.get_database("some_database", "user", "pass"))
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(map(id, handles))) == 1
+
+
+def test_get_database_after_fork():
+    db = db_pool.get_database("some_database", "user", "pass")
+    client = db_pool.get_client()
+    lock = db_pool._lock
+    # what os.register_at_fork runs in the child
+    db_pool._reset_after_fork()
+    assert db_pool._lock is not lock
+    assert db_pool.get_client() is not client
+    assert db_pool.get_database("some_database", "user", "pass") is not db
+
+
+@pytest.mark.skipif(not hasattr(db_pool.os, "fork"), reason="needs fork")
+def test_forked_child_starts_empty():
+    db_pool.get_database("some_database", "user", "pass")
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_fd, str(len(db_pool._clients) + len(db_pool._databases)).encode())
+        os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 16) == b"0"
+    os.close(read_fd)
+    assert db_pool._clients
+
+
+@pytest.mark.parametrize("keep_alive", [True, False])
+def test_http_client_keep_alive(keep_alive):
+    http_client = db_pool.PooledHTTPClient(keep_alive=keep_alive)
+    session = http_client.create_session("http://localhost:8529")
+    assert (session.headers.get("Connection") == "close") != keep_alive
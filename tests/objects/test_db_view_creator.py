@@ -0,0 +1,416 @@
+from unittest.mock import MagicMock, patch
+
+import arango.exceptions
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from dogesec_commons.objects import db_view_creator
+
+
+@pytest.fixture(autouse=True)
+def clean_link_cache():
+    db_view_creator.forget_links()
+    yield
+    db_view_creator.forget_links()
+
+
+def test_create_analyzers():
+    db = MagicMock()
+    db.analyzers.return_value = [dict(name="identity", type="identity")]
+    db.create_analyzer.side_effect = [
+        {},
+        arango.exceptions.AnalyzerCreateError(MagicMock(), MagicMock()),
+    ]
+    db_view_creator.create_analyzers(db)
+    names = [c.kwargs["name"] for c in db.create_analyzer.call_args_list]
+    assert names == [db_view_creator.NORM_ANALYZER, db_view_creator.NGRAM_ANALYZER]
+
+
+def test_create_analyzers_existing():
+    db = MagicMock()
+    norm, ngram = db_view_creator.ANALYZERS
+    db.analyzers.return_value = [
+        # as returned by ArangoDB, with defaults filled in
+        dict(
+            name=f"some_db::{norm['name']}",
+            type="norm",
+            properties={**norm["properties"], "extra_default": 1},
+            features=[],
+        ),
+        dict(
+            name=f"some_db::{ngram['name']}",
+            type="pipeline",
+            properties={"pipeline": [{"type": "norm", "properties": {}}, {}]},
+            features=ngram["features"],
+        ),
+    ]
+    db_view_creator.create_analyzers(db)
+    db.create_analyzer.assert_not_called()
+    assert db_view_creator.analyzer_matches(db.analyzers.return_value[0], norm)
+    assert not db_view_creator.analyzer_matches(db.analyzers.return_value[1], ngram)
+
+
+def test_make_link():
+    link = db_view_creator.make_link()
+    assert link["includeAllFields"] == True
+    assert set(link["fields"]) == set(db_view_creator.SCO_SEARCH_FIELDS)
+    for field in link["fields"].values():
+        assert field["analyzers"] == [
+            "identity",
+            db_view_creator.NORM_ANALYZER,
+            db_view_creator.NGRAM_ANALYZER,
+        ]
+
+
+def test_link_one_collection():
+    db = MagicMock()
+    db.view.return_value = {"links": {"other_collection": {}}}
+    db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    db.update_arangosearch_view.assert_called_once_with(
+        "some_view", {"links": {"some_vertex_collection": db_view_creator.make_link()}}
+    )
+
+
+def test_link_one_collection_already_linked():
+    db = MagicMock()
+    db.view.return_value = {
+        "links": {
+            "some_vertex_collection": as_returned_link(db_view_creator.make_link())
+        }
+    }
+    db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    db.update_arangosearch_view.assert_not_called()
+
+
+def test_link_one_collection_cached():
+    db = MagicMock()
+    db.view.return_value = {"links": {}}
+    for _ in range(3):
+        db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    db.view.assert_called_once()
+    db.update_arangosearch_view.assert_called_once()
+
+    db_view_creator.forget_links("some_view")
+    db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    assert db.view.call_count == 2
+
+
+def test_link_one_collection_cache_expires():
+    db = MagicMock()
+    db.view.return_value = {"links": {}}
+    with patch.object(db_view_creator.conf, "VIEW_LINK_CACHE_TTL", 0):
+        db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+        db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    assert db.view.call_count == 2
+    with patch.object(db_view_creator.conf, "VIEW_LINK_CACHE_TTL", 60):
+        db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+        with patch.object(db_view_creator.time, "monotonic", return_value=10**12):
+            db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    assert db.view.call_count == 4
+
+
+def test_link_all_collections():
+    db = MagicMock()
+    db.collections.return_value = [
+        dict(name="_graphs", system=True),
+        dict(name="linked_vertex_collection", system=False),
+        dict(name="new_edge_collection", system=False),
+    ]
+    view = {
+        "name": "some_view",
+        "links": {
+            "linked_vertex_collection": as_returned_link(db_view_creator.make_link())
+        },
+    }
+    db_view_creator.link_all_collections(db, view)
+    db.update_arangosearch_view.assert_called_once_with(
+        "some_view", {"links": {"new_edge_collection": db_view_creator.make_link()}}
+    )
+    assert db_view_creator.is_link_cached(db, "some_view", "new_edge_collection")
+    assert not db_view_creator.is_link_cached(db, "some_view", "_graphs")
+
+
+def as_returned_link(link):
+    """shape of a link as ArangoDB returns it"""
+    return {
+        **link,
+        "analyzers": ["identity"],
+        "trackListPositions": False,
+        "fields": {
+            field: {
+                "analyzers": [
+                    f"some_db::{a}" if a != "identity" else a for a in v["analyzers"]
+                ]
+            }
+            for field, v in link["fields"].items()
+        },
+    }
+
+
+def as_returned_view(spec):
+    """shape of a view as python-arango returns it"""
+    return {
+        "name": "some_view",
+        "primary_sort": [
+            dict(field=s["field"], asc=s["direction"] == "asc")
+            for s in spec["primarySort"]
+        ],
+        "stored_values": [
+            dict(fields=list(reversed(sv["fields"])), compression="lz4")
+            for sv in reversed(spec["storedValues"])
+        ],
+        "links": {},
+    }
+
+
+def test_fingerprint_view_matches_returned_view():
+    spec = db_view_creator.make_view_spec()
+    assert db_view_creator.fingerprint_view(spec) == db_view_creator.fingerprint_view(
+        as_returned_view(spec)
+    )
+    other_spec = db_view_creator.make_view_spec(sort_fields=["id", "modified"])
+    assert db_view_creator.fingerprint_view(spec) != db_view_creator.fingerprint_view(
+        other_spec
+    )
+
+
+def test_fingerprint_view_is_stable():
+    # the builtin hash() of strings changes between processes, this must not
+    view = {
+        "primary_sort": [{"field": "id", "asc": True}, {"field": "id", "asc": False}],
+        "stored_values": [{"fields": ["type", "id"]}, {"fields": ["id"]}],
+    }
+    assert (
+        db_view_creator.fingerprint_view(view)
+        == "9a3e4077e0f24b1971dee36dc4bb5d632e993038ab88718966fb5d67007c0714"
+    )
+
+
+def test_update_view_unchanged():
+    db = MagicMock()
+    spec = db_view_creator.make_view_spec()
+    db.view.return_value = as_returned_view(spec)
+    assert db_view_creator.update_view(db, spec, "some_view") == db.view.return_value
+    db.delete_view.assert_not_called()
+    db.update_arangosearch_view.assert_not_called()
+
+
+def test_update_view_immutable_change():
+    db = MagicMock()
+    db.view.return_value = as_returned_view(db_view_creator.make_view_spec())
+    new_spec = db_view_creator.make_view_spec(filter_fields=[["id"], ["_is_latest"]])
+    assert db_view_creator.update_view(db, new_spec, "some_view") is None
+    db.delete_view.assert_called_once_with("some_view", ignore_missing=True)
+
+
+VIEW_TUNABLES = dict(
+    VIEW_COMMIT_INTERVAL_MSEC=5000,
+    VIEW_CONSOLIDATION_POLICY={"type": "tier", "segmentsMin": 2},
+)
+
+
+def test_make_view_spec_tunables():
+    assert "commitIntervalMsec" not in db_view_creator.make_view_spec()
+    with patch.multiple(db_view_creator.conf, **VIEW_TUNABLES):
+        spec = db_view_creator.make_view_spec()
+    assert spec["commitIntervalMsec"] == 5000
+    assert spec["consolidationPolicy"] == {"type": "tier", "segmentsMin": 2}
+    assert "cleanupIntervalStep" not in spec
+
+
+def test_update_view_mutable_change():
+    db = MagicMock()
+    db.view.return_value = {
+        **as_returned_view(db_view_creator.make_view_spec()),
+        "commit_interval_msec": 1000,
+        "consolidation_interval_msec": 1000,
+        "consolidation_policy": {"type": "tier", "segments_min": 1, "min_score": 0},
+    }
+    with patch.multiple(db_view_creator.conf, **VIEW_TUNABLES):
+        spec = db_view_creator.make_view_spec()
+    assert db_view_creator.update_view(db, spec, "some_view") == db.view.return_value
+    db.delete_view.assert_not_called()
+    db.update_arangosearch_view.assert_called_once_with(
+        "some_view",
+        {
+            "commitIntervalMsec": 5000,
+            "consolidationPolicy": {"type": "tier", "segmentsMin": 2},
+        },
+    )
+
+    db.update_arangosearch_view.reset_mock()
+    db.view.return_value.update(
+        commit_interval_msec=5000,
+        consolidation_policy={"type": "tier", "segments_min": 2, "min_score": 0},
+    )
+    db_view_creator.update_view(db, spec, "some_view")
+    db.update_arangosearch_view.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "tunables",
+    [
+        dict(VIEW_PRIMARY_SORT_COMPRESSION="none"),
+        dict(VIEW_WRITEBUFFER_SIZE_MAX=64 * 1024 * 1024),
+    ],
+)
+def test_update_view_immutable_tunable_change(tunables):
+    db = MagicMock()
+    db.view.return_value = {
+        **as_returned_view(db_view_creator.make_view_spec()),
+        "primary_sort_compression": "lz4",
+        "writebuffer_max_size": 33554432,
+    }
+    assert db_view_creator.update_view(
+        db, db_view_creator.make_view_spec(), "some_view"
+    )
+    with patch.multiple(db_view_creator.conf, **tunables):
+        spec = db_view_creator.make_view_spec()
+    assert db_view_creator.update_view(db, spec, "some_view") is None
+    db.delete_view.assert_called_once_with("some_view", ignore_missing=True)
+
+
+def test_make_link_in_background():
+    with patch.object(db_view_creator.conf, "VIEW_LINK_IN_BACKGROUND", True):
+        link = db_view_creator.make_link()
+    assert link["inBackground"] == True
+    # not part of the stored link, so it must not make links look different
+    assert db_view_creator.normalize_link(link) == db_view_creator.normalize_link(
+        db_view_creator.make_link()
+    )
+
+
+def test_create_view_keeps_existing_view():
+    db = MagicMock()
+    db.has_view.return_value = True
+    db.view.return_value = as_returned_view(db_view_creator.make_view_spec())
+    assert db_view_creator.create_view(db, "some_view") == db.view.return_value
+    db.create_arangosearch_view.assert_not_called()
+
+
+def test_create_view_recreates_on_immutable_change():
+    db = MagicMock()
+    db.has_view.return_value = True
+    db.view.return_value = as_returned_view(db_view_creator.make_view_spec(["id"]))
+    db_view_creator.create_view(db, "some_view")
+    db.delete_view.assert_called_once()
+    db.create_arangosearch_view.assert_called_once_with(
+        "some_view", db_view_creator.make_view_spec()
+    )
+
+
+def test_make_inverted_index():
+    index = db_view_creator.make_inverted_index()
+    fields = {f["name"]: f.get("analyzer") for f in index["fields"]}
+    assert fields["value"] == db_view_creator.NORM_ANALYZER
+    assert fields["_is_latest"] is None
+    assert len(fields) == len(index["fields"])
+    assert "payload_bin" in fields and "description" not in fields
+    assert index["searchField"] == True
+    assert index["storedValues"] == db_view_creator.make_view_spec()["storedValues"]
+
+    name = db_view_creator.get_inverted_index_name(index)
+    assert name.startswith(db_view_creator.INVERTED_INDEX_PREFIX)
+    with patch.object(db_view_creator.conf, "VIEW_COMMIT_INTERVAL_MSEC", 5000):
+        other_index = db_view_creator.make_inverted_index()
+    assert other_index["commitIntervalMsec"] == 5000
+    assert db_view_creator.get_inverted_index_name(other_index) != name
+
+
+@pytest.fixture
+def search_alias():
+    with patch.object(db_view_creator.conf, "VIEW_BACKEND", "search-alias"):
+        yield
+
+
+def test_link_one_collection_search_alias(search_alias):
+    index_name = db_view_creator.get_inverted_index_name(
+        db_view_creator.make_inverted_index()
+    )
+    db = MagicMock()
+    db.view.return_value = {"type": "search-alias", "indexes": []}
+    collection = db.collection.return_value
+    collection.indexes.return_value = [
+        dict(id="c/1", name="primary", type="primary"),
+        dict(id="c/2", name="dogesec_search_old", type="inverted"),
+    ]
+    db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    assert collection.add_index.call_args[0][0]["name"] == index_name
+    db.update_view.assert_called_once_with(
+        "some_view",
+        {"indexes": [dict(collection="some_vertex_collection", index=index_name)]},
+    )
+    collection.delete_index.assert_called_once_with("c/2", ignore_missing=True)
+    db.update_arangosearch_view.assert_not_called()
+
+
+def test_link_one_collection_search_alias_linked(search_alias):
+    index_name = db_view_creator.get_inverted_index_name(
+        db_view_creator.make_inverted_index()
+    )
+    db = MagicMock()
+    db.view.return_value = {
+        "type": "search-alias",
+        "indexes": [dict(collection="some_vertex_collection", index=index_name)],
+    }
+    collection = db.collection.return_value
+    collection.indexes.return_value = [
+        dict(id="c/1", name=index_name, type="inverted"),
+    ]
+    db_view_creator.link_one_collection(db, "some_view", "some_vertex_collection")
+    collection.add_index.assert_not_called()
+    db.update_view.assert_not_called()
+
+
+def test_create_view_search_alias(search_alias):
+    db = MagicMock()
+    db.has_view.return_value = True
+    db.view.return_value = {"name": "some_view", "type": "arangosearch"}
+    db_view_creator.create_view(db, "some_view")
+    db.delete_view.assert_called_once_with("some_view", ignore_missing=True)
+    db.create_view.assert_called_once_with(
+        "some_view", "search-alias", {"indexes": []}
+    )
+
+
+def test_create_view_from_search_alias():
+    db = MagicMock()
+    db.has_view.return_value = True
+    db.view.return_value = {"name": "some_view", "type": "search-alias"}
+    db.collections.return_value = [dict(name="some_vertex_collection", system=False)]
+    db.collection.return_value.indexes.return_value = [
+        dict(id="c/2", name="dogesec_search_old", type="inverted"),
+    ]
+    db_view_creator.create_view(db, "some_view")
+    db.delete_view.assert_called_once_with("some_view", ignore_missing=True)
+    db.collection.return_value.delete_index.assert_called_once_with(
+        "c/2", ignore_missing=True
+    )
+    db.create_arangosearch_view.assert_called_once()
+
+
+def test_get_primary_sort():
+    # no default, writes only pay for a primary sort that is configured
+    assert db_view_creator.make_view_spec()["primarySort"] == []
+    assert "primarySort" not in db_view_creator.make_inverted_index()
+    assert db_view_creator.get_primary_sort("modified_descending") == [
+        dict(field="modified", direction="desc"),
+        dict(field="id", direction="desc"),
+    ]
+    assert db_view_creator.get_primary_sort("id_ascending") == [
+        dict(field="id", direction="asc")
+    ]
+    with patch.object(db_view_creator.conf, "VIEW_PRIMARY_SORT", "name_ascending"):
+        assert db_view_creator.make_view_spec()["primarySort"][0] == dict(
+            field="name", direction="asc"
+        )
+        assert db_view_creator.make_inverted_index()["primarySort"]["fields"] == [
+            dict(field="name", direction="asc"),
+            dict(field="id", direction="asc"),
+        ]
+
+
+@pytest.mark.parametrize("sort_option", ["modified", "modified_up", "_descending"])
+def test_get_primary_sort_invalid(sort_option):
+    with pytest.raises(ImproperlyConfigured):
+        db_view_creator.get_primary_sort(sort_option)
@@ -0,0 +1,290 @@
+import contextlib
+import io
+from unittest.mock import MagicMock, patch
+
+import pytest
+from rest_framework.exceptions import NotFound
+from stix2arango.stix2arango import Stix2Arango
+
+from dogesec_commons.objects import derived_fields
+from dogesec_commons.objects.management.commands import backfill_derived_fields
+from .utils import make_helper_with_mock_db
+
+
+@pytest.mark.parametrize(
+    "obj,ttp_sources,attack_form",
+    [
+        (dict(type="vulnerability", name="CVE-2024-1234"), ["cve"], None),
+        (dict(type="weakness"), ["cwe"], None),
+        (dict(type="location"), ["location"], None),
+        (
+            dict(
+                type="attack-pattern",
+                x_mitre_domains=["enterprise-attack", "mobile-attack"],
+                x_mitre_is_subtechnique=True,
+                external_references=[dict(source_name="mitre-attack")],
+            ),
+            ["enterprise-attack", "mobile-attack"],
+            "Sub-technique",
+        ),
+        (
+            dict(
+                type="attack-pattern", external_references=[dict(source_name="capec")]
+            ),
+            ["capec"],
+            "Technique",
+        ),
+        (
+            dict(
+                type="attack-pattern",
+                x_mitre_is_subtechnique=False,
+                external_references=[dict(source_name="DISARM")],
+            ),
+            ["disarm"],
+            "Technique",
+        ),
+        (
+            dict(type="malware", external_references=[dict(source_name="mitre-atlas")]),
+            ["atlas"],
+            "Software",
+        ),
+        (dict(type="intrusion-set"), [], "Group"),
+        (dict(type="relationship"), [], None),
+    ],
+)
+def test_get_derived_fields(obj, ttp_sources, attack_form):
+    assert derived_fields.get_derived_fields(obj) == dict(
+        _ttp_source=ttp_sources,
+        _attack_form=attack_form,
+        _external_id=derived_fields.get_external_id(obj),
+        _visibility="public",
+    )
+    assert derived_fields.add_derived_fields(obj) is obj
+    assert obj["_ttp_source"] == ttp_sources
+
+
+def test_register_upload_hooks_is_idempotent():
+    derived_fields.register_upload_hooks()
+    derived_fields.register_upload_hooks()
+    hooks = [hook for hook, _ in Stix2Arango._pre_upload_hooks]
+    assert hooks.count(derived_fields.pre_upload_hook) == 1
+
+
+def test_backfill_collection():
+    db = MagicMock()
+    db.aql.execute.return_value = iter(
+        [
+            dict(_key="a", type="weakness"),
+            dict(
+                _key="b",
+                type="weakness",
+                _ttp_source=["cwe"],
+                _attack_form=None,
+                _external_id=None,
+                _visibility="public",
+            ),
+            dict(_key="c", type="tool", _ttp_source=[], _attack_form="Group"),
+        ]
+    )
+    assert derived_fields.backfill_collection(db, "some_vertex_collection", 2) == 2
+    db.collection.assert_called_once_with("some_vertex_collection")
+    updates = [
+        doc
+        for call in db.collection.return_value.update_many.call_args_list
+        for doc in call[0][0]
+    ]
+    assert updates == [
+        dict(
+            _key="a",
+            _ttp_source=["cwe"],
+            _attack_form=None,
+            _external_id=None,
+            _visibility="public",
+        ),
+        dict(
+            _key="c",
+            _ttp_source=[],
+            _attack_form="Software",
+            _external_id=None,
+            _visibility="public",
+        ),
+    ]
+
+
+def test_backfill_command_covers_edge_collections():
+    # relationships uploaded before `_visibility` existed are hidden by visible_to
+    existing_sro = dict(
+        _key="relationship--1+1",
+        type="relationship",
+        created_by_ref="identity--1",
+        object_marking_refs=[RED],
+    )
+    documents = {
+        "reports_vertex_collection": [dict(_key="indicator--1+1", type="indicator")],
+        "reports_edge_collection": [existing_sro],
+    }
+    db = MagicMock()
+    db.name = "backfill_database"
+    db.collections.return_value = [
+        dict(name=name, system=False)
+        for name in [*documents, "not_a_stix_collection"]
+    ]
+    db.aql.execute.side_effect = lambda query, bind_vars, **kwargs: iter(
+        documents[bind_vars["@collection"]]
+    )
+    collections = {}
+    db.collection.side_effect = lambda name: collections.setdefault(name, MagicMock())
+    with patch.object(backfill_derived_fields.db_pool, "get_database", return_value=db):
+        backfill_derived_fields.Command(stdout=io.StringIO()).handle()
+
+    assert sorted(collections) == sorted(documents)
+    (updates,), _ = collections["reports_edge_collection"].update_many.call_args
+    assert updates[0]["_key"] == "relationship--1+1"
+    assert updates[0]["_visibility"] == "owner:identity--1"
+
+
+def test_get_sdos_searches_derived_fields():
+    helper = make_helper_with_mock_db(
+        ttp_type="cve,enterprise-attack", ttp_object_type="Group"
+    )
+    helper.get_sdos()
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    search = query[query.index("SEARCH") : query.index("SORT")]
+    assert "doc._ttp_source IN @ttp_types" in search
+    assert "doc._attack_form IN @attack_forms" in search
+    assert "FILTER" not in search
+    assert bind_vars["ttp_types"] == ["cve", "enterprise-attack"]
+    assert bind_vars["attack_forms"] == ["Group"]
+
+
+@pytest.mark.parametrize(
+    "obj,external_id",
+    [
+        (
+            dict(
+                type="attack-pattern",
+                external_references=[
+                    dict(source_name="mitre-attack", external_id="T1047")
+                ],
+            ),
+            "T1047",
+        ),
+        (
+            dict(
+                type="vulnerability",
+                external_references=[
+                    dict(source_name="cve", external_id="CVE-2023-12345"),
+                    dict(external_id="CWE-79"),
+                ],
+            ),
+            "CVE-2023-12345",
+        ),
+        (dict(type="vulnerability", external_references=[]), None),
+        (dict(type="ipv4-addr"), None),
+    ],
+)
+def test_get_external_id(obj, external_id):
+    assert derived_fields.get_external_id(obj) == external_id
+
+
+def test_get_sdos_searches_ttp_ids():
+    helper = make_helper_with_mock_db(ttp_id="T1047,CVE-2023-12345")
+    helper.get_sdos()
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    assert "doc._external_id IN @ttp_ids" in query[: query.index("SORT")]
+    assert bind_vars["ttp_ids"] == ["T1047", "CVE-2023-12345"]
+
+
+def test_resolve_external_ids():
+    helper = make_helper_with_mock_db(visible_to="identity--1")
+    helper.db.aql.execute.return_value.__iter__.return_value = iter(
+        [["T1047", {"id": "attack-pattern--1"}]]
+    )
+    response = helper.resolve_external_ids(["T1047", "T9999"])
+    assert response.data == dict(
+        objects={"T1047": {"id": "attack-pattern--1"}}, missing=["T9999"]
+    )
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    assert "doc._is_canonical_latest == TRUE" in query
+    assert "COLLECT" not in query
+    assert bind_vars["external_ids"] == ["T1047", "T9999"]
+    assert bind_vars["visibility"] == ["public", "owner:identity--1"]
+
+
+GREEN = "marking-definition--bab4a63c-aed9-4cf5-a766-dfca5abac2bb"
+RED = "marking-definition--e828b379-4e03-4974-9ac4-e53a884c97c1"
+
+
+@pytest.mark.parametrize(
+    "obj,visibility",
+    [
+        (dict(type="indicator"), "public"),
+        (dict(type="indicator", created_by_ref="identity--1"), "public"),
+        (dict(type="indicator", object_marking_refs=[RED]), "public"),
+        (
+            dict(
+                type="indicator",
+                created_by_ref="identity--1",
+                object_marking_refs=[RED, GREEN],
+            ),
+            "public",
+        ),
+        (
+            dict(
+                type="attack-pattern",
+                created_by_ref="identity--1",
+                object_marking_refs=[RED],
+                x_mitre_domains=["mobile-attack"],
+            ),
+            "public",
+        ),
+        (
+            dict(
+                type="indicator",
+                created_by_ref="identity--1",
+                object_marking_refs=[RED],
+            ),
+            "owner:identity--1",
+        ),
+        (
+            dict(
+                type="indicator",
+                created_by_ref="identity--1",
+                object_marking_refs=[],
+            ),
+            "owner:identity--1",
+        ),
+    ],
+)
+def test_get_visibility(obj, visibility):
+    assert derived_fields.get_visibility(obj) == visibility
+
+
+@pytest.mark.parametrize(
+    "method,args",
+    [
+        ("get_sdos", ()),
+        ("get_sros", ()),
+        ("get_objects_by_id", ("indicator--1",)),
+        ("get_objects_by_ids", (["indicator--1"],)),
+        ("get_object_bundle", ("indicator--1",)),
+    ],
+)
+def test_visible_to_searches_visibility(method, args):
+    helper = make_helper_with_mock_db(visible_to="identity--1")
+    helper.db.aql.execute.return_value.__iter__.return_value = iter([])
+    with contextlib.suppress(NotFound):
+        getattr(helper, method)(*args)
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    search = query[query.rindex("SEARCH") :].split("\n")[0]
+    if method in ["get_objects_by_id", "get_objects_by_ids"]:
+        search = query[query.index("SEARCH") : query.index("RETURN")]
+    if method == "get_object_bundle":
+        search = query[query.index("DOCUMENT(doc_id)") : query.index("LIMIT")]
+    assert "doc._visibility IN @visibility" in search
+    assert "marking" not in query
+    assert bind_vars["visibility"] == ["public", "owner:identity--1"]
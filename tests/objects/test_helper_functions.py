@@ -1,7 +1,26 @@
+import gzip
+import json
 import random
 import pytest
 from unittest.mock import MagicMock, patch
-from dogesec_commons.objects.helpers import positive_int, ArangoDBHelper
+from rest_framework.exceptions import ValidationError
+from arango.exceptions import AQLQueryExecuteError
+from dogesec_commons.objects import conf
+from dogesec_commons.objects.db_view_creator import (
+    SCO_SEARCH_FIELDS,
+    SEARCH_ALIAS,
+    get_primary_sort,
+)
+from dogesec_commons.objects.helpers import (
+    EDGE_COLLECTION_SUFFIX,
+    SDO_SORT_FIELDS,
+    ArangoDBHelper,
+    QueryTimeout,
+    forget_stix_collections,
+    get_stix_collections,
+    positive_int,
+)
+from .utils import make_helper_with_mock_db
 
 
 @pytest.mark.parametrize(
@@ -18,7 +37,6 @@ def test_positive_int(value, cutoff, default, expected):
     assert positive_int(value, cutoff, default) == expected
 
 
-@patch("dogesec_commons.objects.helpers.ArangoDBHelper.client")
 @pytest.mark.parametrize(
     "params",
     [
@@ -28,7 +46,7 @@ def test_positive_int(value, cutoff, default, expected):
         dict(page_size=51),
     ],
 )
-def test_get_page_params(mock_client, params):
+def test_get_page_params(params):
     page, page_size = ArangoDBHelper.get_page_params(params)
     assert page == max(params.get("page", -9), 1)
     assert page_size == min(params.get("page_size", 50), 50)
@@ -139,3 +157,646 @@ def test_get_paginated_response():
     assert response.data["page_number"] == 2
     assert response.data["total_results_count"] == 10
     assert response.data["objects"] == data
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        (
+            {"sort": "name_ascending"},
+            "SORT doc.name ASC, doc.id ASC",
+        ),
+        (
+            {"sort": "modified_descending"},
+            "SORT doc.modified DESC, doc.id DESC",
+        ),
+        (
+            {},
+            "SORT doc.name ASC, doc.id ASC",
+        ),
+    ],
+)
+def test_get_seek_sort_stmt(query, expected):
+    helper = ArangoDBHelper("collection", None)
+    helper.query = query
+    bind_vars = {}
+    search_filters = []
+    assert (
+        helper.get_seek_sort_stmt(
+            ["name_ascending", "modified_descending"], bind_vars, search_filters
+        )
+        == expected
+    )
+    assert bind_vars == {}
+    assert search_filters == []
+    assert helper.seek_condition is None
+
+
+def test_get_seek_sort_stmt_bad_sort():
+    # unknown sorts fall back to the default one
+    helper = ArangoDBHelper("collection", None)
+    helper.query = {"sort": "bad_sort"}
+    stmt = helper.get_seek_sort_stmt(["name_ascending", "modified_descending"], {})
+    assert stmt == "SORT doc.name ASC, doc.id ASC"
+    assert helper.seek_key == ("name_ascending", ["name", "id"])
+
+
+def make_cursor_helper():
+    helper = ArangoDBHelper("collection", None)
+    cursor = ArangoDBHelper.encode_cursor(
+        "modified_descending", ["2024-01-01T00:00:00Z", "indicator--1"]
+    )
+    helper.query = {"sort": "modified_descending", "cursor": cursor}
+    return helper
+
+
+def test_get_seek_sort_stmt_with_cursor():
+    helper = make_cursor_helper()
+    bind_vars = {}
+    search_filters = ["doc.type IN @types"]
+    stmt = helper.get_seek_sort_stmt(
+        ["name_ascending", "modified_descending"], bind_vars, search_filters
+    )
+    assert stmt == "SORT doc.modified DESC, doc.id DESC"
+    condition = "(doc.modified < @cursor_value OR (doc.modified == @cursor_value AND doc.id < @cursor_id))"
+    assert search_filters == ["doc.type IN @types", condition]
+    assert helper.seek_condition == " AND " + condition
+    assert bind_vars == {
+        "cursor_value": "2024-01-01T00:00:00Z",
+        "cursor_id": "indicator--1",
+    }
+
+
+def test_get_seek_sort_stmt_with_cursor_filter():
+    # without search filters, e.g. versions collapsed after SEARCH
+    helper = make_cursor_helper()
+    bind_vars = {}
+    stmt = helper.get_seek_sort_stmt(["name_ascending", "modified_descending"], bind_vars)
+    assert stmt == (
+        "FILTER [doc.modified, doc.id] < [@cursor_value, @cursor_id]\n"
+        "SORT doc.modified DESC, doc.id DESC"
+    )
+    assert stmt.startswith(helper.seek_condition)
+    assert bind_vars["cursor_id"] == "indicator--1"
+
+
+def test_get_seek_sort_stmt_with_null_cursor_value():
+    # a missing sort value cannot be ranged in SEARCH
+    helper = ArangoDBHelper("collection", None)
+    cursor = ArangoDBHelper.encode_cursor("name_ascending", [None, "indicator--1"])
+    helper.query = {"sort": "name_ascending", "cursor": cursor}
+    search_filters = []
+    stmt = helper.get_seek_sort_stmt(["name_ascending"], {}, search_filters)
+    assert search_filters == []
+    assert stmt.startswith("FILTER [doc.name, doc.id] > [@cursor_value, @cursor_id]")
+
+
+@pytest.mark.parametrize("backend", ["arangosearch", SEARCH_ALIAS])
+@pytest.mark.parametrize(
+    "sort,searched",
+    [
+        ("modified_descending", True),
+        ("type_ascending", True),
+        # SEARCH ranges skip objects without a name and compare names bytewise
+        ("name_ascending", False),
+        ("name_descending", False),
+    ],
+)
+def test_get_seek_sort_stmt_with_cursor_searched_fields(backend, sort, searched):
+    helper = ArangoDBHelper("collection", None)
+    cursor = ArangoDBHelper.encode_cursor(sort, ["a", "indicator--1"])
+    helper.query = {"sort": sort, "cursor": cursor}
+    search_filters = []
+    with patch("dogesec_commons.objects.conf.VIEW_BACKEND", backend):
+        stmt = helper.get_seek_sort_stmt(
+            ["name_ascending", "name_descending", "modified_descending", "type_ascending"],
+            {},
+            search_filters,
+        )
+    assert bool(search_filters) == searched
+    assert stmt.startswith("FILTER ") != searched
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not-base64-json",
+        ArangoDBHelper.encode_cursor("name_ascending", ["a", "b"]),
+        ArangoDBHelper.encode_cursor("modified_descending", "not-a-list"),
+        ArangoDBHelper.encode_cursor("modified_descending", ["a"]),
+    ],
+)
+def test_get_seek_sort_stmt_bad_cursor(cursor):
+    helper = ArangoDBHelper("collection", None)
+    helper.query = {"sort": "modified_descending", "cursor": cursor}
+    with pytest.raises(ValidationError):
+        helper.get_seek_sort_stmt(["name_ascending", "modified_descending"], {})
+
+
+def test_get_next_cursor():
+    helper = ArangoDBHelper("collection", None)
+    helper.query = {"sort": "name_ascending"}
+    helper.count = 2
+    helper.get_seek_sort_stmt(["name_ascending"], {})
+    data = [dict(id="x--1", name="a"), dict(id="x--2", name="b")]
+    next_cursor = helper.get_next_cursor(data)
+    assert ArangoDBHelper.decode_cursor(next_cursor, "name_ascending") == ["b", "x--2"]
+    assert helper.get_next_cursor(data[:1]) is None, "partial page is the last page"
+
+
+def test_get_next_cursor_without_seek_support():
+    helper = ArangoDBHelper("collection", None)
+    helper.count = 1
+    assert helper.get_next_cursor([dict(id="x--1")]) is None
+
+
+@pytest.mark.parametrize(
+    "count_mode,full_count,expected_total",
+    [
+        ("exact", True, 77),
+        (None, True, 77),
+        ("bad-mode", True, 77),
+        ("none", False, None),
+    ],
+)
+def test_execute_query_count_modes(count_mode, full_count, expected_total):
+    queries = {"count": count_mode} if count_mode else {}
+    helper = make_helper_with_mock_db(**queries)
+    response = helper.execute_query("FOR doc IN x LIMIT @offset, @count RETURN doc", {})
+    assert helper.db.aql.execute.call_args[1]["full_count"] == full_count
+    assert response.data["total_results_count"] == expected_total
+
+
+def test_execute_query_count_estimate_is_cached():
+    query = "FOR doc IN x FILTER doc.type == @type LIMIT @offset, @count RETURN doc"
+    helper = make_helper_with_mock_db(count="estimate")
+    response = helper.execute_query(query, {"type": "estimate-test"})
+    assert helper.db.aql.execute.call_args[1]["full_count"] == True
+    assert response.data["total_results_count"] == 77
+
+    helper = make_helper_with_mock_db(count="estimate", page="2")
+    response = helper.execute_query(query, {"type": "estimate-test"})
+    assert helper.db.aql.execute.call_args[1]["full_count"] == False
+    assert response.data["total_results_count"] == 77
+
+    helper = make_helper_with_mock_db(count="estimate")
+    response = helper.execute_query(query, {"type": "other-filter"})
+    assert helper.db.aql.execute.call_args[1]["full_count"] == True
+
+
+@pytest.mark.parametrize("count_mode", ["exact", "estimate"])
+def test_execute_query_with_cursor_skips_full_count(count_mode):
+    # fullCount would only count the rows after the cursor
+    cursor = ArangoDBHelper.encode_cursor("created_descending", ["2024", "x--1"])
+    helper = make_helper_with_mock_db(
+        count=count_mode, cursor=cursor, page="3", sort="created_descending"
+    )
+    response = helper.get_sros()
+    kwargs = helper.db.aql.execute.call_args[1]
+    assert kwargs["full_count"] == False
+    assert kwargs["bind_vars"]["offset"] == 0
+    assert response.data["total_results_count"] is None
+
+
+@pytest.mark.parametrize("method", ["get_sdos", "get_sros"])
+def test_count_estimate_is_shared_by_cursor_pages(method):
+    queries = dict(
+        count="estimate",
+        labels="estimate-cursor",
+        relationship_type="estimate-cursor",
+        sort="created_descending",
+    )
+    first_page = make_helper_with_mock_db(**queries)
+    getattr(first_page, method)()
+    assert first_page.db.aql.execute.call_args[1]["full_count"] == True
+
+    cursor = ArangoDBHelper.encode_cursor("created_descending", ["2024", "x--1"])
+    helper = make_helper_with_mock_db(**queries, cursor=cursor)
+    response = getattr(helper, method)()
+    assert response.data["total_results_count"] == 77
+
+
+def make_export_helper(accept_encoding="", **queries):
+    helper = make_helper_with_mock_db(**queries)
+    helper.export = True
+    helper.request.META = {"HTTP_ACCEPT_ENCODING": accept_encoding}
+    cursor = helper.db.aql.execute.return_value
+    cursor.__iter__.return_value = iter([{"id": "x--1"}, {"id": "x--2"}])
+    return helper
+
+
+def test_execute_query_export_ndjson():
+    helper = make_export_helper()
+    response = helper.execute_query("FOR doc IN x LIMIT @offset, @count RETURN doc", {})
+    assert response["Content-Type"] == "application/x-ndjson"
+    assert b"".join(response.streaming_content) == b'{"id": "x--1"}\n{"id": "x--2"}\n'
+    kwargs = helper.db.aql.execute.call_args[1]
+    assert kwargs["stream"] is True
+    assert kwargs["bind_vars"]["offset"] == 0
+    helper.db.aql.execute.return_value.close.assert_called_once()
+
+
+def test_execute_query_export_bundle():
+    helper = make_export_helper(export_format="bundle")
+    response = helper.execute_query("FOR doc IN x LIMIT @offset, @count RETURN doc", {})
+    assert response["Content-Type"] == "application/json"
+    bundle = json.loads(b"".join(response.streaming_content))
+    assert bundle["type"] == "bundle"
+    assert bundle["id"].startswith("bundle--")
+    assert bundle["objects"] == [{"id": "x--1"}, {"id": "x--2"}]
+
+
+def test_execute_query_export_gzip():
+    helper = make_export_helper(accept_encoding="gzip, deflate")
+    response = helper.execute_query("FOR doc IN x LIMIT @offset, @count RETURN doc", {})
+    assert response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response["Vary"]
+    content = gzip.decompress(b"".join(response.streaming_content))
+    assert content == b'{"id": "x--1"}\n{"id": "x--2"}\n'
+
+
+def test_execute_query_export_bad_format():
+    helper = make_export_helper(export_format="csv")
+    with pytest.raises(ValidationError):
+        helper.execute_query("FOR doc IN x LIMIT @offset, @count RETURN doc", {})
+    helper.db.aql.execute.assert_not_called()
+
+
+def test_execute_query_passes_query_limits():
+    helper = make_helper_with_mock_db()
+    with patch.dict(
+        "dogesec_commons.objects.conf.QUERY_LIMITS", {"scos": dict(max_runtime=2.5)}
+    ), patch.dict(
+        "dogesec_commons.objects.conf.DEFAULT_QUERY_LIMITS",
+        dict(max_runtime=30, memory_limit=1024, fail_on_warning=True),
+    ):
+        helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="scos")
+        kwargs = helper.db.aql.execute.call_args[1]
+        assert kwargs["max_runtime"] == 2.5
+        assert kwargs["memory_limit"] == 1024
+        assert kwargs["fail_on_warning"] == True
+
+        helper.execute_query("FOR doc IN x RETURN doc", {}, paginate=False)
+        kwargs = helper.db.aql.execute.call_args[1]
+        assert "max_runtime" not in kwargs
+
+
+@pytest.mark.parametrize(
+    "query_name,max_runtime",
+    [("object", 5), ("retrieve", 10), ("sdos", 20), ("bundle", 30), ("export", 0)],
+)
+def test_get_query_limits_endpoint_defaults(query_name, max_runtime):
+    limits = ArangoDBHelper.get_query_limits(query_name)
+    assert limits["max_runtime"] == max_runtime
+    assert limits["memory_limit"] == conf.DEFAULT_QUERY_LIMITS["memory_limit"]
+
+
+@pytest.mark.parametrize(
+    "error_code,expected_exception,status_code",
+    [
+        (1500, QueryTimeout, 503),
+        (32, ValidationError, 400),
+        (1562, ValidationError, 400),
+    ],
+)
+def test_execute_query_limit_errors(error_code, expected_exception, status_code):
+    helper = make_helper_with_mock_db()
+    helper.db.aql.execute.side_effect = AQLQueryExecuteError(
+        MagicMock(error_code=error_code, error_message="some error"), MagicMock()
+    )
+    with pytest.raises(expected_exception) as exc_info:
+        helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="sdos")
+    assert exc_info.value.status_code == status_code
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+def test_get_value_search(prefilter):
+    helper = make_helper_with_mock_db()
+    bind_vars = {}
+    with patch("dogesec_commons.objects.conf.SCO_SEARCH_NGRAM_PREFILTER", prefilter):
+        search = helper.get_value_search("Static_Key", bind_vars, fields=["value", "key"])
+    assert bind_vars == {"search_value": "static_key", "search_like": "%static\\_key%"}
+    assert 'ANALYZER(doc.value LIKE @search_like OR doc.key LIKE @search_like, "dogesec_norm")' in search
+    assert ('NGRAM_MATCH(doc.value, @search_value, 1, "dogesec_ngram")' in search) == prefilter
+    assert "LOWER" not in search
+
+
+def test_get_value_search_search_alias():
+    helper = make_helper_with_mock_db()
+    bind_vars = {}
+    with patch("dogesec_commons.objects.conf.VIEW_BACKEND", "search-alias"):
+        search = helper.get_value_search("Static_Key", bind_vars, fields=["value", "key"])
+    # the analyzer comes from the inverted index, there is no n-gram index
+    assert search == "(doc.value LIKE @search_like OR doc.key LIKE @search_like)"
+
+
+def test_get_value_search_exact():
+    helper = make_helper_with_mock_db()
+    bind_vars = {}
+    search = helper.get_value_search("AS12345", bind_vars, exact=True, fields=["number"])
+    assert bind_vars == {"search_value": "as12345"}
+    assert search == '(ANALYZER(doc.number == @search_value, "dogesec_norm"))'
+    assert "NGRAM_MATCH" not in search
+
+
+def test_get_value_search_digits():
+    # autonomous-system.number only matches the whole number, even in wildcard mode
+    helper = make_helper_with_mock_db()
+    bind_vars = {}
+    search = helper.get_value_search("12", bind_vars, fields=["value", "number"])
+    assert bind_vars["search_number"] == 12
+    assert search.endswith("OR doc.number == @search_number)")
+    assert "NGRAM_MATCH" not in search
+
+
+def test_get_scos_value_in_search():
+    helper = make_helper_with_mock_db(value="1.1.1")
+    helper.get_scos()
+    query = helper.db.aql.execute.call_args[0][0]
+    assert "FILTER" not in query[: query.index("SORT")]
+    assert "doc.value LIKE @search_like" in query
+
+
+@pytest.mark.parametrize(
+    "queries,types,expected_fields",
+    [
+        ({}, None, [f for f in SCO_SEARCH_FIELDS if f not in ("payload_bin", "body")]),
+        ({}, {"ipv4-addr", "windows-registry-key"}, ["value", "key"]),
+        ({}, {"artifact"}, ["payload_bin"]),
+        ({}, {"email-message"}, ["subject"]),
+        ({}, set(), [f for f in SCO_SEARCH_FIELDS if f not in ("payload_bin", "body")]),
+        (dict(value_fields="body,value"), {"ipv4-addr"}, ["value", "body"]),
+    ],
+)
+def test_get_sco_value_fields(queries, types, expected_fields):
+    helper = make_helper_with_mock_db(**queries)
+    assert helper.get_sco_value_fields(types) == expected_fields
+
+
+def test_get_sco_value_fields_unknown_field():
+    helper = make_helper_with_mock_db(value_fields="value,_key")
+    with pytest.raises(ValidationError):
+        helper.get_sco_value_fields()
+
+
+@pytest.mark.parametrize("method", ["get_scos", "get_smos", "get_sdos", "get_sros"])
+def test_list_queries_use_canonical_latest(method):
+    helper = make_helper_with_mock_db()
+    getattr(helper, method)()
+    query = helper.db.aql.execute.call_args[0][0]
+    assert "doc._is_canonical_latest == TRUE" in query
+    assert "COLLECT" not in query
+
+
+def test_get_sros_all_versions_collapsed():
+    helper = make_helper_with_mock_db()
+    helper.SRO_OBJECTS_ONLY_LATEST = False
+    helper.get_sros()
+    query = helper.db.aql.execute.call_args[0][0]
+    assert "_is_canonical_latest" not in query
+    assert "COLLECT id = doc.id INTO docs" in query
+
+
+@pytest.mark.parametrize(
+    "sort", ["modified_descending", "created_ascending", "name_ascending"]
+)
+def test_seek_sort_matches_view_primary_sort(sort):
+    # the view's primary sort is only used when the SORT matches it exactly
+    helper = make_helper_with_mock_db(sort=sort)
+    assert helper.get_seek_sort_stmt(SDO_SORT_FIELDS, {}) == "SORT " + ", ".join(
+        f"doc.{s['field']} {s['direction'].upper()}" for s in get_primary_sort(sort)
+    )
+
+
+@pytest.mark.parametrize("method", ["get_scos", "get_smos", "get_sdos", "get_sros"])
+def test_list_queries_fields_projection(method):
+    helper = make_helper_with_mock_db(fields="type,modified,type")
+    getattr(helper, method)()
+    query = helper.db.aql.execute.call_args[0][0]
+    assert "KEEP(" not in query
+    fields = ["type", "modified", *helper.seek_key[1]]
+    projection = ", ".join(f'"{f}": doc.`{f}`' for f in dict.fromkeys(fields))
+    assert f"RETURN {{{projection}}}" in query
+
+
+def test_get_projection_default():
+    helper = make_helper_with_mock_db()
+    assert helper.get_projection() == "KEEP(doc, KEYS(doc, true))"
+
+
+@pytest.mark.parametrize("fields", ["id,doc.name", "name`", "1abc"])
+def test_get_projection_invalid(fields):
+    helper = make_helper_with_mock_db(fields=fields)
+    with pytest.raises(ValidationError):
+        helper.get_projection()
+
+
+@pytest.mark.parametrize(
+    "depth,expand_depth",
+    [(None, 0), ("2", 1), ("100", 2), ("bad", 0)],
+)
+def test_get_object_bundle_traversal(depth, expand_depth):
+    queries = dict(types="indicator,relationship", include_embedded_refs="false")
+    if depth:
+        queries["depth"] = depth
+    helper = make_helper_with_mock_db(**queries)
+    helper.db.collections.return_value = [
+        dict(name="b_edge_collection", system=False),
+        dict(name="a_vertex_collection", system=False),
+        dict(name="a_edge_collection", system=False),
+        dict(name="_graphs", system=True),
+    ]
+    with patch("dogesec_commons.objects.conf.BUNDLE_MAXIMUM_DEPTH", 3):
+        helper.get_object_bundle("indicator--1")
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    assert bind_vars["expand_depth"] == expand_depth
+    assert bind_vars["@edge_collection_0"] == "a_edge_collection"
+    assert bind_vars["@edge_collection_1"] == "b_edge_collection"
+    assert "@edge_collection_2" not in bind_vars
+    assert (
+        "0..@expand_depth ANY start._id @@edge_collection_0, @@edge_collection_1"
+        in query
+    )
+    assert 'uniqueVertices: "global"' in query
+    assert "PRUNE LENGTH(p.edges) > 0 AND (v.type NOT IN @types)" in query
+    assert "p.edges[*]._is_ref ALL != TRUE" in query
+    # no IN list over the view
+    assert "IN bundle_ids" not in query
+    # vertex collections are declared for clusters
+    assert query.split()[:2] == ["WITH", "@@vertex_collection_0"]
+    assert bind_vars["@vertex_collection_0"] == "a_vertex_collection"
+    assert "@vertex_collection_1" not in bind_vars
+
+
+def test_get_object_bundle_reuses_collection_list():
+    helper = make_helper_with_mock_db()
+    helper.db.collections.return_value = [
+        dict(name="a_vertex_collection", system=False),
+        dict(name="a_edge_collection", system=False),
+    ]
+    helper.get_object_bundle("indicator--1")
+    helper.get_object_bundle("indicator--2")
+    helper.db.collections.assert_called_once()
+
+
+def test_get_object_bundle_without_edge_collections():
+    helper = make_helper_with_mock_db()
+    helper.db.collections.return_value = []
+    helper.get_object_bundle("indicator--1")
+    query = helper.db.aql.execute.call_args[0][0]
+    assert "LET bundle_ids = []" in query
+    assert " ANY " not in query
+    assert "WITH" not in query
+
+
+def test_get_objects_by_ids():
+    helper = make_helper_with_mock_db()
+    helper.db.aql.execute.return_value.__iter__.return_value = iter(
+        [["indicator--1", {"id": "indicator--1"}]]
+    )
+    response = helper.get_objects_by_ids(["indicator--1", "indicator--2"])
+    assert response.data == dict(
+        objects={"indicator--1": {"id": "indicator--1"}}, missing=["indicator--2"]
+    )
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    assert "SEARCH doc.id IN @ids AND doc._is_canonical_latest == TRUE" in query
+    assert "COLLECT" not in query
+    assert bind_vars["ids"] == ["indicator--1", "indicator--2"]
+    assert "visibility" not in bind_vars
+
+
+def test_get_stix_collections_is_cached():
+    helper = make_helper_with_mock_db()
+    helper.db.collections.return_value = [
+        dict(name="b_edge_collection", system=False),
+        dict(name="b_vertex_collection", system=False),
+        dict(name="other", system=False),
+        dict(name="_system_edge_collection", system=True),
+    ]
+    with patch("dogesec_commons.objects.conf.STIX_COLLECTIONS_CACHE_TTL", 300):
+        assert get_stix_collections(helper.db) == [
+            "b_edge_collection",
+            "b_vertex_collection",
+        ]
+        assert get_stix_collections(helper.db, EDGE_COLLECTION_SUFFIX) == [
+            "b_edge_collection"
+        ]
+    helper.db.collections.assert_called_once()
+    forget_stix_collections()
+    get_stix_collections(helper.db)
+    assert helper.db.collections.call_count == 2
+
+
+@pytest.mark.parametrize("visible_to", [None, "identity--1"])
+def test_get_objects_by_id_reads_keys(visible_to):
+    queries = dict(visible_to=visible_to) if visible_to else {}
+    helper = make_helper_with_mock_db(**queries)
+    helper.db.collections.return_value = [
+        dict(name="a_vertex_collection", system=False),
+        dict(name="a_edge_collection", system=False),
+    ]
+    response = helper.get_objects_by_id("indicator--1")
+    assert response.data == {"id": "x--1"}
+    helper.db.aql.execute.assert_called_once()
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    assert "@@view" not in query
+    assert query.count("FILTER doc._key >= @key_start AND doc._key < @key_end") == 2
+    # the same version as the list endpoints and /objects/retrieve/
+    assert query.count("FILTER doc._is_canonical_latest == TRUE") == 2
+    assert "_is_latest" not in query
+    assert bind_vars["@collection_0"] == "a_edge_collection"
+    assert bind_vars["@collection_1"] == "a_vertex_collection"
+    assert bind_vars["key_start"] == "indicator--1+"
+    assert bind_vars["key_end"] == "indicator--1,"
+    assert ("doc._visibility IN @visibility" in query) == bool(visible_to)
+
+
+def test_get_objects_by_id_falls_back_to_view():
+    helper = make_helper_with_mock_db()
+    helper.db.collections.return_value = [
+        dict(name="a_vertex_collection", system=False),
+    ]
+    helper.db.aql.execute.return_value.__iter__.side_effect = [
+        iter([]),
+        iter([{"id": "indicator--1"}]),
+    ]
+    response = helper.get_objects_by_id("indicator--1")
+    assert response.data == {"id": "indicator--1"}
+    assert helper.db.aql.execute.call_count == 2
+    assert (
+        "SEARCH doc.id == @id AND doc._is_canonical_latest == TRUE"
+        in helper.db.aql.execute.call_args[0][0]
+    )
+
+
+def test_get_objects_by_id_key_lookup_disabled():
+    helper = make_helper_with_mock_db()
+    with patch("dogesec_commons.objects.conf.OBJECT_KEY_LOOKUP", False):
+        helper.get_objects_by_id("indicator--1")
+    helper.db.collections.assert_not_called()
+    assert "SEARCH doc.id == @id" in helper.db.aql.execute.call_args[0][0]
+
+
+@pytest.mark.parametrize(
+    "queries,expected_filters,expected_bind_vars",
+    [
+        (
+            dict(source_ref="indicator--1,indicator--2", target_ref="ipv4-addr--1"),
+            ["doc.source_ref IN @source_ref", "doc.target_ref IN @target_ref"],
+            dict(
+                source_ref=["indicator--1", "indicator--2"],
+                target_ref=["ipv4-addr--1"],
+            ),
+        ),
+        (
+            dict(relationship_type="indicates,Uses"),
+            [
+                "(doc.relationship_type LIKE @relationship_type_0 OR doc.relationship_type LIKE @relationship_type_1)"
+            ],
+            dict(relationship_type_0="%indicates%", relationship_type_1="%uses%"),
+        ),
+        (
+            dict(relationship_type="indicates,uses", relationship_type_exact="true"),
+            ["doc.relationship_type IN @relationship_type"],
+            dict(relationship_type=["indicates", "uses"]),
+        ),
+    ],
+)
+def test_get_sros_multi_valued_filters(queries, expected_filters, expected_bind_vars):
+    helper = make_helper_with_mock_db(**queries)
+    helper.get_sros()
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    search = query[query.index("SEARCH") :].split("\n")[0]
+    for search_filter in expected_filters:
+        assert search_filter in search
+    assert "LIKE" not in search or "relationship_type_exact" not in queries
+    for key, value in expected_bind_vars.items():
+        assert bind_vars[key] == value
+
+
+@pytest.mark.parametrize("method", ["get_scos", "get_sdos", "get_sros"])
+def test_list_scoped_by_report_and_post_in_search(method):
+    helper = make_helper_with_mock_db(report_id="report--1", post_id="post-1")
+    getattr(helper, method)()
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    search = query[query.index("SEARCH") :].split("\n")[0]
+    assert "doc.`_stixify_report_id` == @scope_0" in search
+    assert "doc.`_obstracts_post_id` == @scope_1" in search
+    assert "MATCHES" not in query
+    assert bind_vars["scope_0"] == "report--1"
+    assert bind_vars["scope_1"] == "post-1"
+
+
+def test_get_scos_matcher_in_search():
+    helper = make_helper_with_mock_db()
+    helper.get_scos(matcher={"_obstracts_post_id": "post-1"})
+    query = helper.db.aql.execute.call_args[0][0]
+    bind_vars = helper.db.aql.execute.call_args[1]["bind_vars"]
+    search = query[query.index("SEARCH") :].split("\n")[0]
+    assert "doc.`_obstracts_post_id` == @scope_0" in search
+    assert bind_vars["scope_0"] == "post-1"
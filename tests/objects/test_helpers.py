@@ -240,8 +240,8 @@ SCO_VALUE_FILTER_TEST_DATA = test_data = [
             }
         ],
         "static",
-        ["artifact-1"],
-        id="match-artifact-on-payload_bin",
+        [],
+        id="skip-artifact-payload_bin-by-default",
     ),
     pytest.param(
         [{"type": "autonomous-system", "number": "AS12345", "id": "as-1"}],
@@ -318,8 +318,8 @@ SCO_VALUE_FILTER_TEST_DATA = test_data = [
             }
         ],
         "static",
-        ["email-msg-1"],
-        id="match-email-message-on-body",
+        [],
+        id="skip-email-message-body-by-default",
     ),
     pytest.param(
         [{"type": "file", "name": "static.exe", "id": "file-1"}],
@@ -444,6 +444,57 @@ def test_get_scos_value_filter(subtests, objects, value, expected_ids):
             sco_sort_test()
 
 
+@pytest.mark.parametrize(
+    ["queries", "expected_ids"],
+    [
+        pytest.param(
+            dict(value_fields="payload_bin"),
+            ["artifact-1"],
+            id="match-artifact-on-payload_bin",
+        ),
+        pytest.param(
+            dict(types="artifact"),
+            ["artifact-1"],
+            id="match-artifact-on-payload_bin-by-type",
+        ),
+        pytest.param(
+            dict(value_fields="body,subject"),
+            ["email-msg-1"],
+            id="match-email-message-on-body",
+        ),
+        pytest.param(
+            dict(types="email-message"),
+            [],
+            id="skip-email-message-body-by-type",
+        ),
+        pytest.param(
+            dict(types="domain-name,file"),
+            ["domain-1"],
+            id="match-only-type-identity-fields",
+        ),
+    ],
+)
+def test_get_scos_value_fields(queries, expected_ids):
+    objects = [
+        {"type": "artifact", "payload_bin": "some static content", "id": "artifact-1"},
+        {
+            "type": "email-message",
+            "body": "This message contains static content.",
+            "id": "email-msg-1",
+        },
+        {"type": "domain-name", "value": "malicious-static.net", "id": "domain-1"},
+        {"type": "ipv4-addr", "value": "static", "id": "ipv4-1"},
+    ]
+    helper = ArangoDBHelper(
+        conf.ARANGODB_DATABASE_VIEW, request_from_queries(value="static", **queries)
+    )
+    with make_s2a_uploads(
+        [("test_sco_value_fields", objects)], truncate_collection=True
+    ):
+        object_ids = {obj["id"] for obj in helper.get_scos().data["objects"]}
+        assert object_ids == set(expected_ids)
+
+
 @pytest.fixture(scope="module")
 def sco_exact_match_data():
     with make_s2a_uploads(
@@ -868,6 +919,39 @@ def sro_data():
                 "relationship--9cf0369a-8646-4979-ae2c-ab0d3c95bfad",
             ],
         ),
+        (
+            dict(source_ref="ex-type1--2,ex-type3--3"),
+            [
+                "relationship--9cf0369a-8646-4979-ae2c-ab0d3c95bfad",
+                "relationship--ce65bbc0-5715-4d44-a24f-42b9757d36f4",
+            ],
+        ),
+        (
+            dict(target_ref="ex-type1--3,ex-type3--3,sd"),
+            [
+                "relationship--8a5a7ecf-56cc-4ca5-947f-088870f54ea9",
+                "relationship--1162f86e-c825-4b20-a69e-ea8a6d9d3948",
+            ],
+        ),
+        (
+            dict(relationship_type="killed,created"),
+            [
+                "relationship--9cf0369a-8646-4979-ae2c-ab0d3c95bfad",
+                "relationship--1162f86e-c825-4b20-a69e-ea8a6d9d3948",
+            ],
+        ),
+        (
+            dict(relationship_type="for", relationship_type_exact="true"),
+            [],
+        ),
+        (
+            dict(relationship_type="exists-for,killed-by", relationship_type_exact="true"),
+            [
+                "relationship--8a5a7ecf-56cc-4ca5-947f-088870f54ea9",
+                "relationship--1162f86e-c825-4b20-a69e-ea8a6d9d3948",
+                "relationship--ce65bbc0-5715-4d44-a24f-42b9757d36f4",
+            ],
+        ),
     ],
 )
 def test_sro_filters(sro_data, filters, expected_ids):
@@ -1285,3 +1369,110 @@ def test_sort_sdos(sdo_data, sort, expected_ids):
         for obj in helper.get_sdos().data["objects"]
         if obj["type"] != "identity"
     ] == expected_ids
+
+
+@pytest.fixture
+def unnamed_and_mixed_case_sdo_data():
+    # objects without a name and names that differ only by case
+    objects = [
+        {
+            "type": "note",
+            "id": "note--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a01",
+            "content": "a note has no name",
+            "object_refs": ["malware--1d3fcb2b-4718-4a65-9d0b-2f3d823dbf3d"],
+            "created": "2023-02-01T00:00:00Z",
+            "modified": "2023-02-01T00:00:00Z",
+        },
+        {
+            "type": "opinion",
+            "id": "opinion--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a02",
+            "opinion": "agree",
+            "object_refs": ["malware--1d3fcb2b-4718-4a65-9d0b-2f3d823dbf3d"],
+            "created": "2023-02-02T00:00:00Z",
+            "modified": "2023-02-02T00:00:00Z",
+        },
+        {
+            "type": "indicator",
+            "id": "indicator--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a03",
+            "pattern": "[ipv4-addr:value = '1.1.1.1']",
+            "pattern_type": "stix",
+            "valid_from": "2023-02-03T00:00:00Z",
+            "created": "2023-02-03T00:00:00Z",
+            "modified": "2023-02-03T00:00:00Z",
+        },
+        {
+            "type": "tool",
+            "id": "tool--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a04",
+            "name": "netprobe",
+            "created": "2023-02-04T00:00:00Z",
+            "modified": "2023-02-04T00:00:00Z",
+        },
+        {
+            "type": "tool",
+            "id": "tool--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a05",
+            "name": "NETPROBE",
+            "created": "2023-02-05T00:00:00Z",
+            "modified": "2023-02-05T00:00:00Z",
+        },
+        {
+            "type": "malware",
+            "id": "malware--7a7b8f2e-3c3b-4d0e-9a43-0c3f0a3c9a06",
+            "name": "zeta loader",
+            "is_family": False,
+            "created": "2023-02-06T00:00:00Z",
+            "modified": "2023-02-06T00:00:00Z",
+        },
+    ]
+    with make_s2a_uploads(
+        [("test_sdo_cursor_names", objects)], truncate_collection=True
+    ):
+        yield objects
+
+
+@pytest.mark.parametrize(
+    "sort",
+    [
+        "name_ascending",
+        "name_descending",
+        "modified_descending",
+        "created_ascending",
+        "type_descending",
+    ],
+)
+@pytest.mark.parametrize("with_unnamed_and_mixed_case", [False, True])
+def test_sdos_cursor_pagination_matches_offset_pagination(
+    request, sdo_data, sort, with_unnamed_and_mixed_case
+):
+    if with_unnamed_and_mixed_case:
+        extra_ids = {
+            obj["id"]
+            for obj in request.getfixturevalue("unnamed_and_mixed_case_sdo_data")
+        }
+    expected_ids = [
+        obj["id"]
+        for obj in ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW,
+            request_from_queries(sort=sort),
+        )
+        .get_sdos()
+        .data["objects"]
+    ]
+    if with_unnamed_and_mixed_case:
+        assert extra_ids.issubset(expected_ids)
+
+    seen_ids = []
+    cursor = None
+    while True:
+        queries = dict(sort=sort, page_size=2)
+        if cursor:
+            queries.update(cursor=cursor)
+        data = ArangoDBHelper(
+            conf.ARANGODB_DATABASE_VIEW, request_from_queries(**queries)
+        ).get_sdos().data
+        seen_ids.extend(obj["id"] for obj in data["objects"])
+        if cursor:
+            assert data["total_results_count"] is None
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+    assert seen_ids == expected_ids
@@ -0,0 +1,131 @@
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import RequestFactory
+
+from dogesec_commons.objects import query_stats
+from dogesec_commons.objects.views import query_metrics
+from .utils import make_helper_with_mock_db
+
+STATISTICS = {
+    "fullCount": 77,
+    "execution_time": 0.25,
+    "scanned_index": 100,
+    "scanned_full": 5,
+    "filtered": 20,
+    "peak_memory_usage": 32768,
+}
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    query_stats.reset()
+    yield
+    query_stats.reset()
+
+
+def test_fingerprint_ignores_whitespace():
+    assert query_stats.fingerprint(
+        "FOR doc IN x\n   RETURN doc"
+    ) == query_stats.fingerprint("FOR doc IN x RETURN doc")
+    assert query_stats.fingerprint("FOR doc IN x RETURN doc") != query_stats.fingerprint(
+        "FOR doc IN y RETURN doc"
+    )
+
+
+def test_bind_var_shapes():
+    assert query_stats.bind_var_shapes(
+        {"@collection": "some_view", "types": ["a", "b"], "value": "secret", "count": 5}
+    ) == {"@collection": "some_view", "types": "list[2]", "value": "str", "count": "int"}
+
+
+def test_record_and_render_prometheus():
+    query_stats.record("sdos", "FOR doc IN x RETURN doc", {}, STATISTICS)
+    query_stats.record("sdos", "FOR doc IN x   RETURN doc", {}, STATISTICS)
+    query_stats.record(None, "FOR doc IN y RETURN doc", {}, {})
+    text = query_stats.render_prometheus()
+    labels = f'endpoint="sdos",fingerprint="{query_stats.fingerprint("FOR doc IN x RETURN doc")}"'
+    assert f"dogesec_commons_aql_queries_total{{{labels}}} 2" in text
+    assert f"dogesec_commons_aql_execution_seconds_total{{{labels}}} 0.5" in text
+    assert f"dogesec_commons_aql_scanned_full_total{{{labels}}} 10" in text
+    assert 'endpoint="internal"' in text
+
+
+def test_slow_query_log(caplog):
+    with patch.object(query_stats.conf, "SLOW_QUERY_THRESHOLD", 0.1), caplog.at_level(
+        logging.WARNING, logger="dogesec_commons.objects.slow_queries"
+    ):
+        query_stats.record("sdos", "FOR doc IN x RETURN doc", {"value": "abc"}, STATISTICS)
+        query_stats.record(
+            "sdos", "FOR doc IN x RETURN doc", {}, {**STATISTICS, "execution_time": 0.01}
+        )
+    assert len(caplog.records) == 1
+    assert "'value': 'str'" in caplog.text
+    assert "abc" not in caplog.text
+
+
+@pytest.mark.parametrize("server_timing", [True, False])
+def test_execute_query_records_stats(server_timing):
+    helper = make_helper_with_mock_db()
+    helper.db.aql.execute.return_value.statistics.return_value = STATISTICS
+    with patch.object(query_stats.conf, "QUERY_STATS_SERVER_TIMING", server_timing):
+        response = helper.execute_query(
+            "FOR doc IN x LIMIT @offset, @count RETURN doc", {}, query_name="sdos"
+        )
+    assert response.data["total_results_count"] == 77
+    if server_timing:
+        assert response["Server-Timing"] == 'aql;dur=250.0;desc="sdos"'
+    else:
+        assert "Server-Timing" not in response
+    assert 'endpoint="sdos"' in query_stats.render_prometheus()
+
+
+def make_metrics_request(is_staff, **headers):
+    request = RequestFactory().get("/metrics/aql/", headers=headers)
+    request.user = MagicMock(is_staff=is_staff)
+    return request
+
+
+def test_query_metrics_view():
+    query_stats.record("scos", "FOR doc IN x RETURN doc", {}, STATISTICS)
+    with patch("dogesec_commons.objects.conf.QUERY_METRICS_ENDPOINT", True):
+        response = query_metrics(make_metrics_request(is_staff=True))
+    assert response.status_code == 200
+    assert response["Content-Type"].startswith("text/plain")
+    assert b'endpoint="scos"' in response.content
+
+
+def test_query_metrics_view_is_restricted():
+    with patch("dogesec_commons.objects.conf.QUERY_METRICS_ENDPOINT", True):
+        with pytest.raises(PermissionDenied):
+            query_metrics(make_metrics_request(is_staff=False))
+    with pytest.raises(Http404):
+        query_metrics(make_metrics_request(is_staff=True))
+
+
+@pytest.mark.parametrize(
+    "token,authorization,allowed",
+    [
+        ("secret", "Bearer secret", True),
+        ("secret", "bearer secret", True),
+        ("secret", "Bearer other", False),
+        ("secret", "Basic secret", False),
+        ("secret", None, False),
+        (None, "Bearer ", False),
+    ],
+)
+def test_query_metrics_view_token(token, authorization, allowed):
+    headers = dict(Authorization=authorization) if authorization else {}
+    with (
+        patch("dogesec_commons.objects.conf.QUERY_METRICS_ENDPOINT", True),
+        patch("dogesec_commons.objects.conf.QUERY_METRICS_TOKEN", token),
+    ):
+        request = make_metrics_request(is_staff=False, **headers)
+        if allowed:
+            assert query_metrics(request).status_code == 200
+        else:
+            with pytest.raises(PermissionDenied):
+                query_metrics(request)
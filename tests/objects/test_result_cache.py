@@ -0,0 +1,160 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from dogesec_commons.objects import result_cache
+from .utils import make_helper_with_mock_db
+
+
+@pytest.fixture(autouse=True)
+def clean_result_cache():
+    result_cache.reset()
+    yield
+    result_cache.reset()
+
+
+@pytest.fixture
+def lru_backend():
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_BACKEND", "lru"), patch(
+        "dogesec_commons.objects.conf.RESULT_CACHE_OPTIONS", dict(max_entries=2)
+    ):
+        yield result_cache.get_backend()
+
+
+def make_db(generation=None):
+    db = MagicMock()
+    db.name = "some_database"
+    db.has_collection.return_value = generation is not None
+    db.collection.return_value.get.return_value = (
+        None if generation is None else dict(generation=generation)
+    )
+    return db
+
+
+def test_lru_backend():
+    backend = result_cache.LRUBackend(max_entries=2)
+    value = [{"id": "x--1"}]
+    backend.set("a", value, 60)
+    backend.set("b", [], 60)
+    value.append({"id": "x--2"})
+    assert backend.get("a") == [{"id": "x--1"}]
+    backend.get("a")[0]["id"] = "changed"
+    assert backend.get("a") == [{"id": "x--1"}]
+    backend.set("c", [], 60)
+    # b is the least recently used
+    assert backend.get("b") is None
+    assert backend.get("a") is not None
+    backend.set("d", [], -1)
+    assert backend.get("d") is None
+
+
+@pytest.mark.parametrize(
+    "name,backend_class",
+    [
+        ("lru", result_cache.LRUBackend),
+        ("django", result_cache.DjangoCacheBackend),
+        ("dogesec_commons.objects.result_cache.LRUBackend", result_cache.LRUBackend),
+    ],
+)
+def test_get_backend(name, backend_class):
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_BACKEND", name):
+        backend = result_cache.get_backend()
+        assert type(backend) is backend_class
+        assert result_cache.get_backend() is backend
+
+
+def test_get_backend_disabled():
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_BACKEND", None):
+        assert result_cache.get_backend() is None
+        assert result_cache.get_cache_key(make_db(), "sdos", "query", {}) is None
+
+
+def test_get_generation_is_remembered():
+    db = make_db(generation=4)
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_GENERATION_TTL", 60):
+        assert result_cache.get_generation(db) == 4
+        db.collection.return_value.get.return_value = dict(generation=5)
+        assert result_cache.get_generation(db) == 4
+    db.collection.return_value.get.assert_called_once_with(result_cache.GENERATION_KEY)
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_GENERATION_TTL", 0):
+        result_cache.reset()
+        assert result_cache.get_generation(db) == 5
+    assert result_cache.get_generation(make_db()) == 0
+
+
+def test_bump_generation():
+    db = make_db(generation=4)
+    db.aql.execute.return_value = iter([5])
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_GENERATION_TTL", 60):
+        assert result_cache.bump_generation(db) == 5
+        # the writing process sees its own write right away
+        assert result_cache.get_generation(db) == 5
+    query = db.aql.execute.call_args[0][0]
+    assert "UPSERT" in query
+    assert db.aql.execute.call_args[1]["bind_vars"] == {
+        "key": result_cache.GENERATION_KEY,
+        "@collection": "_dogesec_commons",
+    }
+
+
+def test_bump_generation_does_not_raise():
+    db = make_db()
+    db.aql.execute.side_effect = Exception("server down")
+    assert result_cache.bump_generation(db) is None
+
+
+def test_get_cache_key(lru_backend):
+    db = make_db(generation=1)
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_GENERATION_TTL", 0):
+        key = result_cache.get_cache_key(db, "sdos", "FOR  doc IN x", {"a": 1})
+        assert key.startswith(result_cache.CACHE_KEY_PREFIX)
+        assert key == result_cache.get_cache_key(db, "sdos", "FOR doc\nIN x", {"a": 1})
+        assert key != result_cache.get_cache_key(db, "sdos", "FOR doc IN x", {"a": 2})
+        assert result_cache.get_cache_key(db, None, "FOR doc IN x", {"a": 1}) is None
+        assert result_cache.get_cache_key(db, "export", "FOR doc IN x", {}) is None
+        db.collection.return_value.get.return_value = dict(generation=2)
+        assert key != result_cache.get_cache_key(db, "sdos", "FOR doc IN x", {"a": 1})
+
+
+def test_execute_query_uses_result_cache(lru_backend):
+    def make_helper():
+        helper = make_helper_with_mock_db(page="2")
+        helper.db.name = "some_database"
+        helper.db.has_collection.return_value = False
+        return helper
+
+    helper = make_helper()
+    response = helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="sdos")
+    assert response.data["objects"] == [{"id": "x--1"}]
+    assert response.data["total_results_count"] == 77
+
+    helper = make_helper()
+    cached_response = helper.execute_query(
+        "FOR doc IN x RETURN doc", {}, query_name="sdos"
+    )
+    helper.db.aql.execute.assert_not_called()
+    assert cached_response.data == response.data
+
+    # writes are never cached
+    helper = make_helper()
+    helper.execute_query("FOR doc IN x RETURN doc", {}, paginate=False)
+    helper.execute_query("FOR doc IN x RETURN doc", {}, paginate=False)
+    assert helper.db.aql.execute.call_count == 2
+
+
+def test_write_invalidates_cached_results(lru_backend):
+    helper = make_helper_with_mock_db()
+    helper.db.name = "some_database"
+    helper.db.has_collection.return_value = False
+    cursor = helper.db.aql.execute.return_value
+    helper.db.aql.execute.side_effect = lambda query, **kwargs: (
+        iter([1]) if "UPSERT" in query else cursor
+    )
+    with patch("dogesec_commons.objects.conf.RESULT_CACHE_GENERATION_TTL", 60):
+        helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="sdos")
+        helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="sdos")
+        assert helper.db.aql.execute.call_count == 1
+        assert result_cache.bump_generation(helper.db) == 1
+        helper.execute_query("FOR doc IN x RETURN doc", {}, query_name="sdos")
+    # query, bump, query again
+    assert helper.db.aql.execute.call_count == 3
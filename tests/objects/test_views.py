@@ -28,7 +28,7 @@ def test_sco_view_list_with_post_id(mock_get_scos):
     mock_get_scos.return_value = Response({"results": ["filtered-sco"]})
     request = factory.get("/api/objects/sco/?post_id=test123")
     response = SCOView.as_view({"get": "list"})(request)
-    mock_get_scos.assert_called_once_with(matcher={"_obstracts_post_id": "test123"})
+    mock_get_scos.assert_called_once_with()
     assert response == mock_get_scos.return_value
 
 
@@ -84,6 +84,24 @@ class SingleObjectsViewTest(URLPatternsTestCase):
         assert response.status_code == 404, "should fail because of bad stix_id"
 
 
+    @patch("dogesec_commons.objects.views.ArangoDBHelper.get_objects_by_ids")
+    def test_retrieve_multi(self, mock_get_objects_by_ids):
+        mock_get_objects_by_ids.return_value = Response()
+        url = '/objects/retrieve/'
+        stix_ids = [self.stix_id, "indicator--1", self.stix_id]
+        response = self.client.post(url, format='json', data=stix_ids, content_type="application/json")
+        mock_get_objects_by_ids.assert_called_once_with([self.stix_id, "indicator--1"])
+        assert response == mock_get_objects_by_ids.return_value
+
+    @patch("dogesec_commons.objects.views.ArangoDBHelper.get_objects_by_ids")
+    def test_retrieve_multi_bad_request(self, mock_get_objects_by_ids):
+        url = '/objects/retrieve/'
+        for data in [{"ids": [self.stix_id]}, [self.stix_id, 1], ["x--1"] * 11]:
+            with patch("dogesec_commons.objects.conf.MAXIMUM_RETRIEVE_IDS", 10):
+                response = self.client.post(url, format='json', data=data, content_type="application/json")
+            assert response.status_code == 400
+        mock_get_objects_by_ids.assert_not_called()
+
     @patch("dogesec_commons.objects.views.ArangoDBHelper.get_object_bundle")
     def test_bundle(self, mock_get_object_bundle):
         mock_get_object_bundle.return_value = Response()
@@ -113,4 +131,64 @@ class SingleObjectsViewTest(URLPatternsTestCase):
         mock_delete_report_objects.assert_called_once_with(report_id=report_id, object_ids=stix_ids)
         assert response == mock_delete_report_objects.return_value
 
-    
\ No newline at end of file
+    
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "view,method",
+    [
+        (SCOView, "get_scos"),
+        (SDOView, "get_sdos"),
+        (SMOView, "get_smos"),
+        (SROView, "get_sros"),
+    ],
+)
+def test_export_uses_export_helper(view, method):
+    with patch(
+        f"dogesec_commons.objects.views.ArangoDBHelper.{method}", autospec=True
+    ) as mock_get:
+        mock_get.return_value = Response({"results": []})
+        request = factory.get("/api/objects/xyz/export/?export_format=bundle")
+        response = view.as_view({"get": "export"})(request)
+        assert response == mock_get.return_value
+        helper = mock_get.call_args[0][0]
+        assert helper.export is True
+
+
+@pytest.mark.django_db
+@patch("dogesec_commons.objects.views.ArangoDBHelper.get_scos")
+def test_sco_view_export_with_post_id(mock_get_scos):
+    mock_get_scos.return_value = Response({"results": []})
+    request = factory.get("/api/objects/sco/export/?post_id=test123")
+    SCOView.as_view({"get": "export"})(request)
+    mock_get_scos.assert_called_once_with()
+
+
+@pytest.mark.django_db
+@patch("dogesec_commons.objects.views.ArangoDBHelper.resolve_external_ids")
+def test_sdo_view_resolve(mock_resolve):
+    mock_resolve.return_value = Response({"objects": {}, "missing": []})
+    request = factory.post(
+        "/api/objects/sdos/resolve/", ["T1047", "T1059", "T1047"], format="json"
+    )
+    response = SDOView.as_view({"post": "resolve"})(request)
+    assert response == mock_resolve.return_value
+    mock_resolve.assert_called_once_with(["T1047", "T1059"])
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"external_ids": ["T1047"]},
+        ["T1047", 1],
+        ["T1"] * 11,
+    ],
+)
+@patch("dogesec_commons.objects.views.ArangoDBHelper.resolve_external_ids")
+def test_sdo_view_resolve_bad_request(mock_resolve, data):
+    request = factory.post("/api/objects/sdos/resolve/", data, format="json")
+    with patch("dogesec_commons.objects.conf.MAXIMUM_RESOLVE_IDS", 10):
+        response = SDOView.as_view({"post": "resolve"})(request)
+    assert response.status_code == 400
+    mock_resolve.assert_not_called()
@@ -2,10 +2,12 @@ import time
 from django.conf import settings
 from django.http import HttpRequest
 import rest_framework.request
-from dogesec_commons.objects.db_view_creator import startup_func
+from dogesec_commons.objects import conf
+from dogesec_commons.objects.db_view_creator import link_one_collection
 from dogesec_commons.objects.helpers import ArangoDBHelper
 from stix2arango.stix2arango import Stix2Arango
 import contextlib
+from unittest.mock import MagicMock
 from arango.client import ArangoClient
 
 
@@ -34,16 +36,21 @@ def make_s2a_uploads(
     database = as_arango2stix_db(database)
 
     for collection, objects in uploads:
+        collection = as_arango2stix_collection(collection)
         s2a = Stix2Arango(
             database=database,
-            collection=as_arango2stix_collection(collection),
+            collection=collection,
             file="",
             host_url=settings.ARANGODB_HOST_URL,
             **kwargs,
         )
+        # linked before the upload, as stixifier does
+        for suffix in ["_edge_collection", "_vertex_collection"]:
+            link_one_collection(
+                s2a.arango.db, conf.ARANGODB_DATABASE_VIEW, collection + suffix
+            )
         s2a.run(data=dict(type="bundle", id="", objects=objects))
 
-    startup_func()
     time.sleep(1)
     yield s2a
 
@@ -72,6 +79,17 @@ def make_uploads(collection_name):
         transaction_db.abort_transaction()
 
 
+def make_helper_with_mock_db(**queries):
+    request = MagicMock()
+    request.query_params.dict.return_value = queries
+    helper = ArangoDBHelper("collection", request)
+    helper.db = MagicMock()
+    cursor = helper.db.aql.execute.return_value
+    cursor.__iter__.return_value = iter([{"id": "x--1"}])
+    cursor.statistics.return_value = {"fullCount": 77}
+    return helper
+
+
 def request_from_queries(**queries):
     r = rest_framework.request.Request(HttpRequest())
     r.query_params.update(queries)
@@ -197,11 +197,15 @@ def test_upload_to_arango(fake_file, fake_profile):
         patch(
             "dogesec_commons.stixifier.stixifier.db_view_creator.link_one_collection"
         ) as mock_link,
+        patch(
+            "dogesec_commons.stixifier.stixifier.result_cache.bump_generation"
+        ) as mock_bump_generation,
     ):
         mock_instance = mock_s2a.return_value
         processor.upload_to_arango()
         mock_instance.run.assert_called()
         assert mock_link.call_count == 2
+        mock_bump_generation.assert_called_once_with(mock_instance.arango.db)
         mock_s2a.assert_called_once_with(
             file=str(processor.bundle_file),
             database="test_dogesec_commons",